@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+"""
+Measure Change-Id throughput for bulk generation, in commits per second:
+
+    git     - one 'git hash-object -t commit --stdin' per commit, roughly
+              what get_change_id() costs for each commit (it also runs 'git
+              write-tree')
+    N       - ghlib.change_ids() with N worker processes (1 means no pool)
+
+Usage:
+
+    python bench/bench_chgid.py [-n COMMITS] [-r REPEAT] [--git N] \\
+        [WORKERS ...]
+
+COMMITS synthetic (tree, parent, author, committer, message) tuples are
+generated (default 20000). WORKERS are the pool sizes to try (default 1, 2,
+4, and the number of CPUs). The git baseline is timed on only the first N
+commits (default 200; 0 to skip it), since it is slow. Times are the best
+of REPEAT runs.
+"""
+import optparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'githooks'))
+import ghlib
+
+
+# -----------------------------------------------------------------------------
+def main(args):
+    """
+    Entry point
+    """
+    p = optparse.OptionParser(usage='%prog [-n COMMITS] [-r REPEAT] '
+                              '[--git N] [WORKERS ...]')
+    p.add_option('-n', '--commits',
+                 action='store', default=20000, dest='commits', type='int',
+                 help='number of commits to generate ids for')
+    p.add_option('-r', '--repeat',
+                 action='store', default=3, dest='repeat', type='int',
+                 help='runs per measurement (best is reported)')
+    p.add_option('--git',
+                 action='store', default=200, dest='git', type='int',
+                 help='commits to time the one-git-per-commit baseline on')
+    (o, a) = p.parse_args(args)
+    import multiprocessing
+    ncpu = multiprocessing.cpu_count()
+    workers = [int(x) for x in a[1:]] or sorted(set([1, 2, 4, ncpu]))
+
+    items = make_items(o.commits)
+    exp = ghlib.change_ids(items)
+    sys.stdout.write('%d commits, %d CPUs\n' % (len(items), ncpu))
+    sys.stdout.write('%8s %12s %14s\n' % ('workers', 'time (ms)',
+                                          'commits/sec'))
+    if 0 < o.git:
+        some = items[:o.git]
+        elapsed = best_of(o.repeat, lambda: by_git(some))
+        sys.stdout.write('%8s %12.1f %14.0f\n' %
+                         ('git', 1000.0 * elapsed, len(some) / elapsed))
+    for n in workers:
+        r = []
+        elapsed = best_of(o.repeat,
+                          lambda: r.append(ghlib.change_ids(items, n)))
+        assert r[-1] == exp
+        sys.stdout.write('%8d %12.1f %14.0f\n' %
+                         (n, 1000.0 * elapsed, len(items) / elapsed))
+
+
+# -----------------------------------------------------------------------------
+def best_of(repeat, func):
+    """
+    Run *func* *repeat* times and return the best wall time in seconds
+    """
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    return min(times)
+
+
+# -----------------------------------------------------------------------------
+def by_git(items):
+    """
+    Hash each of *items* by running git
+    """
+    for (tree, parent, author, committer, msg) in items:
+        text = ghlib.commit_header(tree, parent, author, committer)
+        r = ghlib.catch_stdout('git hash-object -t commit --stdin',
+                               input=text + '\n'.join(msg))
+        assert not r.startswith('ERR:'), r
+
+
+# -----------------------------------------------------------------------------
+def make_items(count):
+    """
+    Return *count* synthetic change_id_for() argument tuples forming a
+    linear history with messages of a few lines
+    """
+    rval = []
+    parent = None
+    for n in range(count):
+        who = 'Dev %d <dev%d@example.com> %d +0000' % (n % 7, n % 7,
+                                                      1400000000 + 60 * n)
+        msg = ['Change number %d' % n,
+               '',
+               ' - touches file%d.py' % (n % 97),
+               ' - and some others',
+               '',
+               'Version:   2015.%04d.%d' % (n // 100, n % 100)]
+        rval.append(('%040x' % (n * 7919), parent, who, who, msg))
+        parent = '%040x' % (n * 104729)
+    return rval
+
+
+# -----------------------------------------------------------------------------
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+"""
+Compare reading the index file in Python (gitindex) with asking git, on
+synthetic indexes of increasing size:
+
+    lookup  - the blob id of pkg/version.py: ghlib.index_oid() against
+              'git ls-files -s' limited to that path
+    search  - the tracked files named version.py: ghlib.version_indexed()
+              against 'git ls-files' with a '**/version.py' pathspec
+    tree    - the tree id of the index: gitindex.tree_id() against 'git
+              write-tree'
+
+Usage:
+
+    python bench/bench_index.py [-r REPEAT] [SIZE ...]
+
+Each SIZE is a number of index entries (default 1000 10000 50000 200000).
+The entries are added with 'git update-index --index-info', so no files are
+written to the working tree, and the index is committed and then one
+directory's entry changed, so tree_id() has a cached tree for all but one
+directory, as it would in a typical commit. gitindex.MAX_BYTES is lifted so
+the Python side is timed whatever the size; the table shows the index size
+in bytes to compare with it. Times are the best of REPEAT runs, in
+milliseconds.
+"""
+import optparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'githooks'))
+import ghlib
+import gitindex
+
+
+# -----------------------------------------------------------------------------
+def main(args):
+    """
+    Entry point
+    """
+    p = optparse.OptionParser(usage='%prog [-r REPEAT] [SIZE ...]')
+    p.add_option('-r', '--repeat',
+                 action='store', default=5, dest='repeat', type='int',
+                 help='runs per measurement (best is reported)')
+    (o, a) = p.parse_args(args)
+    sizes = [int(x) for x in a[1:]] or [1000, 10000, 50000, 200000]
+    gitindex.MAX_BYTES = None
+
+    sys.stdout.write('%8s %10s  %-17s %-17s %-17s\n' %
+                     ('entries', 'bytes', 'lookup py/git', 'search py/git',
+                      'tree py/git'))
+    for size in sizes:
+        top = tempfile.mkdtemp(prefix='bench_index.')
+        start = os.getcwd()
+        try:
+            make_repo(top, size)
+            os.chdir(top)
+            row = [size, os.path.getsize(os.path.join('.git', 'index'))]
+            for (py, git) in [(py_lookup, git_lookup),
+                              (py_search, git_search),
+                              (py_tree, git_tree)]:
+                row.append(best_of(o.repeat, py))
+                row.append(best_of(o.repeat, git))
+        finally:
+            os.chdir(start)
+            shutil.rmtree(top)
+        sys.stdout.write('%8d %10d  %7.1f %7.1f   %7.1f %7.1f   '
+                         '%7.1f %7.1f\n' % tuple(row))
+
+
+# -----------------------------------------------------------------------------
+def best_of(repeat, func):
+    """
+    Run *func* *repeat* times, starting each run afresh, and return the best
+    wall time in milliseconds
+    """
+    times = []
+    for i in range(repeat):
+        ghlib.memo_reset()
+        start = time.time()
+        assert func()
+        times.append(time.time() - start)
+    return 1000.0 * min(times)
+
+
+# -----------------------------------------------------------------------------
+def git_lookup():
+    """
+    Ask git for pkg/version.py's index entry
+    """
+    r = ghlib.catch_stdout('git ls-files -s -- ":(top,literal)pkg/version.py"')
+    return r.split()[1]
+
+
+# -----------------------------------------------------------------------------
+def git_search():
+    """
+    Ask git for the tracked files named version.py
+    """
+    return ghlib.version_candidates([''], [], '--cached')
+
+
+# -----------------------------------------------------------------------------
+def git_tree():
+    """
+    Have git write the tree
+    """
+    return ghlib.catch_stdout('git write-tree').strip()
+
+
+# -----------------------------------------------------------------------------
+def make_repo(top, size):
+    """
+    Create a repo at *top* whose index has *size* entries spread over
+    subdirectories plus pkg/version.py, committed, with one entry changed
+    since
+    """
+    start = os.getcwd()
+    os.chdir(top)
+    try:
+        ghlib.catch_stdout('git init -q')
+        blob = ghlib.catch_stdout('git hash-object -w --stdin',
+                                  input='file\n').strip()
+        vblob = ghlib.catch_stdout('git hash-object -w --stdin',
+                                   input='__version__ = "2015.0820"\n')
+        lines = ['100644 %s\tpkg/version.py\n' % vblob.strip()]
+        for n in range(size):
+            lines.append('100644 %s\tsrc/d%03d/f%06d.txt\n' %
+                         (blob, n % 100, n))
+        ghlib.catch_stdout('git update-index --index-info',
+                           input=''.join(lines))
+        ghlib.catch_stdout('git commit -q -m "initial"')
+        other = ghlib.catch_stdout('git hash-object -w --stdin',
+                                   input='changed\n').strip()
+        ghlib.catch_stdout('git update-index --cacheinfo '
+                           '100644,%s,src/d000/f000000.txt' % other)
+    finally:
+        os.chdir(start)
+
+
+# -----------------------------------------------------------------------------
+def py_lookup():
+    """
+    Read pkg/version.py's blob id from the index file
+    """
+    return ghlib.index_oid('pkg/version.py')
+
+
+# -----------------------------------------------------------------------------
+def py_search():
+    """
+    Find the tracked files named version.py in the index file
+    """
+    return ghlib.version_indexed([''], [])
+
+
+# -----------------------------------------------------------------------------
+def py_tree():
+    """
+    Work out the tree id from the index file
+    """
+    return gitindex.tree_id(os.path.join('.git', 'index'))
+
+
+# -----------------------------------------------------------------------------
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+"""
+Compare the cost of deciding whether version.py is staged two ways, on
+synthetic repositories of increasing size:
+
+    status  - 'git status --porc' over the whole repo, then a substring match
+              on each line (what pre-commit.ver used to do)
+    diff    - 'git diff-index --cached' limited to version.py (what it does
+              now)
+
+Usage:
+
+    python bench/bench_staged.py [-r REPEAT] [SIZE ...]
+
+Each SIZE is a number of tracked files (default 100 1000 10000). Each repo
+also gets SIZE/10 untracked files, which 'git status' has to find and 'git
+diff-index' doesn't. Times are the best of REPEAT runs, in milliseconds.
+"""
+import optparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'githooks'))
+import ghlib
+
+
+# -----------------------------------------------------------------------------
+def main(args):
+    """
+    Entry point
+    """
+    p = optparse.OptionParser(usage='%prog [-r REPEAT] [SIZE ...]')
+    p.add_option('-r', '--repeat',
+                 action='store', default=5, dest='repeat', type='int',
+                 help='runs per measurement (best is reported)')
+    (o, a) = p.parse_args(args)
+    sizes = [int(x) for x in a[1:]] or [100, 1000, 10000]
+
+    sys.stdout.write('%8s %12s %12s\n' % ('files', 'status (ms)', 'diff (ms)'))
+    for size in sizes:
+        top = tempfile.mkdtemp(prefix='bench_staged.')
+        try:
+            make_repo(top, size)
+            start = os.getcwd()
+            os.chdir(top)
+            try:
+                old = best_of(o.repeat, by_status)
+                new = best_of(o.repeat, by_diff)
+            finally:
+                os.chdir(start)
+        finally:
+            shutil.rmtree(top)
+        sys.stdout.write('%8d %12.1f %12.1f\n' % (size, old, new))
+
+
+# -----------------------------------------------------------------------------
+def best_of(repeat, func):
+    """
+    Run *func* *repeat* times, check that it says version.py is staged, and
+    return the best wall time in milliseconds
+    """
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        staged = func()
+        times.append(time.time() - start)
+        assert staged
+    return 1000.0 * min(times)
+
+
+# -----------------------------------------------------------------------------
+def by_diff():
+    """
+    The pathspec-limited index-vs-HEAD check
+    """
+    r = ghlib.catch_stdout('git diff-index --cached --name-only -z HEAD -- '
+                           '":(top,literal)pkg/version.py"')
+    return 'pkg/version.py' in r.split('\0')
+
+
+# -----------------------------------------------------------------------------
+def by_status():
+    """
+    The whole-repo 'git status' scan
+    """
+    r = ghlib.catch_stdout('git status --porc')
+    staged = False
+    for line in r.split('\n'):
+        if 'pkg/version.py' in line and line.startswith(("M  ", "A  ")):
+            staged = True
+    return staged
+
+
+# -----------------------------------------------------------------------------
+def make_repo(top, size):
+    """
+    Create a repo at *top* with *size* tracked files spread over
+    subdirectories, one commit, a staged change to pkg/version.py, and some
+    untracked files
+    """
+    start = os.getcwd()
+    os.chdir(top)
+    try:
+        ghlib.catch_stdout('git init -q')
+        os.mkdir('pkg')
+        write('pkg/version.py', '__version__ = "2015.0820"\n')
+        for n in range(size):
+            d = os.path.join('src', 'd%03d' % (n % 100))
+            if not os.path.isdir(d):
+                os.makedirs(d)
+            write(os.path.join(d, 'f%06d.txt' % n), 'file %d\n' % n)
+        ghlib.catch_stdout('git add -A')
+        ghlib.catch_stdout('git commit -q -m "initial"')
+        for n in range(size // 10):
+            write(os.path.join('src', 'untracked%06d.txt' % n), 'junk\n')
+        write('pkg/version.py', '__version__ = "2015.0820.1"\n')
+        ghlib.catch_stdout('git add pkg/version.py')
+    finally:
+        os.chdir(start)
+
+
+# -----------------------------------------------------------------------------
+def write(path, data):
+    """
+    Write *data* to the file at *path*
+    """
+    f = open(path, 'w')
+    f.write(data)
+    f.close()
+
+
+# -----------------------------------------------------------------------------
+if __name__ == '__main__':
+    main(sys.argv)
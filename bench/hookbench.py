@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+"""
+Run each hook end to end against a synthetic git repository and report how
+long it takes, how many git processes it starts, and its peak memory use.
+
+Usage:
+
+    python bench/hookbench.py [options]
+
+Options set the shape of the repository (--files, --depth, --history,
+--tags) and how many times each hook is run (--repeat; the best wall time is
+reported). With --save FILE, the results are written to FILE as JSON. With
+--check FILE, they are compared to results saved earlier and the exit status
+is 1 if any hook got slower (by more than --tolerance), started more git
+processes, used more memory (by more than --tolerance), or exited
+differently.
+
+bench/baseline.json holds results for the default repository shape. Times
+and memory use depend on the host, so to check against it elsewhere, give a
+--tolerance large enough to compare only git process counts and exit
+statuses, as tests/test_hookbench.py does:
+
+    python bench/hookbench.py -r 1 --tolerance 1000 --check bench/baseline.json
+
+On the host that saved it (or after saving your own), the default tolerance
+catches slowdowns too.
+
+Git processes are counted by running the hooks a second time with a 'git'
+wrapper at the front of $PATH, so the wrapper doesn't affect the timings.
+"""
+import json
+import optparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HOOKDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       '..', 'githooks')
+sys.path.insert(0, HOOKDIR)
+import ghlib
+
+HOOKS = ['commit-msg.chgid', 'commit-msg.ver', 'commit-msg.vc',
+         'pre-commit.ver']
+
+MESSAGE = """Synthetic commit for benchmarking
+
+ - the body has a few lines
+ - so the hooks have something to parse
+# Please enter the commit message for your changes. Lines starting
+# with '#' will be ignored, and an empty message aborts the commit.
+"""
+
+
+# -----------------------------------------------------------------------------
+def main(args):
+    """
+    Entry point
+    """
+    p = optparse.OptionParser(usage='%prog [options]')
+    p.add_option('--files',
+                 action='store', default=1000, dest='files', type='int',
+                 help='number of tracked files')
+    p.add_option('--depth',
+                 action='store', default=3, dest='depth', type='int',
+                 help='directory nesting depth')
+    p.add_option('--history',
+                 action='store', default=100, dest='history', type='int',
+                 help='number of commits')
+    p.add_option('--tags',
+                 action='store', default=5, dest='tags', type='int',
+                 help='number of annotated tags spread over the history')
+    p.add_option('-r', '--repeat',
+                 action='store', default=5, dest='repeat', type='int',
+                 help='runs per hook (best wall time is reported)')
+    p.add_option('--save',
+                 action='store', default=None, dest='save',
+                 help='write results to this JSON file')
+    p.add_option('--check',
+                 action='store', default=None, dest='check',
+                 help='compare results to this JSON file')
+    p.add_option('--tolerance',
+                 action='store', default=0.25, dest='tolerance', type='float',
+                 help='allowed fractional increase in time and memory')
+    (o, a) = p.parse_args(args)
+
+    shape = {'files': o.files, 'depth': o.depth, 'history': o.history,
+             'tags': o.tags}
+    top = tempfile.mkdtemp(prefix='hookbench.')
+    try:
+        make_repo(top, **shape)
+        results = {}
+        for hook in HOOKS:
+            results[hook] = measure(top, hook, o.repeat)
+    finally:
+        shutil.rmtree(top)
+
+    report(results)
+    if o.save:
+        f = open(o.save, 'w')
+        json.dump({'shape': shape, 'results': results}, f, indent=2,
+                  separators=(',', ': '), sort_keys=True)
+        f.write('\n')
+        f.close()
+    if o.check:
+        f = open(o.check, 'r')
+        baseline = json.load(f)
+        f.close()
+        if baseline['shape'] != shape:
+            sys.exit('%s was made with a different repo shape: %s' %
+                     (o.check, baseline['shape']))
+        problems = compare(baseline['results'], results, o.tolerance)
+        for line in problems:
+            sys.stdout.write('REGRESSION: %s\n' % line)
+        if problems:
+            sys.exit(1)
+
+
+# -----------------------------------------------------------------------------
+def compare(baseline, results, tolerance):
+    """
+    Return a list of descriptions of the ways *results* are worse than
+    *baseline*
+    """
+    rval = []
+    for hook in HOOKS:
+        (old, new) = (baseline.get(hook), results[hook])
+        if old is None:
+            continue
+        if new['wall_ms'] > old['wall_ms'] * (1 + tolerance):
+            rval.append('%s wall time %.1f ms, was %.1f ms' %
+                        (hook, new['wall_ms'], old['wall_ms']))
+        if new['git_procs'] > old['git_procs']:
+            rval.append('%s started %d git processes, was %d' %
+                        (hook, new['git_procs'], old['git_procs']))
+        if new['maxrss_kb'] > old['maxrss_kb'] * (1 + tolerance):
+            rval.append('%s peak RSS %d KB, was %d KB' %
+                        (hook, new['maxrss_kb'], old['maxrss_kb']))
+        if new['status'] != old['status']:
+            rval.append('%s exited %d, was %d' %
+                        (hook, new['status'], old['status']))
+    return rval
+
+
+# -----------------------------------------------------------------------------
+def git(args):
+    """
+    Run git with *args* in the current directory, exiting on failure
+    """
+    r = ghlib.catch_stdout('git ' + args)
+    if r.startswith('ERR:'):
+        sys.exit('git %s failed: %s' % (args, r[4:]))
+    return r
+
+
+# -----------------------------------------------------------------------------
+def git_wrapper(logfile):
+    """
+    Create a directory holding a 'git' script that records each run in
+    *logfile* before running the real git. Return the directory.
+    """
+    real = None
+    for d in os.getenv('PATH', '').split(os.pathsep):
+        if os.access(os.path.join(d, 'git'), os.X_OK):
+            real = os.path.join(d, 'git')
+            break
+    wdir = tempfile.mkdtemp(prefix='hookbench-git.')
+    path = os.path.join(wdir, 'git')
+    write(path, '#!/bin/sh\necho "$*" >> "%s"\nexec "%s" "$@"\n' %
+          (logfile, real))
+    os.chmod(path, 0o755)
+    return wdir
+
+
+# -----------------------------------------------------------------------------
+def make_repo(top, files, depth, history, tags):
+    """
+    Create a repo at *top* with *files* tracked files nested *depth*
+    directories deep, *history* commits, and *tags* annotated tags spread
+    evenly over the history. Leave version.py updated and staged so that
+    pre-commit.ver is satisfied.
+    """
+    start = os.getcwd()
+    os.chdir(top)
+    try:
+        git('init -q')
+        write('version.py', '__version__ = "2015.0001"\n')
+        for n in range(files):
+            parts = ['d%d' % ((n // 10 ** k) % 10) for k in range(depth)]
+            d = os.path.join(*parts) if parts else '.'
+            if not os.path.isdir(d):
+                os.makedirs(d)
+            write(os.path.join(d, 'f%06d.txt' % n), 'file %d\n' % n)
+        git('add -A')
+        git('commit -q -m "commit 0"')
+        every = max(1, history // max(1, tags))
+        ntags = 0
+        for n in range(history):
+            if 0 < n:
+                git('commit -q --allow-empty -m "commit %d"' % n)
+            if n % every == 0 and ntags < tags:
+                ntags += 1
+                git('tag -a -m "tag" 2015.%04d' % ntags)
+        ghlib.memo_reset()
+        (g_full, g_head, g_tail) = ghlib.git_describe_ht()
+        write('version.py', '__version__ = "%s.%d"\n' %
+              (g_head or '2015.0001', g_tail + 1))
+        git('add version.py')
+    finally:
+        os.chdir(start)
+
+
+# -----------------------------------------------------------------------------
+def measure(top, hook, repeat):
+    """
+    Run *hook* *repeat* times in *top* and return a dict of the best wall
+    time (ms), the peak RSS (KB), the number of git processes one run starts,
+    and the exit status
+    """
+    cmd = [os.path.join(HOOKDIR, hook)]
+    msgfile = os.path.join(top, '.git', 'COMMIT_EDITMSG')
+    if hook.startswith('commit-msg'):
+        cmd.append(msgfile)
+    env = dict(os.environ)
+
+    times = []
+    maxrss = 0
+    for i in range(repeat):
+        write(msgfile, MESSAGE)
+        (status, elapsed, rss) = run(cmd, top, env)
+        times.append(elapsed)
+        maxrss = max(maxrss, rss)
+
+    logfile = os.path.join(top, '.git', 'hookbench-git.log')
+    wdir = git_wrapper(logfile)
+    try:
+        write(msgfile, MESSAGE)
+        write(logfile, '')
+        env['PATH'] = wdir + os.pathsep + env.get('PATH', '')
+        run(cmd, top, env)
+        f = open(logfile, 'r')
+        procs = len(f.readlines())
+        f.close()
+    finally:
+        shutil.rmtree(wdir)
+        os.unlink(logfile)
+
+    return {'wall_ms': round(1000.0 * min(times), 1),
+            'maxrss_kb': maxrss,
+            'git_procs': procs,
+            'status': status}
+
+
+# -----------------------------------------------------------------------------
+def report(results):
+    """
+    Write a table of *results* to stdout
+    """
+    sys.stdout.write('%-18s %10s %10s %12s %7s\n' %
+                     ('hook', 'wall (ms)', 'git procs', 'maxrss (KB)',
+                      'status'))
+    for hook in HOOKS:
+        r = results[hook]
+        sys.stdout.write('%-18s %10.1f %10d %12d %7d\n' %
+                         (hook, r['wall_ms'], r['git_procs'], r['maxrss_kb'],
+                          r['status']))
+
+
+# -----------------------------------------------------------------------------
+def run(cmd, cwd, env):
+    """
+    Run *cmd* in *cwd* with environment *env*. Return its exit status, wall
+    time in seconds, and peak RSS in KB.
+    """
+    out = open(os.devnull, 'w')
+    start = time.time()
+    p = subprocess.Popen(cmd, cwd=cwd, env=env, stdout=out,
+                         stderr=subprocess.STDOUT)
+    (pid, status, usage) = os.wait4(p.pid, 0)
+    elapsed = time.time() - start
+    p.returncode = os.WEXITSTATUS(status)
+    out.close()
+    return (p.returncode, elapsed, usage.ru_maxrss)
+
+
+# -----------------------------------------------------------------------------
+def write(path, data):
+    """
+    Write *data* to the file at *path*
+    """
+    f = open(path, 'w')
+    f.write(data)
+    f.close()
+
+
+# -----------------------------------------------------------------------------
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""
+Report how long it takes to import a hook module, and what it pulls in, in
+the spirit of 'python -X importtime' (which Python 2 doesn't have).
+
+Usage:
+
+    python bench/importtime.py [-n RUNS] [--json] [MODULE]
+
+MODULE (default 'dispatch', the entry point for all the hooks) is imported
+from the githooks directory in a fresh interpreter RUNS times. The report
+gives the best total import time and, for the fastest run, the time spent in
+each module that was loaded, excluding the modules it imported in turn.
+With --json, the report is written as a JSON object instead of a table.
+"""
+import ast
+import json
+import optparse
+import os
+import subprocess
+import sys
+
+HOOKDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       '..', 'githooks')
+
+# Run with 'python -c' in a fresh interpreter to time the import of the module
+# named by sys.argv[2] from directory sys.argv[1] and each module it loads.
+# It imports nothing beyond sys and time itself, so that everything the hook
+# module needs is counted, and writes its results as a Python literal.
+CHILD = """
+import sys, time
+try:
+    import __builtin__ as builtins
+except ImportError:
+    import builtins
+real_import = builtins.__import__
+times = {}
+stack = []
+def timed_import(name, *args, **kwargs):
+    if name in sys.modules:
+        return real_import(name, *args, **kwargs)
+    stack.append(0.0)
+    start = time.time()
+    try:
+        return real_import(name, *args, **kwargs)
+    finally:
+        elapsed = time.time() - start
+        inner = stack.pop()
+        if stack:
+            stack[-1] += elapsed
+        times[name] = times.get(name, 0.0) + elapsed - inner
+sys.path.insert(0, sys.argv[1])
+before = set(sys.modules)
+builtins.__import__ = timed_import
+start = time.time()
+__import__(sys.argv[2])
+total = time.time() - start
+builtins.__import__ = real_import
+sys.stdout.write(repr({'total_ms': 1000.0 * total,
+                       'self_ms': dict([(k, 1000.0 * v)
+                                        for (k, v) in times.items()]),
+                       'loaded': sorted(set(sys.modules) - before)}))
+"""
+
+
+# -----------------------------------------------------------------------------
+def main(args):
+    """
+    Entry point
+    """
+    p = optparse.OptionParser(usage='%prog [-n RUNS] [--json] [MODULE]')
+    p.add_option('-n', '--runs',
+                 action='store', default=5, dest='runs', type='int',
+                 help='number of fresh interpreters to measure')
+    p.add_option('--json',
+                 action='store_true', default=False, dest='json',
+                 help='write the report as JSON')
+    (o, a) = p.parse_args(args)
+    module = a[1] if 1 < len(a) else 'dispatch'
+
+    result = measure(module, o.runs)
+    if o.json:
+        json.dump(result, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        report(result)
+
+
+# -----------------------------------------------------------------------------
+def measure(module, runs):
+    """
+    Import *module* in *runs* fresh interpreters and return the report for
+    the fastest: {'module', 'runs', 'total_ms', 'self_ms', 'loaded'}
+    """
+    best = None
+    for i in range(runs):
+        p = subprocess.Popen([sys.executable, '-c', CHILD, HOOKDIR, module],
+                             stdout=subprocess.PIPE)
+        (out, err) = p.communicate()
+        if p.returncode != 0:
+            sys.exit('importing %s failed' % module)
+        r = ast.literal_eval(out.decode() if bytes is not str else out)
+        if best is None or r['total_ms'] < best['total_ms']:
+            best = r
+    best['module'] = module
+    best['runs'] = runs
+    return best
+
+
+# -----------------------------------------------------------------------------
+def report(result):
+    """
+    Write a table of *result* to stdout, slowest modules first
+    """
+    sys.stdout.write('import %s: %.2f ms (best of %d), %d modules loaded\n' %
+                     (result['module'], result['total_ms'], result['runs'],
+                      len(result['loaded'])))
+    sys.stdout.write('%10s  %s\n' % ('self (ms)', 'module'))
+    for (name, ms) in sorted(result['self_ms'].items(),
+                             key=lambda x: -x[1]):
+        sys.stdout.write('%10.3f  %s\n' % (ms, name))
+
+
+# -----------------------------------------------------------------------------
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+"""
+Check the versions recorded in a range of commits
+
+Usage:
+
+    audit.py [options] [RANGE]
+
+RANGE is anything 'git rev-list' accepts (default HEAD). For each commit in
+it, audit.py reads version.py as committed and reports
+
+ - a Version: trailer that doesn't match it, and
+ - a version that isn't one past what git describe says about the commit's
+   first parent (unless it starts a new head), which is what pre-commit.ver
+   checks at commit time.
+
+Each problem is written to stdout as the commit id followed by what's wrong,
+and the exit status is 1 if there were any.
+
+The history is read from one 'git log', version.py's blob ids are asked for
+in batches of one 'git cat-file --batch-check' process, each distinct
+version.py is read and parsed once, and the describe answers come from one
+TagIndex, carried from parent to child along runs of history without merges
+or tags. So auditing a branch costs about as much as reading its log, not a
+git describe per commit.
+"""
+import ghlib
+import optparse
+import os
+import sys
+
+# Commits whose version.py blob ids are asked for in one round trip
+CHUNK = 500
+
+
+# -----------------------------------------------------------------------------
+def main(args):
+    """
+    Entry point
+    """
+    p = optparse.OptionParser(usage='%prog [options] [RANGE]')
+    p.add_option('-d', '--debug',
+                 action='store_true', default=False, dest='debug',
+                 help='run the debugger')
+    p.add_option('--no-increment',
+                 action='store_false', default=True, dest='increment',
+                 help="don't check versions against git describe")
+    p.add_option('--require-trailer',
+                 action='store_true', default=False, dest='require',
+                 help='report commits without a Version: line')
+    (o, a) = p.parse_args(args)
+    if o.debug:
+        import pdb
+        pdb.set_trace()
+    revs = ' '.join(a[1:]) or 'HEAD'
+
+    auditor = Auditor(increment=o.increment, require_trailer=o.require)
+    try:
+        for (oid, problem) in auditor.audit(revs):
+            sys.stdout.write('%s %s\n' % (oid, problem))
+    except ValueError as e:
+        sys.exit('audit: %s' % e)
+    sys.stderr.write('audit: %d commits, %d problems\n' %
+                     (auditor.commits, auditor.problems))
+    if auditor.problems:
+        sys.exit(1)
+
+
+# -----------------------------------------------------------------------------
+def chunked(items, size):
+    """
+    Generate lists of up to *size* of *items* at a time
+    """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if size <= len(chunk):
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# -----------------------------------------------------------------------------
+def tips(revs):
+    """
+    Return the ids of the commits *revs* starts from (the ones not excluded
+    with ^ or ..)
+    """
+    r = ghlib.catch_stdout('git rev-parse %s' % revs)
+    if r.startswith('ERR:'):
+        return []
+    return [x for x in r.split() if not x.startswith('^')]
+
+
+# -----------------------------------------------------------------------------
+class Auditor(object):
+    """
+    Checks commits' versions, remembering the versions it has parsed and the
+    describe answers it has worked out, and counting what it has seen
+    """
+    # -------------------------------------------------------------------------
+    def __init__(self, increment=True, require_trailer=False):
+        """
+        Set up to check versions against git describe if *increment* and to
+        report missing Version: lines if *require_trailer*
+        """
+        self.increment = increment
+        self.require_trailer = require_trailer
+        facts = ghlib.repo_facts()
+        self.vrel = os.path.relpath(ghlib.get_version_path(),
+                                    facts.toplevel or '.')
+        self.vrel = self.vrel.replace(os.sep, '/')
+        self.index = ghlib.TagIndex()
+        self.described = {}
+        self.versions = {}
+        self.commits = 0
+        self.problems = 0
+
+    # -------------------------------------------------------------------------
+    def audit(self, revs):
+        """
+        Generate (commit id, problem) for the commits in *revs*, oldest first
+        """
+        if self.increment:
+            for tip in tips(revs):
+                self.index.load(tip)
+        for chunk in chunked(ghlib.log_commits(revs), CHUNK):
+            for (oid, parents, lines, vs) in self.with_versions(chunk):
+                self.commits += 1
+                for problem in self.check(parents, lines, vs):
+                    self.problems += 1
+                    yield (oid, problem)
+
+    # -------------------------------------------------------------------------
+    def check(self, parents, lines, vs):
+        """
+        Return a list of what's wrong with a commit with *parents* and
+        message *lines* whose version.py declares *vs* (None if it has no
+        version)
+        """
+        (payload, version, cid, comments) = ghlib.split_msg(lines)
+        trailer = version.replace('Version:', '').strip()
+        rval = []
+        if vs is None:
+            if trailer:
+                rval.append('Version: %s, but no version in %s' %
+                            (trailer, self.vrel))
+            return rval
+        if trailer and trailer != vs:
+            rval.append('Version: %s, but %s has %s' %
+                        (trailer, self.vrel, vs))
+        elif not trailer and self.require_trailer:
+            rval.append('no Version: line (%s has %s)' % (self.vrel, vs))
+
+        if self.increment and parents:
+            try:
+                (v_full, v_head, v_tail) = ghlib.get_version_ht(vs)
+            except ValueError:
+                return rval
+            (tag, distance) = self.describe(parents[0])
+            if tag == v_head and v_tail != distance + 1:
+                rval.append('%s has %s, should be %s.%d' %
+                            (self.vrel, vs, v_head, distance + 1))
+        return rval
+
+    # -------------------------------------------------------------------------
+    def describe(self, oid):
+        """
+        Return (tag, distance) for commit *oid* as TagIndex.describe() would.
+        A commit with one parent and no tag is one further from its parent's
+        tag than the parent, which saves walking history again for it.
+        """
+        if oid not in self.described:
+            self.index.load(oid)
+            parents = self.index.parents.get(oid, [])
+            if oid in self.index.tags:
+                self.described[oid] = (self.index.tags[oid][0][1], 0)
+            elif len(parents) == 1 and parents[0] in self.described:
+                (tag, distance) = self.described[parents[0]]
+                self.described[oid] = (tag, distance + 1 if tag else 0)
+            else:
+                self.described[oid] = self.index.describe(oid)
+        return self.described[oid]
+
+    # -------------------------------------------------------------------------
+    def version(self, reply):
+        """
+        Return the version in the version.py blob named by 'git cat-file
+        --batch-check' (or 'git rev-parse') output *reply*, or None if there
+        isn't one. Each blob is only parsed once.
+        """
+        if reply.startswith('ERR:') or reply.endswith(' missing'):
+            return None
+        blob = reply.split()[0]
+        if blob not in self.versions:
+            text = ghlib.cat_file(blob)
+            if text.startswith('ERR:'):
+                self.versions[blob] = None
+            else:
+                self.versions[blob] = ghlib.version_from_file(self.vrel,
+                                                              text)
+        return self.versions[blob]
+
+    # -------------------------------------------------------------------------
+    def with_versions(self, commits):
+        """
+        Generate (oid, parents, lines, version) for each of *commits* (as
+        ghlib.log_commits() generates them), looking up all their version.py
+        blobs at once
+        """
+        queries = ['%s:%s' % (c[0], self.vrel) for c in commits]
+        replies = ghlib.git_batch_many('git cat-file --batch-check', queries)
+        if replies is None:
+            replies = [ghlib.catch_stdout('git rev-parse -q --verify "%s"' % q)
+                       for q in queries]
+        for (commit, reply) in zip(commits, replies):
+            yield commit + (self.version(reply),)
+
+
+# -----------------------------------------------------------------------------
+if __name__ == '__main__':
+    main(sys.argv)
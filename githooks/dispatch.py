@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+"""
+Common entry point for the hooks in this directory
+
+commit-msg.chgid, commit-msg.ver, commit-msg.vc, and pre-commit.ver are thin
+wrappers that call main() here with their own behavior, so a copy of one
+does the same thing whatever it's named. When dispatch.py itself is the
+hook, which behavior runs is decided by, in order,
+
+ - $GITHOOKS_BEHAVIOR, if set to one of the names in BEHAVIORS,
+ - the name the hook was invoked by (e.g., commit-msg.vc),
+ - the name of the file it is a symlink to, so that .git/hooks/commit-msg
+   can point at commit-msg.ver, or
+ - DEFAULTS, keyed on the git hook name (commit-msg or pre-commit).
+
+optparse is loaded only if there are options to parse and pdb only when the
+debugger is asked for, since most hook runs need neither.
+
+If a ghdaemon is running for the repository, what it knows is loaded into
+ghlib's memo before the hook runs (see ghclient). Set $GITHOOKS_NO_DAEMON to
+skip that.
+"""
+import ghclient
+import ghlib
+import os
+import sys
+
+# Hook behaviors by name: (function, arguments after argv)
+BEHAVIORS = {
+    'commit-msg.chgid': ('commit_msg', (False, True)),
+    'commit-msg.ver': ('commit_msg', (True, False)),
+    'commit-msg.vc': ('commit_msg', (True, True)),
+    'pre-commit.ver': ('pre_commit', ()),
+}
+
+# Behavior to use when the hook is invoked by its bare git name
+DEFAULTS = {
+    'commit-msg': 'commit-msg.vc',
+    'pre-commit': 'pre-commit.ver',
+}
+
+
+# -----------------------------------------------------------------------------
+def main(args, name=None):
+    """
+    Entry point. Run behavior *name*, or if it isn't given, the one
+    behavior() picks for the name we were run by.
+    """
+    if name is None:
+        name = behavior(args[0])
+    if name is None:
+        sys.exit("githooks: can't tell which hook to run as %s" % args[0])
+    (func, extra) = BEHAVIORS[name]
+    if not os.getenv('GITHOOKS_NO_DAEMON'):
+        ghclient.prime()
+    globals()[func](args, *extra)
+
+
+# -----------------------------------------------------------------------------
+def behavior(argv0):
+    """
+    Return the name of the behavior to run for a hook invoked as *argv0*, or
+    None if there's no way to tell
+    """
+    rval = os.getenv('GITHOOKS_BEHAVIOR')
+    if rval in BEHAVIORS:
+        return rval
+    name = os.path.basename(argv0)
+    if name in BEHAVIORS:
+        return name
+    real = os.path.basename(os.path.realpath(argv0))
+    if real in BEHAVIORS:
+        return real
+    return DEFAULTS.get(name)
+
+
+# -----------------------------------------------------------------------------
+def check_increment(vfname, version_ht):
+    """
+    Exit with a message unless version (full, head, tail) *version_ht* is one
+    past what git describe says, or starts a new head
+    """
+    (v_full, v_head, v_tail) = version_ht
+    (g_full, g_head, g_tail) = ghlib.git_describe_ht()
+
+    if g_head == v_head and v_tail != g_tail + 1:
+        raise SystemExit("""
+        Looks like %s should contain %s.%d
+                                    but it's got %s
+
+        I'd update it for you, but git won't let me. >:(
+        """ % (os.path.relpath(vfname), v_head, g_tail+1, v_full))
+
+
+# -----------------------------------------------------------------------------
+def commit_msg(args, want_version, want_cid):
+    """
+    Add a Version: line if *want_version* and a Change-Id: line if
+    *want_cid* to the commit message file named in *args*, unless they're
+    already there. The original is kept as <file>.old unless
+    $GITHOOKS_NO_BACKUP is set.
+    """
+    a = options(args)
+    ghlib.rewrite_msg(a[1], want_version, want_cid,
+                      backup=not os.getenv('GITHOOKS_NO_BACKUP'))
+
+
+# -----------------------------------------------------------------------------
+def not_staged(vfname):
+    """
+    Exit with a message saying that *vfname* needs to be staged
+    """
+    raise SystemExit("""
+        %s is not staged. Looks like you need to make sure it contains the right
+        version and do
+
+            git add %s
+
+        then try your commit again.
+        """ % (os.path.relpath(vfname), os.path.relpath(vfname)))
+
+
+# -----------------------------------------------------------------------------
+def options(args):
+    """
+    Handle the -d/--debug option, which runs the debugger, and return the
+    remaining arguments. optparse is only loaded if there's an option.
+    """
+    if not [x for x in args[1:] if x.startswith('-')]:
+        return args
+    import optparse
+    p = optparse.OptionParser()
+    p.add_option('-d', '--debug',
+                 action='store_true', default=False, dest='debug',
+                 help='run the debugger')
+    (o, a) = p.parse_args(args)
+    if o.debug:
+        import pdb
+        pdb.set_trace()
+    return a
+
+
+# -----------------------------------------------------------------------------
+def pre_commit(args):
+    """
+    Check that the version has been incremented since the last tag and is
+    staged. Any argument runs the debugger.
+    """
+    if 1 < len(args):
+        import pdb
+        pdb.set_trace()
+    vfname = ghlib.get_version_path()
+    if os.getenv('GITHOOKS_VERSION_SOURCE') == 'index':
+        (vs, staged) = ghlib.staged_version(vfname)
+        if not staged:
+            not_staged(vfname)
+        if vs is None:
+            raise SystemExit("""
+        Can't find a version in the staged copy of %s.
+        """ % os.path.relpath(vfname))
+        check_increment(vfname, ghlib.get_version_ht(vs))
+    else:
+        check_increment(vfname, ghlib.get_version_ht())
+        if not version_staged(vfname):
+            not_staged(vfname)
+
+
+# -----------------------------------------------------------------------------
+def version_staged(vfname):
+    """
+    Return True if file *vfname* is staged, i.e., its index entry differs
+    from HEAD and its working tree copy (which is where the version checked
+    came from) matches the index entry, otherwise False. The blob id in the
+    index is read from the index file and compared with the ids in HEAD and
+    of the file, so the cost doesn't depend on the size of the working tree.
+    If the index can't be read, git diff-index and git diff compare just
+    *vfname*'s index entry with HEAD and with the file.
+    """
+    facts = ghlib.repo_facts()
+    rel = os.path.relpath(vfname, facts.toplevel or '.').replace(os.sep, '/')
+    staged = ghlib.index_oid(rel)
+    if staged is not None:
+        head = ''
+        if not facts.head.startswith('ERR:'):
+            head = ghlib.rev_parse('HEAD:' + rel)
+        if staged == ('' if head.startswith('ERR:') else head.strip()):
+            return False
+        return staged == ghlib.hash_path(vfname).strip()
+
+    if facts.head.startswith('ERR:'):
+        base = ghlib.EMPTY_TREE
+    else:
+        base = 'HEAD'
+    spec = '":(top,literal)%s"' % rel
+    r = ghlib.catch_stdout('git diff-index --cached --name-only -z %s -- %s'
+                           % (base, spec))
+    if rel not in r.split('\0'):
+        return False
+    r = ghlib.catch_stdout('git diff --name-only -z -- %s' % spec)
+    return not r.startswith('ERR:') and rel not in r.split('\0')
+
+
+# -----------------------------------------------------------------------------
+if __name__ == '__main__':
+    main(sys.argv)
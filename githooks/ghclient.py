@@ -0,0 +1,86 @@
+"""
+Thin client for ghdaemon
+
+If a ghdaemon is running for the current repository, prime() asks it for
+the repo facts, version path, version, and describe output, and loads them
+into ghlib's per-run memo so the hook doesn't have to compute them. If there
+is no daemon, or it doesn't answer promptly, nothing happens and the hook
+works everything out itself.
+
+Hooks run at the top of the working tree, so the socket is looked for in
+$GIT_DIR, or .git if that isn't set, without running git.
+"""
+import ghlib
+import os
+
+# Name of the daemon's socket in the git dir
+SOCKET_NAME = 'githooks.sock'
+
+
+# -----------------------------------------------------------------------------
+def prime(path=None):
+    """
+    Load what the daemon knows into ghlib's memo. Return True if it
+    answered, otherwise False.
+    """
+    reply = query('facts', path=path)
+    if reply is None or 'toplevel' not in reply:
+        return False
+    known = dict([(k, text(reply[k])) for k in ['toplevel', 'gitdir', 'head']])
+    ghlib.memo_prime('repo_facts', ghlib.RepoFacts(known=known))
+    if 'git_describe_ht' in reply:
+        (full, head, tail) = reply['git_describe_ht']
+        ghlib.memo_prime('git_describe_ht', (text(full), text(head), tail))
+    for name in ['get_version_path', 'get_version_string']:
+        if name in reply:
+            ghlib.memo_prime(name, text(reply[name]))
+    return True
+
+
+# -----------------------------------------------------------------------------
+def query(op, path=None, timeout=1.0):
+    """
+    Send request *op* to the daemon listening on *path* (default: the socket
+    in the current repo's git dir) and return its reply as a dict, or None if
+    there's no daemon or it doesn't answer within *timeout* seconds
+    """
+    path = path or socket_path()
+    if not os.path.exists(path):
+        return None
+    import json
+    import socket
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.settimeout(timeout)
+    try:
+        s.connect(path)
+        s.sendall((json.dumps({'op': op}) + '\n').encode('utf-8'))
+        data = b''
+        while not data.endswith(b'\n'):
+            chunk = s.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+        return json.loads(data.decode('utf-8'))
+    except (socket.error, ValueError):
+        return None
+    finally:
+        s.close()
+
+
+# -----------------------------------------------------------------------------
+def socket_path():
+    """
+    Return where the daemon's socket would be for the repo we're at the top
+    of
+    """
+    return os.path.join(os.getenv('GIT_DIR') or '.git', SOCKET_NAME)
+
+
+# -----------------------------------------------------------------------------
+def text(value):
+    """
+    Return string *value* from a JSON reply as a str
+    """
+    if isinstance(value, str):
+        return value
+    return value.encode('utf-8')
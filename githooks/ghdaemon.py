@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+"""
+Resident helper that keeps ghlib's answers warm for one repository
+
+Usage, from the top of the working tree:
+
+    ghdaemon.py start       # run in the background
+    ghdaemon.py run         # run in the foreground
+    ghdaemon.py status      # report whether one is running
+    ghdaemon.py stop
+
+The daemon listens on a unix socket in the git dir (see ghclient). For each
+request it checks whether .git/index, .git/HEAD, packed-refs, anything under
+refs/, or the version file has changed since it last looked, and if so
+forgets what it knew. Otherwise it answers from memory: the toplevel, git
+dir, HEAD, version path, version, and describe output. The hooks ask for
+these through ghclient and fall back to working them out themselves if the
+daemon isn't there.
+
+The daemon exits after --idle seconds (default 3600) without a request.
+"""
+import ghclient
+import ghlib
+import gitrefs
+import json
+import optparse
+import os
+import sys
+import time
+try:
+    import SocketServer as socketserver
+except ImportError:
+    import socketserver
+
+
+# -----------------------------------------------------------------------------
+def main(args):
+    """
+    Entry point
+    """
+    p = optparse.OptionParser(usage='%prog [options] run|start|stop|status')
+    p.add_option('-d', '--debug',
+                 action='store_true', default=False, dest='debug',
+                 help='run the debugger')
+    p.add_option('--idle',
+                 action='store', default=3600, dest='idle', type='float',
+                 help='exit after this many seconds without a request')
+    (o, a) = p.parse_args(args)
+    if o.debug:
+        import pdb
+        pdb.set_trace()
+    op = a[1] if 1 < len(a) else 'status'
+
+    facts = ghlib.repo_facts()
+    if not facts.gitdir:
+        sys.exit('ghdaemon: not in a git repository')
+    os.chdir(facts.toplevel or facts.gitdir)
+    path = os.path.join(facts.gitdir, ghclient.SOCKET_NAME)
+
+    if op == 'status':
+        if ghclient.query('ping', path=path):
+            sys.stdout.write('ghdaemon is running on %s\n' % path)
+        else:
+            sys.exit('ghdaemon is not running')
+    elif op == 'stop':
+        if not ghclient.query('stop', path=path):
+            sys.exit('ghdaemon is not running')
+    elif op in ('run', 'start'):
+        if ghclient.query('ping', path=path):
+            sys.exit('ghdaemon is already running on %s' % path)
+        if op == 'start' and daemonize():
+            wait_for(path)
+            return
+        serve(path, o.idle)
+    else:
+        p.error('unknown operation %s' % op)
+
+
+# -----------------------------------------------------------------------------
+def daemonize():
+    """
+    Fork into the background. Return True in the original process and False
+    in the daemon.
+    """
+    if os.fork():
+        return True
+    os.setsid()
+    if os.fork():
+        os._exit(0)
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):
+        os.dup2(devnull, fd)
+    return False
+
+
+# -----------------------------------------------------------------------------
+def serve(path, idle):
+    """
+    Listen on *path* until told to stop or *idle* seconds pass without a
+    request
+    """
+    if os.path.exists(path):
+        os.unlink(path)
+    server = Server(path, Handler)
+    server.timeout = idle
+    try:
+        while not server.stopping:
+            server.handle_request()
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+# -----------------------------------------------------------------------------
+def wait_for(path, timeout=5.0):
+    """
+    Wait up to *timeout* seconds for a daemon to answer on *path*
+    """
+    limit = time.time() + timeout
+    while time.time() < limit:
+        if ghclient.query('ping', path=path):
+            return
+        time.sleep(0.05)
+    sys.exit('ghdaemon did not start')
+
+
+# -----------------------------------------------------------------------------
+class Handler(socketserver.StreamRequestHandler):
+    """
+    Answer one request: a line of JSON like {"op": "facts"}
+    """
+    # -------------------------------------------------------------------------
+    def handle(self):
+        """
+        Read the request and write the reply
+        """
+        try:
+            op = json.loads(self.rfile.readline().decode('utf-8')).get('op')
+        except (ValueError, AttributeError):
+            op = None
+        if op == 'facts':
+            reply = self.server.state.facts()
+        elif op == 'ping':
+            reply = {'pid': os.getpid()}
+        elif op == 'stop':
+            self.server.stopping = True
+            reply = {'pid': os.getpid()}
+        else:
+            reply = {'error': 'unknown request'}
+        self.wfile.write((json.dumps(reply) + '\n').encode('utf-8'))
+
+
+# -----------------------------------------------------------------------------
+class Server(socketserver.UnixStreamServer):
+    """
+    The socket server, holding the repo State
+    """
+    # -------------------------------------------------------------------------
+    def __init__(self, path, handler):
+        """
+        Listen on *path*
+        """
+        socketserver.UnixStreamServer.__init__(self, path, handler)
+        self.state = State()
+        self.stopping = False
+
+    # -------------------------------------------------------------------------
+    def handle_timeout(self):
+        """
+        Nobody has asked anything for a while, so quit
+        """
+        self.stopping = True
+
+
+# -----------------------------------------------------------------------------
+class State(object):
+    """
+    What the daemon knows about the repository, and a fingerprint of the
+    files that would change if it were out of date
+    """
+    # -------------------------------------------------------------------------
+    def __init__(self):
+        """
+        Start out knowing nothing
+        """
+        self.stamp = None
+        self.vpath = None
+
+    # -------------------------------------------------------------------------
+    def facts(self):
+        """
+        Return a dict of everything we know, recomputing it if the repository
+        has changed. Values are keyed on the ghlib functions they come from.
+        """
+        stamp = self.fingerprint()
+        if stamp != self.stamp:
+            ghlib.memo_reset()
+            ghlib.close_workers()
+        facts = ghlib.repo_facts()
+        rval = {'toplevel': facts.toplevel,
+                'gitdir': facts.gitdir,
+                'head': facts.head,
+                'git_describe_ht': list(ghlib.git_describe_ht())}
+        try:
+            self.vpath = ghlib.get_version_path()
+            rval['get_version_path'] = self.vpath
+            rval['get_version_string'] = ghlib.get_version_string()
+        except SystemExit:
+            self.vpath = None
+        self.stamp = stamp
+        return rval
+
+    # -------------------------------------------------------------------------
+    def fingerprint(self):
+        """
+        Return the (path, mtime, size) of each file whose change would make
+        what we know out of date. A loose ref being updated changes its
+        directory's mtime, so directories under refs/ are enough.
+        """
+        gitdir = ghlib.repo_facts().gitdir
+        common = gitrefs.common_dir(gitdir)
+        paths = [ghlib.index_path(ghlib.repo_facts()),
+                 os.path.join(gitdir, 'HEAD'),
+                 os.path.join(common, 'packed-refs')]
+        for (r, d, f) in os.walk(os.path.join(common, 'refs')):
+            paths.append(r)
+        if self.vpath:
+            paths.append(self.vpath)
+        rval = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+                rval.append((path, st.st_mtime, st.st_size))
+            except OSError:
+                rval.append((path, None, None))
+        return rval
+
+
+# -----------------------------------------------------------------------------
+if __name__ == '__main__':
+    main(sys.argv)
@@ -1,7 +1,276 @@
+import atexit
+import functools
 import os
-import shlex
-import subprocess
+import re
 import sys
+import time
+
+# Modules that only some hook runs need (calendar, fnmatch, hashlib, json,
+# shlex, subprocess, ...) are imported in the functions that use them to keep
+# hook startup fast. tests/test_startup.py holds us to that.
+
+# Directories get_version_path() won't look in for version.py
+VERSION_PRUNE = ['.git', '.tox', '.venv', 'build', 'dist', 'node_modules',
+                 'third_party', 'vendor', 'venv']
+
+# The id of the tree with nothing in it, for diffing against when there is no
+# HEAD yet
+EMPTY_TREE = '4b825dc642cb6eb9a060e54bf8d69288fbee4904'
+
+# How far HEAD can have moved from a cached describe result for
+# describe_advance() to carry it forward
+DESCRIBE_ADVANCE_MAX = 1000
+
+# How many tags TagIndex.describe() considers before settling on the
+# nearest, as for 'git describe --candidates'
+DESCRIBE_CANDIDATES = 10
+
+# Name of the file under the git dir where results are cached between runs,
+# and this run's hit/miss counts by cache entry name
+CACHE_NAME = 'githooks-cache.json'
+cache_stats = {}
+
+# Values remembered by @memoized functions, keyed on working directory and
+# then function name
+_memo = {}
+
+# Record of the commands run, if $GITHOOKS_TRACE is set. See trace().
+_trace = [] if os.getenv('GITHOOKS_TRACE') else None
+
+# Long-lived git batch processes, keyed on (command, working directory). See
+# git_worker().
+_workers = {}
+
+# Most bytes of queries written to a git batch process before its replies
+# are read: no more than any pipe holds, so the write can't block. See
+# GitWorker.query_many().
+WORKER_BATCH = 4096
+
+# -----------------------------------------------------------------------------
+def memoized(func):
+    """
+    Decorator for ghlib queries whose answers don't change during a hook run.
+    The first call without arguments in a given directory computes the value;
+    later ones return it from _memo. Calls with arguments always run *func*.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if args or kwargs:
+            return func(*args, **kwargs)
+        store = _memo.setdefault(os.getcwd(), {})
+        if func.__name__ not in store:
+            store[func.__name__] = func()
+        return store[func.__name__]
+    return wrapper
+
+
+# -----------------------------------------------------------------------------
+def memo_prime(name, value):
+    """
+    Remember *value* as the result of @memoized function *name* in the
+    current directory, as if it had been computed here
+    """
+    _memo.setdefault(os.getcwd(), {})[name] = value
+
+
+# -----------------------------------------------------------------------------
+def memo_reset():
+    """
+    Forget everything remembered by @memoized functions, so the next call to
+    each recomputes its value. Use this when the repo changes under a
+    long-running process, as in the tests.
+    """
+    _memo.clear()
+
+
+# -----------------------------------------------------------------------------
+def annotated_tags():
+    """
+    Return a dict mapping the id of each commit that annotated tags point at
+    -- the ones 'git describe' can name -- to a list of (tagger timestamp,
+    tag name) for the tags on it, newest first
+
+    The tags are read from the refs directly (see gitrefs) when possible.
+    git is only asked about loose tags, to tell annotated from lightweight,
+    and for the tagger dates of commits with more than one tag, which is
+    what the dates are needed for.
+    """
+    facts = repo_facts()
+    if facts.gitdir:
+        import gitrefs
+        found = gitrefs.discover()
+        if found is not None and found[1] == facts.gitdir:
+            rval = annotated_tags_from(gitrefs.tags(facts.gitdir))
+            if rval is not None:
+                return rval
+    r = catch_stdout("git for-each-ref --format='%(refname) %(objecttype) "
+                     "%(*objecttype) %(*objectname) %(taggerdate:raw)' "
+                     "refs/tags")
+    rval = {}
+    if r.startswith('ERR:'):
+        return rval
+    for line in r.split('\n'):
+        f = line.split()
+        if len(f) < 4 or f[1] != 'tag' or f[2] != 'commit':
+            continue
+        when = int(f[4]) if 4 < len(f) and f[4].isdigit() else 0
+        rval.setdefault(f[3], []).append((when, f[0][len('refs/tags/'):]))
+    for tags in rval.values():
+        tags.sort(key=lambda x: (-x[0], x[1]))
+    return rval
+
+
+# -----------------------------------------------------------------------------
+def annotated_tags_from(refs):
+    """
+    Return what annotated_tags() does for *refs*, a dict like gitrefs.tags()
+    returns, or None if git can't be asked what it needs to know
+    """
+    unknown = sorted([oid for (oid, peeled) in refs.values()
+                      if peeled is None])
+    peel = {}
+    if unknown:
+        replies = git_batch_many('git cat-file --batch-check',
+                                 [oid + '^{}' for oid in unknown])
+        if replies is None:
+            return None
+        for (oid, reply) in zip(unknown, replies):
+            f = reply.split()
+            if 1 < len(f) and f[0] != oid and f[1] == 'commit':
+                peel[oid] = f[0]
+            else:
+                peel[oid] = ''
+    rval = {}
+    for (name, (oid, peeled)) in refs.items():
+        peeled = peel[oid] if peeled is None else peeled
+        if peeled:
+            rval.setdefault(peeled, []).append([0, name, oid])
+    for tags in rval.values():
+        if 1 < len(tags):
+            for tag in tags:
+                m = re.search(r'^tagger .* (\d+) [-+]\d{4}$',
+                              cat_file(tag[2]), re.M)
+                tag[0] = int(m.group(1)) if m else 0
+        tags[:] = sorted([(when, name) for (when, name, oid) in tags],
+                         key=lambda x: (-x[0], x[1]))
+    return rval
+
+
+# -----------------------------------------------------------------------------
+def cache_get(facts, name, key):
+    """
+    Return the value cached under *name* in the current repo's cache file if
+    it was stored with *key*, otherwise None. Hits and misses are counted in
+    cache_stats.
+    """
+    entry = cache_load(facts).get(name)
+    stats = cache_stats.setdefault(name, {'hit': 0, 'miss': 0})
+    if entry is not None and entry.get('key') == key:
+        stats['hit'] += 1
+        return entry.get('value')
+    stats['miss'] += 1
+    return None
+
+
+# -----------------------------------------------------------------------------
+def cache_load(facts):
+    """
+    Read and return the contents of the cache file in *facts*.gitdir, or an
+    empty dict if there isn't one or it can't be read
+    """
+    import json
+    if not facts.gitdir:
+        return {}
+    try:
+        f = open(os.path.join(facts.gitdir, CACHE_NAME), 'r')
+        try:
+            rval = json.load(f)
+        finally:
+            f.close()
+    except (IOError, OSError, ValueError):
+        return {}
+    if not isinstance(rval, dict):
+        return {}
+    return rval
+
+
+# -----------------------------------------------------------------------------
+def cache_put(facts, name, key, value):
+    """
+    Store *value* under *name* in the cache file along with the *key* that
+    cache_get must be given to retrieve it. Failure to write the cache is not
+    an error.
+    """
+    import json
+    if not facts.gitdir:
+        return
+    data = cache_load(facts)
+    data[name] = {'key': key, 'value': value}
+    path = os.path.join(facts.gitdir, CACHE_NAME)
+    try:
+        f = open(path + '.tmp', 'w')
+        try:
+            json.dump(data, f)
+        finally:
+            f.close()
+        os.rename(path + '.tmp', path)
+    except (IOError, OSError, ValueError):
+        pass
+
+
+# -----------------------------------------------------------------------------
+def cache_report():
+    """
+    If $GITHOOKS_DEBUG is set, write the cache hit/miss counts to stderr
+    """
+    for name in sorted(cache_stats.keys()):
+        debug('cache %s: %d hit, %d miss' % (name, cache_stats[name]['hit'],
+                                             cache_stats[name]['miss']))
+
+
+atexit.register(cache_report)
+
+
+# -----------------------------------------------------------------------------
+def cat_file(spec):
+    """
+    Return the contents of the git object named by *spec* (e.g., 'HEAD:x.py'
+    or ':version.py'). Queries go to a warm 'git cat-file --batch' process. If
+    that can't be used, we fall back to one-shot 'git cat-file'.
+    """
+    reply = git_batch('git cat-file --batch', spec, body=True)
+    if reply is None:
+        otype = catch_stdout('git cat-file -t "%s"' % spec)
+        if otype.startswith('ERR:'):
+            return otype
+        return catch_stdout('git cat-file %s "%s"' % (otype.strip(), spec))
+    (header, body) = reply
+    if header.endswith(' missing') or header.endswith(' ambiguous'):
+        return 'ERR:' + header
+    return body
+
+
+# -----------------------------------------------------------------------------
+def catch_all(cmd, input=None):
+    """
+    Run *cmd*, optionally passing string *input* to it on stdin, and return a
+    tuple (returncode, stdout, stderr). Raises OSError if *cmd* can't be run.
+    """
+    import shlex
+    import subprocess
+    if _trace is not None:
+        start = time.time()
+    p = subprocess.Popen(shlex.split(cmd),
+                         stdin=subprocess.PIPE,
+                         stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE)
+    if input:
+        p.stdin.write(input)
+    (o, e) = p.communicate()
+    if _trace is not None:
+        trace(cmd, start, len(input or ''), len(o) + len(e), p.returncode)
+    return (p.returncode, o, e)
+
 
 # -----------------------------------------------------------------------------
 def catch_stdout(cmd, input=None):
@@ -10,14 +279,8 @@ def catch_stdout(cmd, input=None):
     what the process writes to stdout
     """
     try:
-        p = subprocess.Popen(shlex.split(cmd),
-                             stdin=subprocess.PIPE,
-                             stdout=subprocess.PIPE,
-                             stderr=subprocess.PIPE)
-        if input:
-            p.stdin.write(input)
-        (o, e) = p.communicate()
-        if p.returncode == 0:
+        (rc, o, e) = catch_all(cmd, input=input)
+        if rc == 0:
             rval = o
         else:
             rval = 'ERR:' + e
@@ -30,6 +293,98 @@ def catch_stdout(cmd, input=None):
     return rval
 
 
+# -----------------------------------------------------------------------------
+def change_id_for(tree, parent, author, committer, msg):
+    """
+    Return the Change-Id: line for a commit of *tree* on *parent* (None for a
+    root commit) by *author* and *committer* (identity lines, 'name <email>
+    timestamp tz') with message lines *msg*. This is what get_change_id()
+    computes for the commit being made, for callers that already know the
+    pieces.
+    """
+    istr = commit_header(tree, parent, author, committer) + '\n'.join(msg)
+    return 'Change-Id: I' + hash_object(istr, 'commit') + '\n'
+
+
+# -----------------------------------------------------------------------------
+def change_id_item(item):
+    """
+    change_id_for() taking its arguments as one tuple, for change_ids()'s
+    pool, which can only pass one argument and must be able to pickle the
+    function
+    """
+    return change_id_for(*item)
+
+
+# -----------------------------------------------------------------------------
+def change_id_parts():
+    """
+    Return the (tree, parent, author, committer) of the commit being made,
+    for change_id_for(). parent is None if there's no HEAD yet. The tree id
+    is worked out from the index (see gitindex) if possible, so that 'git
+    write-tree' doesn't have to write it.
+    """
+    import gitindex
+    facts = repo_facts()
+    parent = None
+    if not facts.head.startswith('ERR:'):
+        parent = facts.head.strip()
+    tree = gitindex.tree_id(index_path(facts), facts.gitdir)
+    if tree is None:
+        tree = catch_stdout('git write-tree').strip()
+    return (tree, parent, facts.author.strip(), facts.committer.strip())
+
+
+# -----------------------------------------------------------------------------
+def change_ids(items, workers=1, chunksize=256):
+    """
+    Return the Change-Id: lines for *items*, a sequence of (tree, parent,
+    author, committer, msg) tuples as change_id_for() takes them, in order.
+    With more than one of *workers*, the hashing is spread over a pool of
+    that many processes, handing each *chunksize* items at a time. Small
+    batches are done in this process, where the pool would cost more than
+    it saves. No git commands are run either way.
+    """
+    items = list(items)
+    if workers <= 1 or len(items) < 2 * chunksize:
+        return [change_id_for(*x) for x in items]
+    import multiprocessing
+    pool = multiprocessing.Pool(workers)
+    try:
+        return pool.map(change_id_item, items, chunksize)
+    finally:
+        pool.close()
+        pool.join()
+
+
+# -----------------------------------------------------------------------------
+def close_workers():
+    """
+    Shut down all the long-lived git processes started by git_worker(). This
+    is registered to run at exit but may be called any time -- workers are
+    restarted on demand.
+    """
+    for key in list(_workers.keys()):
+        _workers.pop(key).close()
+
+
+atexit.register(close_workers)
+
+
+# -----------------------------------------------------------------------------
+def commit_header(tree, parent, author, committer):
+    """
+    Return the tree, parent, author, and committer text that precedes the
+    message in what change_id_for() hashes
+    """
+    rval = 'tree %s\n' % tree
+    if parent:
+        rval += 'parent %s\n' % parent
+    rval += 'author %s\n' % author
+    rval += 'committer %s\n' % committer
+    return rval
+
+
 # -----------------------------------------------------------------------------
 def contents(filename):
     """
@@ -42,22 +397,87 @@ def contents(filename):
     return rval
 
 
+# -----------------------------------------------------------------------------
+def debug(msg):
+    """
+    Write *msg* to stderr if $GITHOOKS_DEBUG is set
+    """
+    if os.getenv('GITHOOKS_DEBUG'):
+        sys.stderr.write('githooks: %s\n' % msg)
+
+
+# -----------------------------------------------------------------------------
+def describe_advance(cached, head):
+    """
+    Work out the describe (full, head, tail) for commit *head* from a
+    *cached* result for an earlier commit, if *head* is a linear descendant
+    of it with no tagged commits in between. Return None if it isn't, so the
+    caller can run 'git describe'.
+    """
+    if cached.get('tagged') is None:
+        cached['tagged'] = tagged_commits()
+    r = catch_stdout('git rev-list --parents --max-count=%d %s ^%s' %
+                     (DESCRIBE_ADVANCE_MAX + 1, head, cached['head']))
+    if r.startswith('ERR:'):
+        return None
+    lines = r.split('\n')[:-1]
+    if not lines or DESCRIBE_ADVANCE_MAX < len(lines):
+        return None
+    tagged = set(cached['tagged'])
+    expect = head
+    for line in lines:
+        oids = line.split()
+        if oids[0] != expect or len(oids) != 2 or oids[0] in tagged:
+            return None
+        expect = oids[1]
+    if expect != cached['head']:
+        return None
+    (full, ghead, tail) = cached['ht']
+    if not ghead:
+        return (full, ghead, tail)
+    tail += len(lines)
+    return ('%s.%d' % (ghead, tail), ghead, tail)
+
+
+# -----------------------------------------------------------------------------
+def describe_full():
+    """
+    Run 'git describe --long' in the current repo. There are three possible
+    results:
+        no tag - full = head = '', tail = 0
+        '2014.1116-9-g1eaeaad' - full = '2014.1116.9', head = '2014.1116',
+            tail = 9
+        '2015.0125-0-g5a3b9c1' - full = head = '2015.0125', tail = 0
+    The count and abbreviated id are split off the right, so tag names may
+    contain '-'. git describe stops walking history once its candidate tags
+    are settled, where a TagIndex would read all of it first, so this is
+    what a hook uses; TagIndex is for callers asking about many commits.
+    """
+    r = catch_stdout('git describe --long')
+    rl = r.strip().rsplit('-', 2)
+    if r.startswith('ERR:') or len(rl) != 3 or not rl[1].isdigit():
+        return(('', '', 0))
+    (head, tail) = (rl[0], int(rl[1]))
+    if tail == 0:
+        return((head, head, 0))
+    return(('%s.%d' % (head, tail), head, tail))
+
+
+# -----------------------------------------------------------------------------
+def env_list(name):
+    """
+    Return the non-empty elements of environment variable *name* split on
+    os.pathsep
+    """
+    return [x for x in os.getenv(name, '').split(os.pathsep) if x]
+
+
 # -----------------------------------------------------------------------------
 def get_change_id(msg):
     """
     Generate a change id line based on the commit message and return it
     """
-    istr = 'tree '
-    istr += catch_stdout('git write-tree')
-    parent = catch_stdout('git rev-parse "HEAD^0"')
-    if not parent.startswith('ERR:'):
-        istr += 'parent ' + parent
-    istr += 'author ' + catch_stdout('git var GIT_AUTHOR_IDENT')
-    istr += 'committer ' + catch_stdout('git var GIT_COMMITTER_IDENT')
-    istr += '\n'.join(msg)
-    rval = catch_stdout('git hash-object -t commit --stdin',
-                        input=istr)
-    return 'Change-Id: I' + rval
+    return change_id_for(*(change_id_parts() + (msg,)))
 
 
 # -----------------------------------------------------------------------------
@@ -67,27 +487,60 @@ def get_version():
     contains a statement that sets __version__ and we use that to construct and
     return a line of the form 'Version:    x.x.x'
     """
-    vpath = get_version_path()
-    vinfo = contents(vpath)
-    eval(compile('\n'.join(vinfo), vpath, 'exec'))
-    rval = "Version:   %s" % locals()["__version__"]
+    rval = "Version:   %s" % get_version_string()
     return rval
 
 
 # -----------------------------------------------------------------------------
-def get_version_path():
+@memoized
+def get_version_path(roots=None, prune=None):
     """
-    Scan the current git repo for a file named 'version.py'. Return the path to
-    it.
+    Find the file named 'version.py' in the current git repo and return its
+    path.
+
+    We look in the index for tracked files named version.py rather than
+    walking the tree. If none are tracked, an untracked version.py at the top
+    of a root will do; git is only asked for untracked, not-ignored ones
+    further down if $GITHOOKS_VERSION_UNTRACKED is set, since that means
+    reading every directory. The search is limited to the directories in
+    *roots* (relative to the toplevel, default $GITHOOKS_VERSION_ROOTS or the
+    whole repo) and skips any path with a directory component matching a
+    pattern in *prune* (default VERSION_PRUNE plus $GITHOOKS_VERSION_PRUNE).
+    If there are several candidates, the shallowest wins, with ties going to
+    the one that sorts first.
     """
-    groot = catch_stdout('git rev-parse --show-toplevel')
-    if groot.startswith('ERR:'):
-        groot = '.'
-    vpath = ''
-    for r, d, f in os.walk(groot.strip()):
-        if 'version.py' in f:
-            vpath = os.path.join(r, 'version.py')
-            break
+    facts = repo_facts()
+    groot = facts.toplevel or '.'
+    if roots is None:
+        roots = env_list('GITHOOKS_VERSION_ROOTS') or ['']
+    if prune is None:
+        prune = VERSION_PRUNE + env_list('GITHOOKS_VERSION_PRUNE')
+    untracked = bool(os.getenv('GITHOOKS_VERSION_UNTRACKED'))
+
+    key = [groot, index_stamp(facts), roots, prune, untracked]
+    vpath = cache_get(facts, 'version_path', key) or ''
+    if not isinstance(vpath, str):
+        vpath = vpath.encode('utf-8')
+    if vpath and not os.path.isfile(vpath):
+        vpath = ''
+    found = None
+    if vpath == '' and facts.toplevel:
+        found = version_indexed(roots, prune)
+        if found is None:
+            found = version_candidates(roots, prune, '--cached')
+        if found == []:
+            found = version_at_roots(groot, roots, prune)
+        if found == [] and untracked:
+            found = version_candidates(roots, prune,
+                                       '--others --exclude-standard')
+    if vpath == '' and found is None:
+        found = version_walk(groot, roots, prune)
+    if found:
+        vpath = os.path.join(groot, found[0])
+    elif vpath == '':
+        vpath = version_fallback(groot)
+    if vpath and found is not None:
+        cache_put(facts, 'version_path', key, vpath)
     if vpath == '':
         vpath_msg = ("\nYou don't have a version.py file. " +
                      "Here's what it should contain:\n\n" +
@@ -98,13 +551,15 @@ def get_version_path():
 
 
 # -----------------------------------------------------------------------------
-def get_version_ht():
+def get_version_ht(vs=None):
     """
     Get the version string and return the head and tail. The head is the first
     two segments. The tail is the third segment or the empty string if there is
-    no third segment.
+    no third segment. If *vs* is given, it is used as the version string rather
+    than reading it from version.py.
     """
-    vs = get_version_string()
+    if vs is None:
+        vs = get_version_string()
     vl = vs.split('.')
     head = '.'.join(vl[0:2])
     if 2 < len(vl):
@@ -115,39 +570,614 @@ def get_version_ht():
 
 
 # -----------------------------------------------------------------------------
+@memoized
 def get_version_string():
     """
-    Scan the current git repo for a file named 'version.py'. We assume it
-    contains a statement that sets __version__. We return the value of
-    __version__.
+    Find the version file (normally 'version.py') in the current git repo and
+    return the version it declares. The file is parsed, not executed (see
+    version_from_file).
     """
     vpath = get_version_path()
-    vinfo = contents(vpath)
-    eval(compile('\n'.join(vinfo), vpath, 'exec'))
-    return locals()['__version__']
+    rval = version_from_file(vpath)
+    if rval is None:
+        sys.exit("\nCan't find a version in %s. " % vpath +
+                 "It should contain a line like\n\n" +
+                 "    __version__ = '0.0'\n")
+    return rval
+
+
+# -----------------------------------------------------------------------------
+def git_batch(cmd, query, body=False):
+    """
+    Send *query* to the warm git process for *cmd* and return its reply (see
+    GitWorker.query). Return None if no worker can be used so the caller can
+    fall back to a one-shot command.
+    """
+    replies = git_batch_many(cmd, [query], body=body)
+    if replies is None:
+        return None
+    return replies[0]
+
+
+# -----------------------------------------------------------------------------
+def git_batch_many(cmd, queries, body=False):
+    """
+    Like git_batch, but send all of *queries* before reading any replies, so
+    they cost a single round trip, and return the list of replies
+    """
+    worker = git_worker(cmd, body=body)
+    if worker is None:
+        return None
+    try:
+        return worker.query_many(queries)
+    except (IOError, OSError, ValueError):
+        _workers.pop((cmd, os.getcwd()), None)
+        worker.close()
+        return None
+
 
 # -----------------------------------------------------------------------------
+@memoized
 def git_describe_ht():
     """
-    Run 'git describe' in the current repo. There are three possible results:
-        '' - head = '', tail = 0
-        '2014.1116-9-g1eaeaad' - head = '2014.1116', tail = 9
-        '2015.0125' - head = '2015.0125', tail = 0
+    Return the (full, head, tail) for HEAD that describe_full() would.
+
+    The answer is cached in the git dir along with the HEAD it's for, keyed
+    on a fingerprint of the tags (see tags_stamp). If the tags haven't
+    changed, a cached answer for HEAD is used as is, and one for an earlier
+    commit is carried forward if HEAD has just advanced from it (see
+    describe_advance), so 'git describe' only has to walk history when the
+    tags change or HEAD jumps.
     """
-    r = catch_stdout('git describe')
-    if 'No names found' in r:
-        full = ''
-        head = ''
-        tail = 0
-    elif '-' in r:
-        rl = r.split('-')
-        full = '.'.join([rl[0], rl[1]])
-        head = rl[0]
-        tail = int(rl[1])
+    facts = repo_facts()
+    if facts.head.startswith('ERR:'):
+        return(('', '', 0))
+    head = facts.head.strip()
+    key = tags_stamp(facts)
+    cached = cache_get(facts, 'describe', key)
+    rval = None
+    if cached is not None:
+        cached['ht'] = tuple([x if isinstance(x, (int, str))
+                              else x.encode('utf-8') for x in cached['ht']])
+        if cached['head'] == head:
+            return cached['ht']
+        rval = describe_advance(cached, head)
+    if rval is None:
+        rval = describe_full()
+        cached = {'tagged': None}
+    cache_put(facts, 'describe', key, {'head': head, 'ht': list(rval),
+                                       'tagged': cached['tagged']})
+    return rval
+
+
+# -----------------------------------------------------------------------------
+def git_worker(cmd, body=False):
+    """
+    Return a running GitWorker for *cmd* in the current directory, starting
+    one if necessary. Return None if workers are disabled (by setting
+    $GITHOOKS_NO_WORKERS) or git can't be started.
+
+    git reads the index once when it starts, so a worker is replaced if the
+    index has changed since it was started.
+    """
+    if os.getenv('GITHOOKS_NO_WORKERS'):
+        return None
+    key = (cmd, os.getcwd())
+    stamp = index_stamp(repo_facts())
+    worker = _workers.get(key)
+    if worker is not None:
+        if worker.alive() and worker.stamp == stamp:
+            return worker
+        worker.close()
+    try:
+        worker = GitWorker(cmd, body=body)
+    except OSError:
+        return None
+    worker.stamp = stamp
+    _workers[key] = worker
+    return worker
+
+
+# -----------------------------------------------------------------------------
+class GitWorker(object):
+    """
+    A long-lived git process running a batch command such as 'git cat-file
+    --batch-check' or 'git hash-object --stdin-paths'. Each query is one line
+    on the process's stdin and gets one reply, so a hook that asks several
+    questions pays for git startup once instead of once per question.
+    """
+    # -------------------------------------------------------------------------
+    def __init__(self, cmd, body=False):
+        """
+        Start *cmd*. If *body* is True, each reply is a header line followed
+        by the number of bytes given in the header's last field, as with 'git
+        cat-file --batch'.
+        """
+        import shlex
+        import subprocess
+        if _trace is not None:
+            start = time.time()
+        self.cmd = cmd
+        self.body = body
+        self.devnull = open(os.devnull, 'w')
+        self.proc = subprocess.Popen(shlex.split(cmd),
+                                     stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE,
+                                     stderr=self.devnull)
+        if _trace is not None:
+            trace('%s (start)' % cmd, start, 0, 0, None)
+
+    # -------------------------------------------------------------------------
+    def alive(self):
+        """
+        Return True if the git process is still running
+        """
+        return self.proc.poll() is None
+
+    # -------------------------------------------------------------------------
+    def close(self):
+        """
+        Close the git process's stdin and wait for it to exit
+        """
+        try:
+            self.proc.stdin.close()
+            self.proc.wait()
+        except (IOError, OSError):
+            pass
+        self.devnull.close()
+
+    # -------------------------------------------------------------------------
+    def query(self, line):
+        """
+        Send *line* to the git process and return its reply. Without *body*,
+        the reply is the response line with its newline stripped. With
+        *body*, it's a tuple (header, contents), where contents is '' for
+        missing objects.
+        """
+        return self.query_many([line])[0]
+
+    # -------------------------------------------------------------------------
+    def query_many(self, lines):
+        """
+        Send *lines* to the git process and return a list of the replies as
+        described for query(). The lines go in batches of at most
+        WORKER_BATCH bytes, each sent only once the replies to the last have
+        been read, so git never has more than a pipeful of queries waiting
+        and can't block writing replies while we block writing queries.
+        """
+        if _trace is not None:
+            start = time.time()
+        data = ''.join([l + '\n' for l in lines])
+        rval = []
+        (batch, size) = ([], 0)
+        for line in lines + [None]:
+            if batch and (line is None or
+                          WORKER_BATCH < size + len(line) + 1):
+                self.proc.stdin.write(''.join(batch))
+                self.proc.stdin.flush()
+                rval.extend([self.reply() for l in batch])
+                (batch, size) = ([], 0)
+            if line is not None:
+                batch.append(line + '\n')
+                size += len(line) + 1
+        if _trace is not None:
+            size = sum([len(r) if not self.body else
+                        len(r[0]) + len(r[1]) for r in rval])
+            trace('%s <<< %s' % (self.cmd, ' '.join(lines)), start,
+                  len(data), size, None)
+        return rval
+
+    # -------------------------------------------------------------------------
+    def reply(self):
+        """
+        Read one reply from the git process
+        """
+        header = self.proc.stdout.readline()
+        if not header:
+            raise IOError("%s exited" % self.cmd)
+        header = header.rstrip('\n')
+        if not self.body:
+            return header
+        fields = header.split()
+        if len(fields) != 3 or not fields[2].isdigit():
+            return (header, '')
+        data = self.proc.stdout.read(int(fields[2]))
+        self.proc.stdout.read(1)
+        return (header, data)
+
+
+# -----------------------------------------------------------------------------
+def hash_object(data, otype='blob'):
+    """
+    Return the id git would assign to an object of type *otype* with content
+    *data*, the same value 'git hash-object -t *otype* --stdin' prints, but
+    computed here without running git.
+    """
+    import hashlib
+    return hashlib.sha1('%s %d\0%s' % (otype, len(data), data)).hexdigest()
+
+
+# -----------------------------------------------------------------------------
+def hash_path(path):
+    """
+    Return the blob id (with a trailing newline, like 'git hash-object') that
+    git would assign to the file at *path*, using a warm 'git hash-object
+    --stdin-paths' process when possible.
+    """
+    reply = git_batch('git hash-object --stdin-paths', path)
+    if reply is None:
+        return catch_stdout('git hash-object "%s"' % path)
+    return reply + '\n'
+
+
+# -----------------------------------------------------------------------------
+def ident(who):
+    """
+    Build the identity line ('name <email> timestamp tz') that 'git var
+    GIT_*who*_IDENT' would report, where *who* is 'AUTHOR' or 'COMMITTER',
+    from $GIT_*who*_NAME, $GIT_*who*_EMAIL, and $GIT_*who*_DATE. Return None
+    if the environment doesn't determine it and git has to be asked.
+    """
+    name = ident_strip(os.getenv('GIT_%s_NAME' % who, ''))
+    email = ident_strip(os.getenv('GIT_%s_EMAIL' % who, ''))
+    if not name or not email:
+        return None
+    date = os.getenv('GIT_%s_DATE' % who)
+    if date is None:
+        import calendar
+        now = int(time.time())
+        offset = (calendar.timegm(time.localtime(now)) - now) // 60
+        sign = '-' if offset < 0 else '+'
+        date = '%d %s%02d%02d' % (now, sign, abs(offset) // 60,
+                                  abs(offset) % 60)
+    elif re.match(r'^@?\d+ [+-]\d{4}$', date):
+        date = date.lstrip('@')
     else:
-        full = head = r.strip()
-        tail = 0
-    return((full, head, tail))
+        return None
+    return '%s <%s> %s\n' % (name, email, date)
+
+
+# -----------------------------------------------------------------------------
+def ident_strip(value):
+    """
+    Clean up a name or email *value* the way git does before putting it in
+    an identity line (strbuf_addstr_without_crud in git's ident.c): strip
+    control characters, spaces, and the punctuation git calls crud from both
+    ends, and drop any '<', '>', or newline left in the middle
+    """
+    crud = ''.join([chr(c) for c in range(33)]) + '.,:;<>"\\\''
+    return re.sub('[<>\n]', '', value.strip(crud))
+
+
+# -----------------------------------------------------------------------------
+def index_oid(rel):
+    """
+    Return the blob id (hex, no newline) of path *rel* (relative to the
+    toplevel, with '/' separators) in the index, read directly from the
+    index file, '' if it isn't in the index, or None if the index can't be
+    read
+    """
+    import gitindex
+    index = gitindex.load(index_path(repo_facts()))
+    if index is None:
+        return None
+    try:
+        entry = index.lookup(rel)
+    finally:
+        index.close()
+    return '' if entry is None else entry.hexoid
+
+
+# -----------------------------------------------------------------------------
+def index_path(facts):
+    """
+    Return the path of the index file git is using: $GIT_INDEX_FILE if set
+    (as it is for 'git commit -a' and friends), otherwise 'index' in the git
+    dir
+    """
+    return os.getenv('GIT_INDEX_FILE') or os.path.join(facts.gitdir, 'index')
+
+
+# -----------------------------------------------------------------------------
+def index_stamp(facts):
+    """
+    Return [mtime, size] of the index file, or [0, 0] if there isn't one, for
+    detecting changes to the index
+    """
+    try:
+        st = os.stat(index_path(facts))
+    except OSError:
+        return [0, 0]
+    return [st.st_mtime, st.st_size]
+
+
+# -----------------------------------------------------------------------------
+def join_msg(payload, version, cid, comments):
+    """
+    Return the lines of a message laid out as *payload*, a blank line if
+    needed, *version*, *cid*, and *comments* -- the inverse of split_msg()
+    """
+    rval = list(payload)
+    if payload and 0 < len(payload[-1]):
+        rval.append('')
+    rval.append(version.strip())
+    rval.append(cid.strip())
+    rval.extend(comments)
+    return rval
+
+
+# -----------------------------------------------------------------------------
+def log_commits(revs, bufsize=65536):
+    """
+    Generate (oid, parents, lines) for each commit 'git rev-list *revs*'
+    would list, parents before children, where *lines* is the message as a
+    list of lines for split_msg(). The log is parsed as git writes it, so
+    the whole history is never held in memory. Raise ValueError with git's
+    complaint if *revs* is no good.
+    """
+    import shlex
+    import subprocess
+    if _trace is not None:
+        start = time.time()
+    cmd = 'git log --reverse --topo-order --format=%x00%H%x20%P%n%B ' + revs
+    p = subprocess.Popen(shlex.split(cmd), stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE)
+    nout = 0
+    rest = ''
+    while True:
+        chunk = p.stdout.read(bufsize)
+        nout += len(chunk)
+        records = (rest + chunk).split('\0')
+        rest = records.pop()
+        for record in records:
+            if record:
+                yield log_record(record)
+        if not chunk:
+            break
+    if rest:
+        yield log_record(rest)
+    err = p.stderr.read()
+    rc = p.wait()
+    if _trace is not None:
+        trace(cmd, start, 0, nout, rc)
+    if rc != 0:
+        raise ValueError(err.strip())
+
+
+# -----------------------------------------------------------------------------
+def log_record(record):
+    """
+    Split one record of log_commits()'s git log output into (oid, parents,
+    lines)
+    """
+    (head, sep, body) = record.partition('\n')
+    ids = head.split()
+    return (ids[0], ids[1:], body.rstrip('\n').split('\n'))
+
+
+# -----------------------------------------------------------------------------
+@memoized
+def repo_facts():
+    """
+    Gather the facts about the current repository that the hooks need and
+    return them as a RepoFacts object
+    """
+    return RepoFacts()
+
+
+# -----------------------------------------------------------------------------
+class RepoFacts(object):
+    """
+    Facts about the current repository: *toplevel* and *gitdir* are absolute
+    paths ('' outside a repo), *head* is the id of the commit HEAD points at
+    with a trailing newline (or 'ERR:...' if there isn't one yet), and
+    *author* and *committer* are identity lines as 'git var' reports them.
+
+    The toplevel, git dir, and HEAD are read from the filesystem (see
+    gitrefs) when the repository is set up simply enough, otherwise they
+    come from one 'git rev-parse' run. The identities are built from the
+    environment when it has enough information, otherwise from a single
+    'git var -l', and only when asked for.
+    """
+    # -------------------------------------------------------------------------
+    def __init__(self, known=None):
+        """
+        Find the toplevel, git dir, and HEAD, unless they're *known*
+        already, i.e., given in a dict (from ghdaemon, for example) with keys
+        'toplevel', 'gitdir', and 'head'
+        """
+        self.toplevel = ''
+        self.gitdir = ''
+        self.head = 'ERR:not a git repository'
+        self._idents = {}
+        if known is not None:
+            self.toplevel = known['toplevel']
+            self.gitdir = known['gitdir']
+            self.head = known['head']
+            return
+        import gitrefs
+        found = gitrefs.discover()
+        if found == ('', ''):
+            return
+        if found is not None:
+            oid = gitrefs.resolve(found[1])
+            if oid is None or re.match(r'^[0-9a-f]{40}$', oid):
+                (self.toplevel, self.gitdir) = found
+                self.head = oid + '\n' if oid else 'ERR:HEAD^0 missing'
+                return
+        try:
+            (rc, o, e) = catch_all('git rev-parse --show-toplevel --git-dir' +
+                                   ' --verify -q "HEAD^0"')
+        except OSError as e:
+            self.head = 'ERR:' + str(e)
+            return
+        lines = o.split('\n')
+        if rc not in (0, 1) or len(lines) < 3:
+            self.head = 'ERR:' + e
+            return
+        self.toplevel = lines[0]
+        self.gitdir = os.path.abspath(lines[1])
+        if rc == 0 and lines[2]:
+            self.head = lines[2] + '\n'
+        else:
+            self.head = 'ERR:HEAD^0 missing'
+
+    # -------------------------------------------------------------------------
+    @property
+    def author(self):
+        """
+        The author identity line
+        """
+        return self._ident('AUTHOR')
+
+    # -------------------------------------------------------------------------
+    @property
+    def committer(self):
+        """
+        The committer identity line
+        """
+        return self._ident('COMMITTER')
+
+    # -------------------------------------------------------------------------
+    def _ident(self, who):
+        """
+        Return the identity line for *who*, consulting 'git var -l' for both
+        identities the first time the environment doesn't settle it
+        """
+        if who not in self._idents:
+            rval = ident(who)
+            if rval is None:
+                self._load_idents()
+            else:
+                self._idents[who] = rval
+        return self._idents[who]
+
+    # -------------------------------------------------------------------------
+    def _load_idents(self):
+        """
+        Fill in any identities not already known from 'git var -l'
+        """
+        r = catch_stdout('git var -l')
+        for who in ['AUTHOR', 'COMMITTER']:
+            if who in self._idents:
+                continue
+            line = select('GIT_%s_IDENT=' % who, r.split('\n'))
+            if line:
+                self._idents[who] = line.split('=', 1)[1] + '\n'
+            else:
+                self._idents[who] = r if r.startswith('ERR:') else 'ERR:'
+
+
+# -----------------------------------------------------------------------------
+def rev_parse(rev):
+    """
+    Return the object id *rev* names, with a trailing newline as 'git
+    rev-parse' would write it, or 'ERR:...' if it can't be resolved. Queries
+    go to a warm 'git cat-file --batch-check' process when possible.
+    """
+    reply = git_batch('git cat-file --batch-check', rev)
+    if reply is None:
+        return catch_stdout('git rev-parse --verify "%s"' % rev)
+    if reply.endswith(' missing') or reply.endswith(' ambiguous'):
+        return 'ERR:' + reply
+    return reply.split()[0] + '\n'
+
+
+# -----------------------------------------------------------------------------
+def rewrite_msg(filename, want_version, want_cid, backup=True):
+    """
+    Rewrite commit message file *filename* the way save_new() would lay it
+    out, adding a Version: line if *want_version* and a Change-Id: line if
+    *want_cid* unless they're already there, without holding the message in
+    memory. The file is read line by line, once to find the trailers and
+    measure the message and, if a change id is needed, once more to hash it.
+    The payload is then copied to a temporary file in the same directory,
+    with comment lines set aside in a spool file to be appended after the
+    trailers, and the temporary file is renamed over *filename*. If *backup*,
+    the original is kept as *filename*.old.
+
+    If the trailers asked for are already there and not empty, the file is
+    left alone (no write, rename, or backup) and False is returned.
+    Otherwise, True is returned.
+    """
+    import hashlib
+    import shutil
+    import tempfile
+
+    (version, cid, last, size, nlines) = ('', '', '', 0, 0)
+    f = open(filename, 'rU')
+    for l in f:
+        l = l.rstrip('\n')
+        size += len(l)
+        nlines += 1
+        if l.startswith('#'):
+            continue
+        elif 'Version:' in l:
+            version = l
+        elif 'Change-Id:' in l:
+            cid = l
+        else:
+            last = l
+    f.close()
+
+    need_version = (want_version and
+                    version.replace('Version:', '').strip() == '')
+    need_cid = want_cid and cid.replace('Change-Id:', '').strip() == ''
+    if not need_version and not need_cid:
+        return False
+
+    if need_version:
+        version = get_version()
+
+    if need_cid:
+        header = commit_header(*change_id_parts())
+        h = hashlib.sha1('commit %d\0%s' %
+                         (len(header) + size + max(0, nlines - 1), header))
+        f = open(filename, 'rU')
+        sep = ''
+        for l in f:
+            h.update(sep + l.rstrip('\n'))
+            sep = '\n'
+        f.close()
+        cid = 'Change-Id: I' + h.hexdigest() + '\n'
+
+    (fd, tmpname) = tempfile.mkstemp(dir=os.path.dirname(filename) or '.',
+                                     prefix=os.path.basename(filename) + '.')
+    renamed = False
+    try:
+        o = os.fdopen(fd, 'w')
+        spool = tempfile.TemporaryFile()
+        f = open(filename, 'rU')
+        for l in f:
+            l = l.rstrip('\n')
+            if l.startswith('#'):
+                spool.write(l + '\n')
+            elif 'Version:' not in l and 'Change-Id:' not in l:
+                o.write(l + '\n')
+        f.close()
+        if 0 < len(last):
+            o.write('\n')
+        o.write(version.strip() + '\n')
+        o.write(cid.strip() + '\n')
+        spool.seek(0)
+        shutil.copyfileobj(spool, o)
+        spool.close()
+        o.close()
+        os.chmod(tmpname, os.stat(filename).st_mode & 0o7777)
+        if backup:
+            old = filename + '.old'
+            if os.path.lexists(old):
+                os.unlink(old)
+            try:
+                os.link(filename, old)
+            except OSError:
+                shutil.copy2(filename, old)
+        os.rename(tmpname, filename)
+        renamed = True
+    finally:
+        if not renamed:
+            os.unlink(tmpname)
+    return True
 
 
 # -----------------------------------------------------------------------------
@@ -158,12 +1188,8 @@ def save_new(filename, payload, version, cid, comments):
     """
     newname = filename + ".new"
     o = open(newname, 'w')
-    o.writelines([p + '\n' for p in payload])
-    if 0 < len(payload[-1]):
-        o.write("\n")
-    o.writelines([version.strip() + '\n'])
-    o.writelines([cid.strip() + '\n'])
-    o.writelines([p + '\n' for p in comments])
+    o.writelines([p + '\n' for p in join_msg(payload, version, cid,
+                                               comments)])
     o.close()
     return newname
 
@@ -201,3 +1227,464 @@ def split_msg(msg):
         else:
             payload.append(l)
     return(payload, version, cid, comments)
+
+
+# -----------------------------------------------------------------------------
+def staged_version(vpath):
+    """
+    Look up version file *vpath* in the index and in HEAD with one round trip
+    to a warm 'git cat-file --batch' process. Return a tuple (version,
+    staged): the version declared in the staged copy of the file (None if it
+    isn't in the index or declares no version) and whether the staged copy
+    differs from HEAD's, i.e., whether it will change in the next commit.
+    """
+    rel = os.path.relpath(vpath, repo_facts().toplevel or '.')
+    rel = rel.replace(os.sep, '/')
+    replies = git_batch_many('git cat-file --batch',
+                             [':' + rel, 'HEAD:' + rel], body=True)
+    if replies is None:
+        replies = []
+        for spec in [':' + rel, 'HEAD:' + rel]:
+            oid = rev_parse(spec)
+            if oid.startswith('ERR:'):
+                replies.append((spec + ' missing', ''))
+            else:
+                data = cat_file(spec)
+                replies.append(('%s blob %d' % (oid.strip(), len(data)),
+                                data))
+    oids = ['' if h.endswith((' missing', ' ambiguous')) else h.split()[0]
+            for (h, data) in replies]
+    if not oids[0]:
+        return (None, False)
+    return (version_from_file(vpath, replies[0][1]), oids[0] != oids[1])
+
+
+# -----------------------------------------------------------------------------
+def tagged_commits():
+    """
+    Return the ids of the commits that annotated tags point at
+    """
+    return sorted(annotated_tags().keys())
+
+
+# -----------------------------------------------------------------------------
+def tags_stamp(facts):
+    """
+    Return a fingerprint of the tags in the repo described by *facts*: the
+    [mtime, size] of packed-refs and the [path, mtime] of each directory
+    under refs/tags. Creating, moving, or deleting a loose tag renames a file
+    in or out of its directory, which changes the directory's mtime.
+    """
+    rval = []
+    if not facts.gitdir:
+        return rval
+    import gitrefs
+    common = gitrefs.common_dir(facts.gitdir)
+    try:
+        st = os.stat(os.path.join(common, 'packed-refs'))
+        rval.append([st.st_mtime, st.st_size])
+    except OSError:
+        rval.append(None)
+    top = os.path.join(common, 'refs', 'tags')
+    for (r, d, f) in os.walk(top):
+        d.sort()
+        try:
+            rval.append([os.path.relpath(r, top), os.stat(r).st_mtime])
+        except OSError:
+            pass
+    return rval
+
+
+# -----------------------------------------------------------------------------
+class TagIndex(object):
+    """
+    The annotated tags and the commit graph, read into memory to answer
+    'git describe' questions -- which tag is nearest to a commit, and how
+    many commits past it is the commit -- without running git describe.
+    Parents and commit dates are read with 'git rev-list --parents' as they
+    are needed and kept, so one TagIndex can answer many queries about the
+    same history cheaply.
+
+    describe() follows git describe's own walk (newest commit first,
+    counting commits not reachable from each of up to DESCRIBE_CANDIDATES
+    tags), so it gets the same answer, including on histories with merges
+    where that isn't the true shortest distance.
+    """
+    # -------------------------------------------------------------------------
+    def __init__(self, tags=None):
+        """
+        Start with the annotated tags in the repo, or *tags* if given (a
+        dict like annotated_tags() returns)
+        """
+        self.tags = annotated_tags() if tags is None else tags
+        self.parents = {}
+        self.dates = {}
+        self.tips = []
+
+    # -------------------------------------------------------------------------
+    def describe(self, oid):
+        """
+        Return (tag, distance) for the annotated tag nearest to commit *oid*
+        (a commit id or anything else rev_parse() understands), or (None, 0)
+        if no tag is reachable from it
+        """
+        import heapq
+        if oid not in self.parents:
+            oid = rev_parse(oid + '^0').strip()
+        self.load(oid)
+        if oid not in self.parents:
+            return (None, 0)
+        if oid in self.tags:
+            return (self.tags[oid][0][1], 0)
+
+        # flags[c] has bit 0 set once c has been queued and bit n set if c
+        # is reachable from the nth candidate. Candidates are [name, depth,
+        # flag, order].
+        flags = {oid: 1}
+        queue = []
+        seq = [0]
+
+        def push(c):
+            seq[0] += 1
+            heapq.heappush(queue, (-self.dates[c], seq[0], c))
+
+        def visit(c):
+            for p in self.parents[c]:
+                if not flags.get(p, 0) & 1:
+                    push(p)
+                flags[p] = flags.get(p, 0) | flags[c]
+
+        push(oid)
+        matches = []
+        gave_up = None
+        seen = 0
+        while queue:
+            c = heapq.heappop(queue)[2]
+            seen += 1
+            if c in self.tags:
+                if len(matches) < DESCRIBE_CANDIDATES:
+                    flag = 1 << (len(matches) + 1)
+                    matches.append([self.tags[c][0][1], seen - 1, flag,
+                                    len(matches)])
+                    flags[c] |= flag
+                else:
+                    gave_up = c
+                    break
+            for t in matches:
+                if not flags[c] & t[2]:
+                    t[1] += 1
+            if matches and not queue:
+                depth = min([t[1] for t in matches])
+                within = 0
+                for t in matches:
+                    if t[1] == depth:
+                        within |= t[2]
+                if flags[c] & within == within:
+                    break
+            visit(c)
+        if not matches:
+            return (None, 0)
+
+        # Finish counting for the best candidate
+        matches.sort(key=lambda t: (t[1], t[3]))
+        best = matches[0]
+        if gave_up is not None:
+            push(gave_up)
+        while queue:
+            c = heapq.heappop(queue)[2]
+            if flags[c] & best[2]:
+                if not [x for x in queue if not flags[x[2]] & best[2]]:
+                    break
+            else:
+                best[1] += 1
+            visit(c)
+        return (best[0], best[1])
+
+    # -------------------------------------------------------------------------
+    def load(self, rev):
+        """
+        Read the parents and commit dates of *rev* and its ancestors,
+        skipping what has already been read
+        """
+        if rev in self.parents:
+            return
+        cmd = 'git rev-list --parents --timestamp %s' % rev
+        if self.tips:
+            cmd += ' --not ' + ' '.join(self.tips)
+        r = catch_stdout(cmd)
+        if r.startswith('ERR:'):
+            return
+        for line in r.split('\n'):
+            f = line.split()
+            if 1 < len(f):
+                self.dates[f[1]] = int(f[0])
+                self.parents[f[1]] = f[2:]
+        self.tips.append(rev)
+
+
+# -----------------------------------------------------------------------------
+def trace(cmd, start, nin, nout, rc):
+    """
+    Record that *cmd*, started at time *start*, has finished, having been
+    sent *nin* bytes and returned *nout* with exit status *rc* (None for
+    queries to a worker that's still running). Callers check that tracing is
+    on ($GITHOOKS_TRACE is set) before timing anything, so this costs nothing
+    when it's off.
+    """
+    _trace.append({'cmd': cmd,
+                   'ms': round(1000.0 * (time.time() - start), 3),
+                   'in': nin,
+                   'out': nout,
+                   'rc': rc})
+
+
+# -----------------------------------------------------------------------------
+def trace_report():
+    """
+    Report what trace() recorded. If $GITHOOKS_TRACE is '1', write a table to
+    stderr. Otherwise it names a file, and a JSON object describing this run
+    is appended to it as a single line.
+    """
+    if _trace is None:
+        return
+    import json
+    dest = os.getenv('GITHOOKS_TRACE')
+    if dest == '1':
+        sys.stderr.write('%10s %4s %8s %8s  %s\n' %
+                         ('ms', 'rc', 'in', 'out', 'command'))
+        for t in _trace:
+            sys.stderr.write('%10.3f %4s %8d %8d  %s\n' %
+                             (t['ms'], '-' if t['rc'] is None else t['rc'],
+                              t['in'], t['out'], t['cmd']))
+        sys.stderr.write('%10.3f %4s %8s %8s  %d commands\n' %
+                         (sum([t['ms'] for t in _trace]), '', '', '',
+                          len(_trace)))
+    else:
+        f = open(dest, 'a')
+        json.dump({'argv': sys.argv, 'pid': os.getpid(),
+                   'calls': _trace}, f)
+        f.write('\n')
+        f.close()
+
+
+atexit.register(trace_report)
+
+
+# -----------------------------------------------------------------------------
+def version_at_roots(groot, roots, prune):
+    """
+    Return the paths, relative to *groot*, of the files named version.py at
+    the top of each of *roots* (not below them) that aren't *prune*d, in the
+    order get_version_path prefers them
+    """
+    rval = []
+    for r in roots:
+        rel = (r.strip('/') + '/' if r.strip('/') else '') + 'version.py'
+        if (os.path.isfile(os.path.join(groot, rel)) and
+                not version_pruned(rel, prune)):
+            rval.append(rel)
+    return sorted(set(rval), key=lambda p: (p.count('/'), p))
+
+
+# -----------------------------------------------------------------------------
+def version_candidates(roots, prune, which):
+    """
+    Ask 'git ls-files *which*' for files named version.py under *roots*.
+    Return their paths relative to the toplevel, minus any that are *prune*d,
+    in the order get_version_path prefers them, or None if git fails.
+    """
+    specs = ' '.join(["':(top,glob)%s**/version.py'" %
+                      (r.strip('/') + '/' if r.strip('/') else '')
+                      for r in roots])
+    r = catch_stdout('git ls-files -z --full-name %s -- %s' % (which, specs))
+    if r.startswith('ERR:'):
+        return None
+    rval = [p for p in r.split('\0')
+            if p and not version_pruned(p, prune)]
+    return sorted(rval, key=lambda p: (p.count('/'), p))
+
+
+# -----------------------------------------------------------------------------
+def version_fallback(groot):
+    """
+    For projects without a version.py, return the path of pyproject.toml or
+    setup.cfg at *groot* if it declares a version statically, otherwise ''
+    """
+    for name in ['pyproject.toml', 'setup.cfg']:
+        path = os.path.join(groot, name)
+        if os.path.isfile(path) and version_from_file(path) is not None:
+            return path
+    return ''
+
+
+# -----------------------------------------------------------------------------
+def version_from_cfg(text):
+    """
+    Return the version in the [metadata] section of setup.cfg content *text*,
+    or None. 'attr:' and 'file:' directives need code or other files to
+    resolve so they count as no version.
+    """
+    try:
+        import ConfigParser as configparser
+    except ImportError:
+        import configparser
+    import io
+    cfg = configparser.RawConfigParser()
+    read = getattr(cfg, 'read_file', None) or cfg.readfp
+    try:
+        read(io.StringIO(text.decode('utf-8')
+                         if isinstance(text, bytes) else text))
+        rval = cfg.get('metadata', 'version').strip()
+    except (configparser.Error, UnicodeError):
+        return None
+    if not rval or rval.startswith(('attr:', 'file:')):
+        return None
+    return str(rval)
+
+
+# -----------------------------------------------------------------------------
+def version_from_file(path, text=None):
+    """
+    Return the version declared in the file at *path* without executing
+    anything, or None if there isn't one. *text* is the file's content if the
+    caller already has it (e.g., from a git blob). The format follows the
+    file name: pyproject.toml, setup.cfg, or else Python source setting
+    __version__.
+    """
+    if text is None:
+        try:
+            f = open(path, 'r')
+            text = f.read()
+            f.close()
+        except IOError:
+            return None
+    name = os.path.basename(path)
+    if name == 'pyproject.toml':
+        return version_from_toml(text)
+    elif name == 'setup.cfg':
+        return version_from_cfg(text)
+    return version_from_py(text)
+
+
+# -----------------------------------------------------------------------------
+def version_from_py(text):
+    """
+    Return the value assigned to __version__ in Python source *text*, or
+    None. The usual one-line string assignment is picked out with a regex;
+    anything else (tuples, multiple assignments, ...) is found by walking the
+    parse tree. A tuple like (1, 2, 3) becomes '1.2.3'. The code is never
+    run.
+    """
+    m = re.findall(r'^__version__\s*=\s*([\'"])([^\'"\\\n]*)\1\s*(?:#.*)?$',
+                   text, re.MULTILINE)
+    if len(m) == 1:
+        return m[0][1]
+
+    import ast
+    try:
+        tree = ast.parse(text)
+    except (SyntaxError, ValueError, TypeError):
+        return None
+    rval = None
+    for node in tree.body:
+        if not isinstance(node, ast.Assign):
+            continue
+        if not any(isinstance(t, ast.Name) and t.id == '__version__'
+                   for t in node.targets):
+            continue
+        try:
+            value = ast.literal_eval(node.value)
+        except ValueError:
+            continue
+        if isinstance(value, tuple):
+            value = '.'.join([str(x) for x in value])
+        rval = str(value)
+    return rval
+
+
+# -----------------------------------------------------------------------------
+def version_from_toml(text):
+    """
+    Return the version in the [project] or [tool.poetry] table of
+    pyproject.toml content *text*, or None. Only the simple 'version =
+    "..."' form is understood.
+    """
+    section = None
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('['):
+            section = line.strip('[] ')
+        elif section in ('project', 'tool.poetry'):
+            m = re.match(r'^version\s*=\s*([\'"])([^\'"]*)\1\s*(?:#.*)?$',
+                         line)
+            if m:
+                return m.group(2)
+    return None
+
+
+# -----------------------------------------------------------------------------
+def version_indexed(roots, prune):
+    """
+    Like version_candidates(roots, prune, '--cached'), but read the paths
+    from the index file instead of running git ls-files. Return None if the
+    index can't be read.
+    """
+    import gitindex
+    index = gitindex.load(index_path(repo_facts()))
+    if index is None:
+        return None
+    rval = []
+    try:
+        for r in roots:
+            prefix = r.strip('/') + '/' if r.strip('/') else ''
+            for p in index.prefixed(prefix):
+                if (p == 'version.py' or p.endswith('/version.py')) and \
+                   not version_pruned(p, prune):
+                    rval.append(p)
+    finally:
+        index.close()
+    return sorted(set(rval), key=lambda p: (p.count('/'), p))
+
+
+# -----------------------------------------------------------------------------
+def version_pruned(path, prune):
+    """
+    Return True if any directory component of *path* matches one of the
+    fnmatch patterns in *prune*
+    """
+    import fnmatch
+    for part in path.split('/')[:-1]:
+        if any(fnmatch.fnmatch(part, pat) for pat in prune):
+            return True
+    return False
+
+
+# -----------------------------------------------------------------------------
+def version_walk(groot, roots, prune):
+    """
+    Search the directory tree under *groot* for version.py without git's
+    help, one level at a time so we stop at the shallowest depth that has
+    one. Directories matching *prune* are not entered. Return the matching
+    paths, relative to *groot*, in preference order.
+    """
+    import fnmatch
+    level = [r.strip('/') for r in roots]
+    while level:
+        found = [os.path.join(d, 'version.py') for d in level
+                 if os.path.isfile(os.path.join(groot, d, 'version.py'))]
+        if found:
+            return sorted(found)
+        below = []
+        for d in level:
+            try:
+                names = sorted(os.listdir(os.path.join(groot, d) or '.'))
+            except OSError:
+                continue
+            for name in names:
+                path = os.path.join(d, name)
+                full = os.path.join(groot, path)
+                if (os.path.isdir(full) and not os.path.islink(full) and
+                        not any(fnmatch.fnmatch(name, p) for p in prune)):
+                    below.append(path)
+        level = below
+    return []
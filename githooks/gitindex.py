@@ -0,0 +1,419 @@
+"""
+Read git's index file directly
+
+The hooks only need a few things from the index -- the id of the tree 'git
+write-tree' would write for it, whether a file is staged and what its blob
+id is, and which files named version.py are tracked -- and asking git for
+them costs a process and, for write-tree, writes tree objects into the
+repository as a side effect.
+
+Index maps the index file and finds where each entry starts, but only
+decodes an entry when it's asked for, so looking up one path is a binary
+search over the entry offsets. Versions 2, 3, and 4 (with its
+prefix-compressed paths) are understood. Finding the offsets means stepping
+through every entry, though, which in Python costs more than starting git
+once the index is bigger than MAX_BYTES (see bench/bench_index.py), so
+load() declines larger indexes, as it does split and sparse ones, and the
+caller should ask git.
+
+tree_id() works out the tree id using the cached tree ids git keeps in the
+index's TREE extension for the directories that haven't changed, so usually
+only the directories with staged changes have to be hashed. Anything it
+doesn't handle (unmerged entries, intent-to-add entries, indexes load()
+declines, SHA-256 repositories) makes it return None, and the caller should
+run 'git write-tree' instead.
+"""
+import array
+import binascii
+import hashlib
+import mmap
+import os
+import struct
+
+# Flag bits in an index entry
+STAGE_MASK = 0x3000
+EXTENDED = 0x4000
+NAME_MASK = 0x0fff
+INTENT_TO_ADD = 0x2000          # in the extended flags
+
+# Extensions we can't work without understanding: with 'link' (split
+# index) most entries are in another file, and with 'sdir' (sparse index)
+# some entries stand for whole directories
+UNSUPPORTED = ['link', 'sdir']
+
+# Largest index file (in bytes) load() will read; above this, git answers
+# faster than scanning the entries here. None for no limit.
+MAX_BYTES = 128 * 1024
+
+
+# -----------------------------------------------------------------------------
+def cached_trees(data):
+    """
+    Parse the body of a TREE extension, *data*, and return the root of the
+    cached tree as a CachedTree, or None if there isn't one
+    """
+    (node, pos) = cached_tree_node(data, 0)
+    return node
+
+
+# -----------------------------------------------------------------------------
+def cached_tree_node(data, pos):
+    """
+    Parse one cached tree entry and its subtrees from *data* starting at
+    *pos*. Return the CachedTree and the position after it.
+    """
+    if len(data) <= pos:
+        return (None, pos)
+    end = data.index(b'\0', pos)
+    name = data[pos:end]
+    nl = data.index(b'\n', end)
+    (count, nsub) = [int(x) for x in data[end + 1:nl].split(b' ')]
+    pos = nl + 1
+    oid = None
+    if 0 <= count:
+        oid = data[pos:pos + 20]
+        pos += 20
+    node = CachedTree(name, count, oid)
+    for i in range(nsub):
+        (child, pos) = cached_tree_node(data, pos)
+        node.children[child.name] = child
+    return (node, pos)
+
+
+# -----------------------------------------------------------------------------
+def load(path):
+    """
+    Return an Index for the index file at *path*, or None if it's missing,
+    empty, bigger than MAX_BYTES, or not something we understand
+    """
+    try:
+        if MAX_BYTES is not None and MAX_BYTES < os.path.getsize(path):
+            return None
+        return Index(path)
+    except (IOError, OSError, ValueError, struct.error):
+        return None
+
+
+# -----------------------------------------------------------------------------
+def sha1_repo(gitdir):
+    """
+    Return False if the repository at *gitdir* uses an object format other
+    than SHA-1, otherwise True
+    """
+    try:
+        f = open(os.path.join(gitdir, 'config'), 'r')
+        try:
+            text = f.read()
+        finally:
+            f.close()
+    except (IOError, OSError):
+        return True
+    for line in text.split('\n'):
+        (name, sep, value) = line.partition('=')
+        if name.strip().lower() == 'objectformat':
+            return value.strip().lower() == 'sha1'
+    return True
+
+
+# -----------------------------------------------------------------------------
+def tree_id(path, gitdir=None):
+    """
+    Return the id (hex, no newline) of the tree 'git write-tree' would write
+    for the index at *path*, without writing anything, or None if it can't
+    be worked out here. *gitdir*, if given, is checked for a non-SHA-1
+    object format.
+    """
+    if gitdir and not sha1_repo(gitdir):
+        return None
+    index = load(path)
+    if index is None:
+        return None
+    try:
+        extensions = index.extensions()
+        if not index.writable:
+            return None
+        root = None
+        if 'TREE' in extensions:
+            root = cached_trees(extensions['TREE'])
+        (oid, pos) = tree_oid(index, 0, b'', root)
+    finally:
+        index.close()
+    return binascii.hexlify(oid).decode('ascii')
+
+
+# -----------------------------------------------------------------------------
+def tree_oid(index, pos, prefix, cached):
+    """
+    Return the binary id of the tree for directory *prefix* ('' or ending in
+    '/'), whose entries start at *index*[*pos*], and the position of the
+    first entry after them. *cached* is the CachedTree for the directory, if
+    there is one; if it's valid, its id is used without looking at the
+    entries.
+    """
+    if cached is not None and cached.oid is not None:
+        return (cached.oid, pos + cached.count)
+    body = []
+    while pos < len(index) and index.path(pos).startswith(prefix):
+        rest = index.path(pos)[len(prefix):]
+        if b'/' in rest:
+            name = rest[:rest.index(b'/')]
+            child = None
+            if cached is not None:
+                child = cached.children.get(name)
+            (oid, pos) = tree_oid(index, pos, prefix + name + b'/', child)
+            body.append(b'40000 ' + name + b'\0' + oid)
+        else:
+            entry = index[pos]
+            body.append(('%o ' % entry.mode).encode('ascii') + rest + b'\0' +
+                        entry.oid)
+            pos += 1
+    body = b''.join(body)
+    h = hashlib.sha1(('tree %d\0' % len(body)).encode('ascii') + body)
+    return (h.digest(), pos)
+
+
+# -----------------------------------------------------------------------------
+class CachedTree(object):
+    """
+    One directory's entry in the index's TREE extension: its *name*, the
+    number of index entries it covers (*count*, -1 if invalidated), its tree
+    id if valid, and its subdirectories by name
+    """
+    # -------------------------------------------------------------------------
+    def __init__(self, name, count, oid):
+        """
+        Set the attributes
+        """
+        self.name = name
+        self.count = count
+        self.oid = oid
+        self.children = {}
+
+
+# -----------------------------------------------------------------------------
+class Entry(object):
+    """
+    One index entry: its path, mode, binary object id, flags, and extended
+    flags
+    """
+    __slots__ = ['path', 'mode', 'oid', 'flags', 'xflags']
+
+    # -------------------------------------------------------------------------
+    def __init__(self, path, mode, oid, flags, xflags):
+        """
+        Set the attributes
+        """
+        self.path = path
+        self.mode = mode
+        self.oid = oid
+        self.flags = flags
+        self.xflags = xflags
+
+    # -------------------------------------------------------------------------
+    @property
+    def hexoid(self):
+        """
+        The object id in hex
+        """
+        return binascii.hexlify(self.oid).decode('ascii')
+
+    # -------------------------------------------------------------------------
+    @property
+    def stage(self):
+        """
+        0 for a merged entry, 1-3 for the sides of a conflict
+        """
+        return (self.flags & STAGE_MASK) >> 12
+
+
+# -----------------------------------------------------------------------------
+class Index(object):
+    """
+    A memory-mapped index file. len() is the number of entries, index[i] is
+    the i'th as an Entry, and iterating gives all of them in order. Only the
+    offset of each entry (and for version 4, its path, since each path is
+    stored relative to the one before) is kept; entries are decoded when
+    they're asked for. writable is False if any entry is unmerged or
+    intent-to-add, which 'git write-tree' would refuse or leave out.
+    """
+    # -------------------------------------------------------------------------
+    def __init__(self, path):
+        """
+        Map the index file at *path* and find its entries. Raise ValueError
+        if it isn't an index we understand.
+        """
+        f = open(path, 'rb')
+        try:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        scanned = False
+        try:
+            self.scan()
+            scanned = True
+        finally:
+            if not scanned:
+                self.map.close()
+
+    # -------------------------------------------------------------------------
+    def __getitem__(self, i):
+        """
+        Decode and return entry *i*
+        """
+        off = self.offsets[i]
+        (mode,) = struct.unpack_from('>L', self.map, off + 24)
+        (flags,) = struct.unpack_from('>H', self.map, off + 60)
+        xflags = 0
+        if flags & EXTENDED:
+            (xflags,) = struct.unpack_from('>H', self.map, off + 62)
+        return Entry(self.path(i), mode, self.map[off + 40:off + 60], flags,
+                     xflags)
+
+    # -------------------------------------------------------------------------
+    def __iter__(self):
+        """
+        Generate the entries in order
+        """
+        for i in range(len(self.offsets)):
+            yield self[i]
+
+    # -------------------------------------------------------------------------
+    def __len__(self):
+        """
+        The number of entries
+        """
+        return len(self.offsets)
+
+    # -------------------------------------------------------------------------
+    def bisect(self, path):
+        """
+        Return the position of the first entry whose path is not less than
+        *path*
+        """
+        (lo, hi) = (0, len(self.offsets))
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.path(mid) < path:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    # -------------------------------------------------------------------------
+    def close(self):
+        """
+        Unmap the file
+        """
+        self.map.close()
+
+    # -------------------------------------------------------------------------
+    def extensions(self):
+        """
+        Return a dict of the extension bodies by signature
+        """
+        rval = {}
+        pos = self.end
+        while pos + 8 <= len(self.map) - 20:
+            (sig, size) = struct.unpack_from('>4sL', self.map, pos)
+            rval[sig.decode('latin-1')] = self.map[pos + 8:pos + 8 + size]
+            pos += 8 + size
+        return rval
+
+    # -------------------------------------------------------------------------
+    def lookup(self, path):
+        """
+        Return the Entry for *path* (a str of bytes, relative to the top of
+        the working tree, with '/' separators), or None if it isn't in the
+        index. For a path with conflicts, the lowest stage entry is returned.
+        """
+        i = self.bisect(path)
+        if i < len(self.offsets) and self.path(i) == path:
+            return self[i]
+        return None
+
+    # -------------------------------------------------------------------------
+    def path(self, i):
+        """
+        Return the path of entry *i*
+        """
+        if self.paths is not None:
+            return self.paths[i]
+        off = self.offsets[i]
+        (flags,) = struct.unpack_from('>H', self.map, off + 60)
+        start = off + (64 if flags & EXTENDED else 62)
+        size = flags & NAME_MASK
+        if size == NAME_MASK:
+            size = self.map.find(b'\0', start) - start
+        return self.map[start:start + size]
+
+    # -------------------------------------------------------------------------
+    def prefixed(self, prefix):
+        """
+        Generate the paths that start with *prefix*, in order, without
+        repeats for conflicted paths
+        """
+        prev = None
+        for i in range(self.bisect(prefix), len(self.offsets)):
+            path = self.path(i)
+            if not path.startswith(prefix):
+                break
+            if path != prev:
+                yield path
+            prev = path
+
+    # -------------------------------------------------------------------------
+    def scan(self):
+        """
+        Read the header, record where each entry starts, and note whether
+        any is unmerged or intent-to-add. Raise ValueError if the index has
+        an extension we don't understand (see UNSUPPORTED).
+        """
+        (sig, version, count) = struct.unpack_from('>4sLL', self.map, 0)
+        if sig != b'DIRC' or version not in (2, 3, 4):
+            raise ValueError('unsupported index')
+        self.version = version
+        self.offsets = array.array('L')
+        self.paths = [] if version == 4 else None
+        self.writable = True
+        pos = 12
+        prev = b''
+        for i in range(count):
+            self.offsets.append(pos)
+            (flags,) = struct.unpack_from('>H', self.map, pos + 60)
+            if flags & STAGE_MASK:
+                self.writable = False
+            elif flags & EXTENDED:
+                (xflags,) = struct.unpack_from('>H', self.map, pos + 62)
+                if xflags & INTENT_TO_ADD:
+                    self.writable = False
+            start = pos + (64 if flags & EXTENDED else 62)
+            if version == 4:
+                (strip, start) = self.varint(start)
+                end = self.map.find(b'\0', start)
+                prev = prev[:len(prev) - strip] + self.map[start:end]
+                self.paths.append(prev)
+                pos = end + 1
+            else:
+                size = flags & NAME_MASK
+                if size == NAME_MASK:
+                    size = self.map.find(b'\0', start) - start
+                # Entries are padded with 1-8 NULs to a multiple of 8 bytes
+                pos += ((start + size - pos) // 8 + 1) * 8
+        self.end = pos
+        if [x for x in UNSUPPORTED if x in self.extensions()]:
+            raise ValueError('unsupported index extension')
+
+    # -------------------------------------------------------------------------
+    def varint(self, pos):
+        """
+        Decode the variable-length integer at *pos*, as index version 4
+        stores the number of bytes of the previous path to drop. Return it
+        and the position after it.
+        """
+        c = ord(self.map[pos:pos + 1])
+        val = c & 0x7f
+        while c & 0x80:
+            pos += 1
+            c = ord(self.map[pos:pos + 1])
+            val = ((val + 1) << 7) | (c & 0x7f)
+        return (val, pos + 1)
@@ -0,0 +1,198 @@
+"""
+Find the repository and read its refs directly
+
+Most hook runs need to know where the repository is and what commit HEAD
+points at, and pre-commit.ver needs the tags. Both are a few small files
+under the git dir, so reading them here saves starting git for them.
+
+discover() finds the working tree and git dir the way git does for the
+common cases: $GIT_DIR (and $GIT_WORK_TREE) if set, otherwise the nearest
+directory at or above the current one with a .git directory, or a .git file
+pointing at one (as for linked worktrees and submodules). Refs shared by
+all worktrees are read from the common dir named by $GIT_COMMON_DIR or the
+git dir's 'commondir' file. packed-refs is parsed once and kept until its
+mtime or size changes.
+
+Setups this doesn't handle -- core.worktree, $GIT_CEILING_DIRECTORIES, bare
+repositories, reftable ref storage -- make discover() return None, and the
+caller should ask git instead.
+"""
+import os
+import re
+
+# Parsed packed-refs files by path: (stamp, refs, peeled, fully peeled)
+_packed = {}
+
+# Refs that each worktree has its own copy of, in its own git dir
+PER_WORKTREE = ['refs/bisect/', 'refs/worktree/', 'refs/rewritten/']
+
+
+# -----------------------------------------------------------------------------
+def common_dir(gitdir):
+    """
+    Return the directory holding the refs and objects shared by all the
+    worktrees of the repository with git dir *gitdir*
+    """
+    if os.getenv('GIT_COMMON_DIR'):
+        return os.path.abspath(os.getenv('GIT_COMMON_DIR'))
+    text = read(os.path.join(gitdir, 'commondir'))
+    if text is None or not text.strip():
+        return gitdir
+    return os.path.normpath(os.path.join(gitdir, text.strip()))
+
+
+# -----------------------------------------------------------------------------
+def discover(start=None):
+    """
+    Return (toplevel, gitdir) for the repository containing directory
+    *start* (default the current directory), ('', '') if there isn't one, or
+    None if it's set up in a way we leave to git
+    """
+    if os.getenv('GIT_CEILING_DIRECTORIES'):
+        return None
+    start = os.path.realpath(start or os.getcwd())
+    if os.getenv('GIT_DIR'):
+        gitdir = os.path.abspath(os.getenv('GIT_DIR'))
+        toplevel = os.path.realpath(os.getenv('GIT_WORK_TREE') or start)
+    else:
+        (toplevel, gitdir) = ('', '')
+        d = start
+        while True:
+            dotgit = os.path.join(d, '.git')
+            if os.path.isdir(dotgit):
+                (toplevel, gitdir) = (d, dotgit)
+                break
+            elif os.path.isfile(dotgit):
+                text = read(dotgit) or ''
+                if not text.startswith('gitdir:'):
+                    return None
+                gitdir = os.path.normpath(os.path.join(d, text[7:].strip()))
+                toplevel = d
+                break
+            elif is_gitdir(d):
+                return None
+            parent = os.path.dirname(d)
+            if parent == d:
+                return ('', '')
+            d = parent
+    if not is_gitdir(gitdir):
+        return None
+    config = read(os.path.join(common_dir(gitdir), 'config')) or ''
+    if re.search(r'^\s*(worktree\s*=|bare\s*=\s*true)', config,
+                 re.M | re.I) or \
+       re.search(r'^\s*refstorage\s*=', config, re.M | re.I):
+        return None
+    return (toplevel, gitdir)
+
+
+# -----------------------------------------------------------------------------
+def is_gitdir(path):
+    """
+    Return True if *path* looks like a git dir
+    """
+    return (os.path.isfile(os.path.join(path, 'HEAD')) and
+            (os.path.isdir(os.path.join(path, 'objects')) or
+             os.path.isfile(os.path.join(path, 'commondir'))))
+
+
+# -----------------------------------------------------------------------------
+def packed_refs(gitdir):
+    """
+    Return (refs, peeled, fully_peeled) from the packed-refs file of the
+    repository with git dir *gitdir*: a dict of ref names to ids, a dict of
+    ref names to the ids of the commits annotated tags point at, and whether
+    the file lists the peeled id of every annotated tag. The file is only
+    read again if it has changed.
+    """
+    path = os.path.join(common_dir(gitdir), 'packed-refs')
+    try:
+        st = os.stat(path)
+        stamp = (st.st_mtime, st.st_size)
+    except OSError:
+        return ({}, {}, True)
+    if path in _packed and _packed[path][0] == stamp:
+        return _packed[path][1:]
+    (refs, peeled, fully) = ({}, {}, False)
+    last = None
+    for line in (read(path) or '').split('\n'):
+        if line.startswith('#'):
+            fully = ' fully-peeled ' in line + ' '
+        elif line.startswith('^') and last:
+            peeled[last] = line[1:].strip()
+        elif ' ' in line:
+            (oid, last) = line.split(' ', 1)
+            refs[last] = oid
+    _packed[path] = (stamp, refs, peeled, fully)
+    return (refs, peeled, fully)
+
+
+# -----------------------------------------------------------------------------
+def read(path):
+    """
+    Return the contents of the file at *path*, or None if it can't be read
+    """
+    try:
+        f = open(path, 'r')
+        try:
+            return f.read()
+        finally:
+            f.close()
+    except (IOError, OSError):
+        return None
+
+
+# -----------------------------------------------------------------------------
+def read_ref(gitdir, name):
+    """
+    Return the value of ref *name* (e.g., 'HEAD' or 'refs/heads/master') --
+    an object id, or 'ref: <name>' for a symbolic ref -- from its loose file
+    or packed-refs, or None if there's no such ref
+    """
+    if name == 'HEAD' or '/' not in name or \
+       [p for p in PER_WORKTREE if name.startswith(p)]:
+        where = gitdir
+    else:
+        where = common_dir(gitdir)
+    text = read(os.path.join(where, name))
+    if text is not None:
+        return text.strip()
+    return packed_refs(gitdir)[0].get(name)
+
+
+# -----------------------------------------------------------------------------
+def resolve(gitdir, name='HEAD'):
+    """
+    Return the object id ref *name* points at, following symbolic refs, or
+    None if it doesn't point at anything (as for HEAD on an unborn branch)
+    """
+    for depth in range(5):
+        value = read_ref(gitdir, name)
+        if value is None:
+            return None
+        if not value.startswith('ref:'):
+            return value
+        name = value[4:].strip()
+    return None
+
+
+# -----------------------------------------------------------------------------
+def tags(gitdir):
+    """
+    Return a dict of tag names to (id, peeled) for the repository with git
+    dir *gitdir*, loose tags taking precedence over packed ones. peeled is
+    the id of the commit an annotated tag points at, '' for a lightweight
+    tag, or None if it can't be told without reading the tag's object.
+    """
+    (refs, peeled, fully) = packed_refs(gitdir)
+    rval = {}
+    for (name, oid) in refs.items():
+        if name.startswith('refs/tags/'):
+            rval[name[10:]] = (oid, peeled.get(name, '' if fully else None))
+    top = os.path.join(common_dir(gitdir), 'refs', 'tags')
+    for (r, d, f) in os.walk(top):
+        for fname in f:
+            oid = (read(os.path.join(r, fname)) or '').strip()
+            if re.match(r'^[0-9a-f]{40}$', oid):
+                name = os.path.relpath(os.path.join(r, fname), top)
+                rval[name.replace(os.sep, '/')] = (oid, None)
+    return rval
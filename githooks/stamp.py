@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+"""
+Add Version: and Change-Id: trailers to every commit in a range at once
+
+Usage:
+
+    stamp.py [options] RANGE
+
+RANGE is anything 'git rev-list' accepts, e.g. origin/master..HEAD. Each
+commit in it whose message lacks a trailer gets one, laid out the way the
+commit-msg hooks would have done it: the version comes from version.py as
+committed, and the Change-Id is computed from the commit's tree, author,
+committer, and message and the rewritten id of its first parent -- the
+parent the new commit will have, just as the commit-msg hook hashes against
+the HEAD it commits on top of. Commits are rewritten oldest first, with
+descendants of rewritten commits re-parented onto the new ones, and the map
+of old to new commit ids is written to stdout. With --update, HEAD is moved
+to its rewritten commit (the tree, index, and working tree don't change).
+Rewritten commits lose any signature.
+
+All of the reading is done through one 'git cat-file --batch' process and
+all of the writing through one 'git hash-object --stdin-paths' process, and
+versions are parsed once per distinct version.py blob, so stamping a long
+series costs about as much as a few hook runs.
+"""
+import ghlib
+import optparse
+import os
+import sys
+import tempfile
+
+
+# -----------------------------------------------------------------------------
+def main(args):
+    """
+    Entry point
+    """
+    p = optparse.OptionParser(usage='%prog [options] RANGE')
+    p.add_option('-d', '--debug',
+                 action='store_true', default=False, dest='debug',
+                 help='run the debugger')
+    p.add_option('--no-version',
+                 action='store_false', default=True, dest='version',
+                 help="don't add Version: lines")
+    p.add_option('--no-change-id',
+                 action='store_false', default=True, dest='cid',
+                 help="don't add Change-Id: lines")
+    p.add_option('--update',
+                 action='store_true', default=False, dest='update',
+                 help='move HEAD to its rewritten commit')
+    (o, a) = p.parse_args(args)
+    if o.debug:
+        import pdb
+        pdb.set_trace()
+    if len(a) != 2:
+        p.error('a revision range is required')
+
+    revs = ghlib.catch_stdout('git rev-list --reverse --topo-order %s' % a[1])
+    if revs.startswith('ERR:'):
+        sys.exit('stamp: bad revision range %s' % a[1])
+    stamper = Stamper(want_version=o.version, want_cid=o.cid)
+    for oid in revs.split():
+        new = stamper.stamp(oid)
+        if new != oid:
+            sys.stdout.write('%s %s\n' % (oid, new))
+
+    head = ghlib.repo_facts().head.strip()
+    if o.update and stamper.rewritten.get(head, head) != head:
+        r = ghlib.catch_stdout('git update-ref -m "stamp %s" HEAD %s %s' %
+                               (a[1], stamper.rewritten[head], head))
+        if r.startswith('ERR:'):
+            sys.exit('stamp: %s' % r[4:])
+
+
+# -----------------------------------------------------------------------------
+def parse_commit(raw):
+    """
+    Split commit object text *raw* into a list of (name, value) headers and
+    the message. Continuation lines (as in a signature) are kept with the
+    header they belong to.
+    """
+    (head, sep, msg) = raw.partition('\n\n')
+    headers = []
+    for line in head.split('\n'):
+        if line.startswith(' ') and headers:
+            headers[-1] = (headers[-1][0], headers[-1][1] + '\n' + line)
+        else:
+            (name, sep, value) = line.partition(' ')
+            headers.append((name, value))
+    return (headers, msg)
+
+
+# -----------------------------------------------------------------------------
+class Stamper(object):
+    """
+    Rewrites commits to add trailers, remembering what it has rewritten and
+    the versions it has already read
+    """
+    # -------------------------------------------------------------------------
+    def __init__(self, want_version=True, want_cid=True):
+        """
+        Set up to add a Version: line if *want_version* and a Change-Id: line
+        if *want_cid*
+        """
+        self.want_version = want_version
+        self.want_cid = want_cid
+        self.rewritten = {}
+        self.versions = {}
+        self.vrel = None
+        if want_version:
+            facts = ghlib.repo_facts()
+            self.vrel = os.path.relpath(ghlib.get_version_path(),
+                                        facts.toplevel or '.')
+            self.vrel = self.vrel.replace(os.sep, '/')
+
+    # -------------------------------------------------------------------------
+    def message(self, oid, headers, msg, parents):
+        """
+        Return the stamped message for commit *oid* with *headers* and
+        message *msg* whose (rewritten) first parent is parents[0], or None
+        if it already has the trailers wanted
+        """
+        lines = msg.split('\n')
+        if lines and lines[-1] == '':
+            lines.pop()
+        if not lines:
+            lines = ['']
+        (payload, version, cid, comments) = ghlib.split_msg(lines)
+        need_version = (self.want_version and
+                        version.replace('Version:', '').strip() == '')
+        need_cid = (self.want_cid and
+                    cid.replace('Change-Id:', '').strip() == '')
+        if not need_version and not need_cid:
+            return None
+
+        if need_version:
+            vs = self.version(oid)
+            if vs is not None:
+                version = 'Version:   %s' % vs
+        if need_cid:
+            fields = dict(headers)
+            cid = ghlib.change_id_for(fields['tree'],
+                                      parents[0] if parents else None,
+                                      fields['author'], fields['committer'],
+                                      lines)
+        # Collapse runs of blank lines and drop trailing ones, as git commit
+        # would have
+        new = ghlib.join_msg(payload, version, cid, comments)
+        new = [l for (i, l) in enumerate(new) if l or (0 < i and new[i - 1])]
+        while new and new[-1] == '':
+            new.pop()
+        return '\n'.join(new) + '\n'
+
+    # -------------------------------------------------------------------------
+    def stamp(self, oid):
+        """
+        Write a copy of commit *oid* with the trailers wanted and its parents
+        replaced by their rewritten versions. Return the new commit's id, or
+        *oid* if nothing needed to change.
+        """
+        raw = ghlib.cat_file(oid)
+        if raw.startswith('ERR:'):
+            sys.exit('stamp: %s' % raw[4:])
+        (headers, msg) = parse_commit(raw)
+        parents = [self.rewritten.get(v, v)
+                   for (k, v) in headers if k == 'parent']
+        new = self.message(oid, headers, msg, parents)
+        if new is None and parents == [v for (k, v) in headers
+                                       if k == 'parent']:
+            return oid
+
+        text = ''
+        pi = iter(parents)
+        for (name, value) in headers:
+            if name == 'gpgsig':
+                continue
+            if name == 'parent':
+                value = next(pi)
+            text += '%s %s\n' % (name, value)
+        text += '\n' + (msg if new is None else new)
+        newoid = self.write(text)
+        self.rewritten[oid] = newoid
+        return newoid
+
+    # -------------------------------------------------------------------------
+    def version(self, oid):
+        """
+        Return the version declared in version.py as of commit *oid*, or None
+        if it's not there. Versions are remembered by blob id, so each
+        distinct version.py is only read once.
+        """
+        reply = ghlib.git_batch('git cat-file --batch-check',
+                                '%s:%s' % (oid, self.vrel))
+        if reply is None:
+            reply = ghlib.catch_stdout('git rev-parse -q --verify "%s:%s"' %
+                                       (oid, self.vrel))
+        if reply.startswith('ERR:') or reply.endswith(' missing'):
+            return None
+        blob = reply.split()[0]
+        if blob not in self.versions:
+            text = ghlib.cat_file(blob)
+            if text.startswith('ERR:'):
+                self.versions[blob] = None
+            else:
+                self.versions[blob] = ghlib.version_from_file(self.vrel,
+                                                              text)
+        return self.versions[blob]
+
+    # -------------------------------------------------------------------------
+    def write(self, text):
+        """
+        Store commit object *text* in the repository and return its id
+        """
+        (fd, path) = tempfile.mkstemp(prefix='stamp.')
+        try:
+            f = os.fdopen(fd, 'w')
+            f.write(text)
+            f.close()
+            oid = ghlib.git_batch('git hash-object -t commit -w --stdin-paths',
+                                  path)
+            if oid is None:
+                oid = ghlib.catch_stdout('git hash-object -t commit -w "%s"' %
+                                         path)
+        finally:
+            os.unlink(path)
+        if oid.startswith('ERR:'):
+            sys.exit('stamp: %s' % oid[4:])
+        return oid.strip()
+
+
+# -----------------------------------------------------------------------------
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+"""
+Find the commits carrying a Change-Id: or Version:
+
+Usage:
+
+    trailers.py [options] [VALUE ...]
+
+Prints 'commit-id trailer value' for each commit whose Change-Id: or
+Version: line has one of the VALUEs. The trailers are looked up in an index
+kept in the git dir (githooks-trailers.db, an sqlite database), which is
+brought up to date first: only the commits added since the last update --
+those reachable from --revs (default --all) but not from the tips recorded
+last time -- are read, from one 'git log', and their trailers are picked out
+the way the commit-msg hooks find them (see ghlib.split_msg). With no
+VALUEs, the index is just updated.
+"""
+import ghlib
+import optparse
+import os
+import sys
+
+# Name of the index under the (common) git dir
+INDEX_NAME = 'githooks-trailers.db'
+
+# Trailers indexed, by the name split_msg() returns them under
+TRAILERS = ['Change-Id', 'Version']
+
+
+# -----------------------------------------------------------------------------
+def main(args):
+    """
+    Entry point
+    """
+    p = optparse.OptionParser(usage='%prog [options] [VALUE ...]')
+    p.add_option('-d', '--debug',
+                 action='store_true', default=False, dest='debug',
+                 help='run the debugger')
+    p.add_option('-r', '--revs',
+                 action='store', default='--all', dest='revs',
+                 help='commits to index (default --all)')
+    p.add_option('--no-update',
+                 action='store_false', default=True, dest='update',
+                 help="look up VALUEs without updating the index first")
+    (o, a) = p.parse_args(args)
+    if o.debug:
+        import pdb
+        pdb.set_trace()
+
+    facts = ghlib.repo_facts()
+    if not facts.gitdir:
+        sys.exit('trailers: not in a git repository')
+    import gitrefs
+    index = TrailerIndex(os.path.join(gitrefs.common_dir(facts.gitdir),
+                                      INDEX_NAME))
+    try:
+        if o.update:
+            try:
+                count = index.update(o.revs)
+            except ValueError as e:
+                sys.exit('trailers: %s' % e)
+            if not a[1:]:
+                sys.stderr.write('trailers: indexed %d commits\n' % count)
+        for value in a[1:]:
+            for (oid, name) in index.find(value):
+                sys.stdout.write('%s %s: %s\n' % (oid, name, value))
+    finally:
+        index.close()
+
+
+# -----------------------------------------------------------------------------
+def trailer_rows(commits, counter=None):
+    """
+    Generate (name, value, oid) for the Change-Id: and Version: lines of
+    *commits*, as ghlib.log_commits() generates them. If *counter* (a list)
+    is given, each commit is appended to it as it goes by.
+    """
+    for (oid, parents, lines) in commits:
+        if counter is not None:
+            counter.append(oid)
+        (payload, version, cid, comments) = ghlib.split_msg(lines)
+        for (name, line) in zip(TRAILERS, [cid, version]):
+            value = line.split(':', 1)[1].strip() if line else ''
+            if value:
+                yield (name, value, oid)
+
+
+# -----------------------------------------------------------------------------
+class TrailerIndex(object):
+    """
+    The sqlite index of trailers: a row (name, value, oid) per trailer and
+    the commit ids it has been brought up to date with
+    """
+    # -------------------------------------------------------------------------
+    def __init__(self, path):
+        """
+        Open (creating if need be) the index at *path*
+        """
+        import sqlite3
+        self.db = sqlite3.connect(path)
+        self.db.text_factory = str
+        self.db.execute('CREATE TABLE IF NOT EXISTS trailers '
+                        '(name TEXT, value TEXT, oid TEXT, '
+                        'UNIQUE (name, value, oid))')
+        self.db.execute('CREATE INDEX IF NOT EXISTS trailers_value '
+                        'ON trailers (value)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS tips '
+                        '(oid TEXT PRIMARY KEY)')
+        self.db.commit()
+
+    # -------------------------------------------------------------------------
+    def close(self):
+        """
+        Close the database
+        """
+        self.db.close()
+
+    # -------------------------------------------------------------------------
+    def find(self, value):
+        """
+        Return a list of (oid, trailer name) for the commits with a trailer
+        whose value is *value*
+        """
+        return self.db.execute('SELECT oid, name FROM trailers '
+                               'WHERE value = ? ORDER BY oid, name',
+                               (value,)).fetchall()
+
+    # -------------------------------------------------------------------------
+    def tips(self):
+        """
+        Return the commit ids the index was last brought up to date with
+        that are still in the repository
+        """
+        oids = [oid for (oid,) in
+                self.db.execute('SELECT oid FROM tips ORDER BY oid')]
+        replies = ghlib.git_batch_many('git cat-file --batch-check',
+                                       [oid + '^{commit}' for oid in oids])
+        if replies is None:
+            replies = [ghlib.rev_parse(oid + '^{commit}') for oid in oids]
+        return [oid for (oid, reply) in zip(oids, replies)
+                if not reply.startswith('ERR:') and
+                not reply.endswith(' missing')]
+
+    # -------------------------------------------------------------------------
+    def update(self, revs):
+        """
+        Index the commits reachable from *revs* that aren't reachable from
+        the tips indexed before, and remember *revs*' tips in their place:
+        everything reachable from the old tips has been indexed already, so
+        only the new ones are needed to tell what's new next time. Return
+        the number of commits read. Raise ValueError if *revs* is no good.
+        """
+        new = ghlib.catch_stdout('git rev-parse %s' % revs)
+        if new.startswith('ERR:'):
+            raise ValueError(new[4:].strip() or 'bad revision %s' % revs)
+        new = sorted(set([x for x in new.split() if not x.startswith('^')]))
+        old = self.tips()
+        seen = []
+        commits = ghlib.log_commits(' '.join([revs, '--not'] + old))
+        done = False
+        try:
+            self.db.executemany('INSERT OR IGNORE INTO trailers '
+                                'VALUES (?, ?, ?)',
+                                trailer_rows(commits, seen))
+            self.db.execute('DELETE FROM tips')
+            self.db.executemany('INSERT INTO tips VALUES (?)',
+                                [(oid,) for oid in new])
+            done = True
+        finally:
+            if done:
+                self.db.commit()
+            else:
+                self.db.rollback()
+        return len(seen)
+
+
+# -----------------------------------------------------------------------------
+if __name__ == '__main__':
+    main(sys.argv)
@@ -1,9 +1,16 @@
 import contextlib
+import githooks
+from githooks import ghlib
 import os
 import pdb
 import pytest
 import sys
 
+# The githooks modules import their siblings by plain name inside functions,
+# which looks in githooks.__path__, so it has to work from the directories
+# the tests chdir into
+githooks.__path__[:] = [os.path.abspath(p) for p in githooks.__path__]
+
 
 # -----------------------------------------------------------------------------
 def pytest_addoption(parser):
@@ -38,12 +45,21 @@ def pytest_runtest_setup(item):
         pytest.dbgfunc = lambda: None
 
 
+# -----------------------------------------------------------------------------
+@pytest.fixture(autouse=True)
+def memo_reset():
+    """
+    Each test starts with nothing remembered from earlier tests
+    """
+    ghlib.memo_reset()
+
+
 # -----------------------------------------------------------------------------
 @contextlib.contextmanager
 def chdir(target):
     start = os.getcwd()
     os.chdir(target)
-
-    yield
-
-    os.chdir(start)
+    try:
+        yield
+    finally:
+        os.chdir(start)
@@ -0,0 +1,86 @@
+"""
+Tests for audit.py
+"""
+from conftest import chdir
+from githooks import audit
+from githooks import ghlib
+import os
+import pytest
+import sys
+
+AUDIT = os.path.abspath(os.path.join('githooks', 'audit.py'))
+
+
+# -----------------------------------------------------------------------------
+def commit(version, msg):
+    """
+    Commit version.py declaring *version* with message *msg*
+    """
+    open('version.py', 'w').write('__version__ = "%s"\n' % version)
+    ghlib.catch_stdout('git add version.py')
+    ghlib.catch_stdout('git commit --allow-empty -F -', input=msg)
+    return ghlib.rev_parse('HEAD').strip()
+
+
+# -----------------------------------------------------------------------------
+def test_audit(tmpdir):
+    """
+    audit.py should report trailers that disagree with version.py and
+    versions that aren't one past the nearest tag, and nothing else
+    """
+    pytest.dbgfunc()
+    with chdir(str(tmpdir)):
+        ghlib.catch_stdout('git init')
+        commit('2015.0820', 'start\n')
+        ghlib.catch_stdout('git tag -a 2015.0820 -m tag')
+        commit('2015.0820.1', 'one\n\nVersion:   2015.0820.1\n')
+        bad_trailer = commit('2015.0820.2', 'two\n\nVersion:   2015.0820.9\n')
+        no_bump = commit('2015.0820.2', 'three\n')
+        commit('2015.0820.4', 'four\n\nVersion:   2015.0820.4\n')
+        commit('2015.0901', 'new head\n')
+
+        (rc, o, e) = ghlib.catch_all('%s %s' % (sys.executable, AUDIT))
+        assert rc == 1
+        assert o.strip().split('\n') == [
+            '%s Version: 2015.0820.9, but version.py has 2015.0820.2' %
+            bad_trailer,
+            '%s version.py has 2015.0820.2, should be 2015.0820.3' % no_bump]
+        assert 'audit: 6 commits, 2 problems' in e
+
+        (rc, o, e) = ghlib.catch_all('%s %s --no-increment HEAD~2..' %
+                                     (sys.executable, AUDIT))
+        assert (rc, o) == (0, '')
+
+        (rc, o, e) = ghlib.catch_all('%s %s --require-trailer HEAD~2..' %
+                                     (sys.executable, AUDIT))
+        assert o == ('%s no Version: line (version.py has 2015.0901)\n' %
+                     ghlib.rev_parse('HEAD').strip())
+
+
+# -----------------------------------------------------------------------------
+def test_describe_matches(tmpdir):
+    """
+    Auditor.describe, carried along history, should agree with git describe
+    for every commit, merges included
+    """
+    pytest.dbgfunc()
+    with chdir(str(tmpdir)):
+        ghlib.catch_stdout('git init')
+        commit('1.0', 'root\n')
+        ghlib.catch_stdout('git tag -a 1.0 -m tag')
+        for n in range(3):
+            commit('1.0.%d' % (n + 1), 'main %d\n' % n)
+        ghlib.catch_stdout('git checkout -q -b side HEAD~2')
+        for n in range(4):
+            commit('1.0.%d' % (n + 2), 'side %d\n' % n)
+        ghlib.catch_stdout('git tag -a 1.1 -m tag HEAD~1')
+        ghlib.catch_stdout('git checkout -q master')
+        ghlib.catch_stdout('git merge -q --no-ff -m merge side')
+        commit('1.1.9', 'after\n')
+
+        auditor = audit.Auditor()
+        list(auditor.audit('--all'))
+        for oid in ghlib.catch_stdout('git rev-list --all').split():
+            exp = ghlib.catch_stdout('git describe --long %s' % oid).strip()
+            (tag, distance) = auditor.describe(oid)
+            assert '%s-%d-g%s' % (tag, distance, oid[:7]) == exp
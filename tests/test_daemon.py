@@ -0,0 +1,113 @@
+"""
+Tests for ghdaemon and ghclient
+"""
+from conftest import chdir
+from githooks import ghclient
+from githooks import ghlib
+import os
+import pytest
+import sys
+
+DAEMON = os.path.abspath(os.path.join('githooks', 'ghdaemon.py'))
+
+
+# -----------------------------------------------------------------------------
+@pytest.fixture
+def daemon(tmpdir):
+    """
+    Set up a repo in *tmpdir* with a daemon running for it. Yield the repo
+    path, then stop the daemon.
+    """
+    td = str(tmpdir)
+    with chdir(td):
+        ghlib.catch_stdout('git init')
+        open('version.py', 'w').write('__version__ = "2015.0820"\n')
+        ghlib.catch_stdout('git add version.py')
+        ghlib.catch_stdout('git commit -m inception')
+        ghlib.catch_stdout('git tag -a -m "version basis" 2015.0820')
+        r = ghlib.catch_stdout('%s %s start --idle 60' %
+                               (sys.executable, DAEMON))
+        assert not r.startswith('ERR:')
+    yield td
+    with chdir(td):
+        ghlib.catch_stdout('%s %s stop' % (sys.executable, DAEMON))
+
+
+# -----------------------------------------------------------------------------
+def test_client_nodaemon(tmpdir):
+    """
+    Without a daemon, the client reports nothing and primes nothing
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    with chdir(td):
+        ghlib.catch_stdout('git init')
+        assert ghclient.query('facts') is None
+        assert not ghclient.prime()
+
+
+# -----------------------------------------------------------------------------
+def test_daemon_facts(daemon):
+    """
+    The daemon reports what ghlib would work out in-process
+    """
+    pytest.dbgfunc()
+    with chdir(daemon):
+        reply = ghclient.query('facts')
+        assert reply['toplevel'] == daemon
+        assert reply['head'] == ghlib.catch_stdout('git rev-parse HEAD')
+        assert reply['get_version_path'] == os.path.join(daemon, 'version.py')
+        assert reply['get_version_string'] == '2015.0820'
+        assert reply['git_describe_ht'] == ['2015.0820', '2015.0820', 0]
+
+
+# -----------------------------------------------------------------------------
+def test_daemon_invalidate(daemon):
+    """
+    Changes to the version file, the index, and refs are noticed
+    """
+    pytest.dbgfunc()
+    with chdir(daemon):
+        assert ghclient.query('facts')['get_version_string'] == '2015.0820'
+        st = os.stat('version.py')
+        open('version.py', 'w').write('__version__ = "2015.0820.1"\n')
+        os.utime('version.py', (st.st_atime, st.st_mtime + 10))
+        assert ghclient.query('facts')['get_version_string'] == '2015.0820.1'
+
+        ghlib.catch_stdout('git add version.py')
+        ghlib.catch_stdout('git commit -m "another commit"')
+        reply = ghclient.query('facts')
+        assert reply['head'] == ghlib.catch_stdout('git rev-parse HEAD')
+        assert reply['git_describe_ht'] == ['2015.0820.1', '2015.0820', 1]
+
+
+# -----------------------------------------------------------------------------
+def test_daemon_prime(daemon, monkeypatch):
+    """
+    prime() loads the daemon's answers into ghlib's memo so no git command
+    needs to run to get them
+    """
+    pytest.dbgfunc()
+    with chdir(daemon):
+        assert ghclient.prime()
+
+        def nogit(*args, **kwargs):
+            raise AssertionError('git should not run')
+        monkeypatch.setattr(ghlib, 'catch_all', nogit)
+        assert ghlib.repo_facts().toplevel == daemon
+        assert ghlib.get_version_ht() == ('2015.0820', '2015.0820', 0)
+        assert ghlib.git_describe_ht() == ('2015.0820', '2015.0820', 0)
+
+
+# -----------------------------------------------------------------------------
+def test_daemon_hook(daemon):
+    """
+    A hook run with the daemon up gets the same result as without it
+    """
+    pytest.dbgfunc()
+    hook = os.path.abspath(os.path.join(os.path.dirname(DAEMON),
+                                        'commit-msg.ver'))
+    with chdir(daemon):
+        open('msg', 'w').write('subject\n')
+        ghlib.catch_stdout('%s msg' % hook)
+        assert 'Version:   2015.0820' in ghlib.contents('msg')
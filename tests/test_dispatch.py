@@ -0,0 +1,120 @@
+"""
+Tests for the hook dispatcher
+"""
+from conftest import chdir
+from githooks import dispatch
+from githooks import ghlib
+import os
+import pytest
+
+
+# -----------------------------------------------------------------------------
+def test_behavior_default(tmpdir, monkeypatch):
+    """
+    A bare git hook name gets the default behavior; an unknown name gets
+    None
+    """
+    pytest.dbgfunc()
+    monkeypatch.delenv('GITHOOKS_BEHAVIOR', raising=False)
+    td = str(tmpdir)
+    for name in ['commit-msg', 'pre-commit', 'post-commit']:
+        open(os.path.join(td, name), 'w').close()
+    assert dispatch.behavior(os.path.join(td, 'commit-msg')) == 'commit-msg.vc'
+    assert (dispatch.behavior(os.path.join(td, 'pre-commit')) ==
+            'pre-commit.ver')
+    assert dispatch.behavior(os.path.join(td, 'post-commit')) is None
+
+
+# -----------------------------------------------------------------------------
+def test_behavior_env(tmpdir, monkeypatch):
+    """
+    $GITHOOKS_BEHAVIOR overrides the name the hook was run by
+    """
+    pytest.dbgfunc()
+    monkeypatch.setenv('GITHOOKS_BEHAVIOR', 'commit-msg.chgid')
+    assert dispatch.behavior('commit-msg.ver') == 'commit-msg.chgid'
+    monkeypatch.setenv('GITHOOKS_BEHAVIOR', 'no-such-behavior')
+    assert dispatch.behavior('commit-msg.ver') == 'commit-msg.ver'
+
+
+# -----------------------------------------------------------------------------
+def test_behavior_name(tmpdir, monkeypatch):
+    """
+    The name the hook was run by selects the behavior
+    """
+    pytest.dbgfunc()
+    monkeypatch.delenv('GITHOOKS_BEHAVIOR', raising=False)
+    for name in dispatch.BEHAVIORS:
+        assert dispatch.behavior(os.path.join('githooks', name)) == name
+
+
+# -----------------------------------------------------------------------------
+def test_behavior_symlink(tmpdir, monkeypatch):
+    """
+    .git/hooks/commit-msg linked to commit-msg.ver adds only a version
+    """
+    pytest.dbgfunc()
+    monkeypatch.delenv('GITHOOKS_BEHAVIOR', raising=False)
+    td = str(tmpdir)
+    target = os.path.abspath(os.path.join('githooks', 'commit-msg.ver'))
+    with chdir(td):
+        ghlib.catch_stdout('git init')
+        open('version.py', 'w').write('__version__ = "2015.0820.3"\n')
+        hook = os.path.join(td, '.git', 'hooks', 'commit-msg')
+        os.symlink(target, hook)
+        assert dispatch.behavior(hook) == 'commit-msg.ver'
+
+        open('msg', 'w').write('subject\n')
+        ghlib.catch_stdout('%s msg' % hook)
+        z = ghlib.contents('msg')
+    assert 'Version:   2015.0820.3' in z
+    assert not [l for l in z if 'Change-Id:' in l]
+
+
+# -----------------------------------------------------------------------------
+def test_behavior_copy(tmpdir, monkeypatch):
+    """
+    A copy of commit-msg.chgid named commit-msg, as the hooks' docstrings
+    say to install it, adds only a Change-Id, even with no version.py
+    """
+    pytest.dbgfunc()
+    monkeypatch.delenv('GITHOOKS_BEHAVIOR', raising=False)
+    import shutil
+    td = str(tmpdir)
+    hooks = os.path.join(td, 'githooks')
+    shutil.copytree(os.path.abspath('githooks'), hooks)
+    hook = os.path.join(hooks, 'commit-msg')
+    shutil.copy2(os.path.join(hooks, 'commit-msg.chgid'), hook)
+    with chdir(td):
+        ghlib.catch_stdout('git init')
+        open('msg', 'w').write('subject\n')
+        (rc, o, e) = ghlib.catch_all('%s msg' % hook)
+        z = ghlib.contents('msg')
+    assert rc == 0
+    assert [l for l in z if l.startswith('Change-Id: I')]
+    assert not [l for l in z if 'Version:' in l]
+
+
+# -----------------------------------------------------------------------------
+@pytest.mark.parametrize('readable', [True, False])
+def test_version_staged(tmpdir, monkeypatch, readable):
+    """
+    version_staged should require the index entry to differ from HEAD and
+    match the working tree, whether it reads the index itself or asks git
+    """
+    pytest.dbgfunc()
+    with chdir(str(tmpdir)):
+        ghlib.catch_stdout('git init')
+        open('version.py', 'w').write('__version__ = "1.0"\n')
+        ghlib.catch_stdout('git add version.py')
+        ghlib.catch_stdout('git commit -m first')
+        if not readable:
+            monkeypatch.setattr(ghlib, 'index_oid', lambda rel: None)
+        vpath = os.path.abspath('version.py')
+        assert not dispatch.version_staged(vpath)
+        open('version.py', 'w').write('__version__ = "1.0.1"\n')
+        assert not dispatch.version_staged(vpath)
+        ghlib.catch_stdout('git add version.py')
+        assert dispatch.version_staged(vpath)
+        open('version.py', 'w').write('__version__ = "1.0.2"\n')
+        assert not dispatch.version_staged(vpath)
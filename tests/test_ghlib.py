@@ -3,9 +3,29 @@ Tests for ghlib routines
 """
 from conftest import chdir
 from githooks import ghlib
+from githooks import gitrefs
+import json
 import os
 import pytest
 
+# -----------------------------------------------------------------------------
+def test_cat_file(tmpdir):
+    """
+    cat_file should return the contents of a staged blob and an ERR: string
+    for something that doesn't exist
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    with chdir(td):
+        ghlib.catch_stdout('git init')
+        v = open('version.py', 'w')
+        v.write('__version__ = "1.2.3"\n')
+        v.close()
+        ghlib.catch_stdout('git add version.py')
+        assert ghlib.cat_file(':version.py') == '__version__ = "1.2.3"\n'
+        assert ghlib.cat_file(':nosuch.py').startswith('ERR:')
+
+
 # -----------------------------------------------------------------------------
 def test_catch_stdout_in(tmpdir):
     """
@@ -41,6 +61,24 @@ def test_catch_stdout_nosuch(tmpdir):
     assert 'No such file or directory' in result
 
 
+# -----------------------------------------------------------------------------
+def test_change_ids():
+    """
+    change_ids should give the same answers, in the same order, as
+    change_id_for, with or without a worker pool
+    """
+    pytest.dbgfunc()
+    author = 'A U Thor <author@example.com> 1234567890 +0000'
+    items = [('4b825dc642cb6eb9a060e54bf8d69288fbee4904',
+              None if n == 0 else '%040x' % n, author, author,
+              ['Commit %d' % n, '', 'Body'])
+             for n in range(20)]
+    exp = [ghlib.change_id_for(*x) for x in items]
+    assert len(set(exp)) == len(items)
+    assert ghlib.change_ids(items) == exp
+    assert ghlib.change_ids(iter(items), workers=2, chunksize=3) == exp
+
+
 # -----------------------------------------------------------------------------
 def test_contents(tmpdir):
     """
@@ -56,6 +94,23 @@ def test_contents(tmpdir):
         assert '\n' not in l
 
 
+# -----------------------------------------------------------------------------
+def test_get_change_id(tmpdir):
+    """
+    get_change_id should produce a single Change-Id line with a 40 digit hex
+    id
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    with chdir(td):
+        ghlib.catch_stdout('git init')
+        cid = ghlib.get_change_id(['Subject line', '', 'Body text'])
+    assert cid.startswith('Change-Id: I')
+    assert cid.endswith('\n')
+    assert len(cid.strip()) == len('Change-Id: I') + 40
+    int(cid.strip()[len('Change-Id: I'):], 16)
+
+
 # -----------------------------------------------------------------------------
 def test_get_version_ht_justhead(tmpdir):
     """
@@ -72,6 +127,7 @@ def test_get_version_ht_justhead(tmpdir):
 
     with chdir(td):
         ghlib.catch_stdout('git init')
+        ghlib.catch_stdout('git add .')
         (full, head, tail) = ghlib.get_version_ht()
 
     assert full == '2010.1201'
@@ -96,6 +152,7 @@ def test_get_version_ht_withtail(tmpdir):
 
     with chdir(td):
         ghlib.catch_stdout('git init')
+        ghlib.catch_stdout('git add .')
         (full, head, tail) = ghlib.get_version_ht()
 
     assert full == '2010.1201.125'
@@ -143,6 +200,7 @@ def test_get_version_path_levone(tmpdir):
 
     with chdir(td):
         ghlib.catch_stdout('git init')
+        ghlib.catch_stdout('git add .')
         vpath = ghlib.get_version_path()
 
     assert vpath == os.path.join(pkg, vname)
@@ -166,11 +224,194 @@ def test_get_version_path_levtwo(tmpdir):
 
     with chdir(td):
         ghlib.catch_stdout('git init')
+        ghlib.catch_stdout('git add .')
         vpath = ghlib.get_version_path()
 
     assert vpath == os.path.join(deep, vname)
 
 
+# -----------------------------------------------------------------------------
+def test_get_version_path_norepo(tmpdir):
+    """
+    Outside a git repo, version.py should be found by walking the tree,
+    shallowest first, skipping pruned directories
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    for dn in ['build', 'pkg', os.path.join('pkg', 'deep')]:
+        os.mkdir(os.path.join(td, dn))
+    for dn in ['build', os.path.join('pkg', 'deep')]:
+        open(os.path.join(td, dn, 'version.py'), 'w').close()
+
+    with chdir(td):
+        vpath = ghlib.get_version_path()
+
+    assert vpath == os.path.join('.', 'pkg', 'deep', 'version.py')
+
+
+# -----------------------------------------------------------------------------
+def test_get_version_path_pruned(tmpdir):
+    """
+    version.py under a pruned directory should be ignored even when it's
+    shallower than the real one
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    for dn in ['node_modules', 'pkg', os.path.join('pkg', 'deep')]:
+        os.mkdir(os.path.join(td, dn))
+    for dn in ['node_modules', os.path.join('pkg', 'deep')]:
+        open(os.path.join(td, dn, 'version.py'), 'w').close()
+
+    with chdir(td):
+        ghlib.catch_stdout('git init')
+        ghlib.catch_stdout('git add .')
+        vpath = ghlib.get_version_path()
+
+    assert vpath == os.path.join(td, 'pkg', 'deep', 'version.py')
+
+
+# -----------------------------------------------------------------------------
+def test_get_version_path_roots(tmpdir, monkeypatch):
+    """
+    With $GITHOOKS_VERSION_ROOTS set, only those directories are searched
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    for dn in ['aaa', 'zzz']:
+        os.mkdir(os.path.join(td, dn))
+        open(os.path.join(td, dn, 'version.py'), 'w').close()
+    monkeypatch.setenv('GITHOOKS_VERSION_ROOTS', 'zzz')
+
+    with chdir(td):
+        ghlib.catch_stdout('git init')
+        vpath = ghlib.get_version_path()
+
+    assert vpath == os.path.join(td, 'zzz', 'version.py')
+
+
+# -----------------------------------------------------------------------------
+def test_get_version_path_siblings(tmpdir):
+    """
+    When version.py exists in sibling directories, the choice should be
+    deterministic: the first by name
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    for dn in ['zzz', 'mmm', 'aaa']:
+        os.mkdir(os.path.join(td, dn))
+        open(os.path.join(td, dn, 'version.py'), 'w').close()
+
+    with chdir(td):
+        ghlib.catch_stdout('git init')
+        ghlib.catch_stdout('git add .')
+        vpath = ghlib.get_version_path()
+
+    assert vpath == os.path.join(td, 'aaa', 'version.py')
+
+
+# -----------------------------------------------------------------------------
+def test_get_version_path_tracked(tmpdir):
+    """
+    A tracked version.py should be preferred over a shallower untracked one
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    pkg = os.path.join(td, 'pkg')
+    os.mkdir(pkg)
+    open(os.path.join(pkg, 'version.py'), 'w').close()
+
+    with chdir(td):
+        ghlib.catch_stdout('git init')
+        ghlib.catch_stdout('git add pkg/version.py')
+        open('version.py', 'w').close()
+        vpath = ghlib.get_version_path()
+
+    assert vpath == os.path.join(pkg, 'version.py')
+
+
+# -----------------------------------------------------------------------------
+def test_get_version_path_untracked(tmpdir, monkeypatch):
+    """
+    With nothing tracked, an untracked version.py is only looked for below
+    the top of the repo if $GITHOOKS_VERSION_UNTRACKED is set
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    deep = os.path.join(td, 'pkg', 'deep')
+    os.makedirs(deep)
+    open(os.path.join(deep, 'version.py'), 'w').close()
+
+    with chdir(td):
+        ghlib.catch_stdout('git init')
+        with pytest.raises(SystemExit):
+            ghlib.get_version_path()
+        monkeypatch.setenv('GITHOOKS_VERSION_UNTRACKED', '1')
+        ghlib.memo_reset()
+        assert ghlib.get_version_path() == os.path.join(deep, 'version.py')
+
+
+# -----------------------------------------------------------------------------
+def test_get_version_path_cached(tmpdir):
+    """
+    The second lookup should come from the cache; changing the index or
+    removing the file should invalidate it
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    pkg = os.path.join(td, 'pkg')
+    os.mkdir(pkg)
+    open(os.path.join(pkg, 'version.py'), 'w').close()
+    ghlib.cache_stats.clear()
+
+    with chdir(td):
+        ghlib.catch_stdout('git init')
+        ghlib.catch_stdout('git add pkg/version.py')
+        assert ghlib.get_version_path() == os.path.join(pkg, 'version.py')
+        assert ghlib.cache_stats['version_path'] == {'hit': 0, 'miss': 1}
+        assert os.path.exists(os.path.join('.git', ghlib.CACHE_NAME))
+
+        ghlib.memo_reset()
+        assert ghlib.get_version_path() == os.path.join(pkg, 'version.py')
+        assert ghlib.cache_stats['version_path'] == {'hit': 1, 'miss': 1}
+
+        open('version.py', 'w').close()
+        ghlib.catch_stdout('git add version.py')
+        ghlib.memo_reset()
+        assert ghlib.get_version_path() == os.path.join(td, 'version.py')
+        assert ghlib.cache_stats['version_path'] == {'hit': 1, 'miss': 2}
+
+        ghlib.catch_stdout('git rm -q --cached version.py')
+        os.unlink('version.py')
+        ghlib.memo_reset()
+        assert ghlib.get_version_path() == os.path.join(pkg, 'version.py')
+        assert ghlib.cache_stats['version_path'] == {'hit': 1, 'miss': 3}
+
+
+# -----------------------------------------------------------------------------
+def test_get_version_path_pyproject(tmpdir, monkeypatch):
+    """
+    With no version.py, a pyproject.toml declaring a version is used, without
+    asking git for untracked files
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    t = open(os.path.join(td, 'pyproject.toml'), 'w')
+    t.write('[project]\nname = "pkg"\nversion = "2016.0101.2"\n')
+    t.close()
+
+    with chdir(td):
+        ghlib.catch_stdout('git init')
+        real = ghlib.catch_stdout
+        cmds = []
+        monkeypatch.setattr(ghlib, 'catch_stdout',
+                            lambda cmd, **kw: cmds.append(cmd) or
+                            real(cmd, **kw))
+        assert ghlib.get_version_path() == os.path.join(td, 'pyproject.toml')
+        assert ghlib.get_version_ht() == ('2016.0101.2', '2016.0101', 2)
+
+    assert not [c for c in cmds if '--others' in c]
+
+
 # -----------------------------------------------------------------------------
 def test_git_describe_ht_notag(tmpdir):
     """
@@ -239,6 +480,422 @@ def test_git_describe_ht_minor(tmpdir):
     assert tail == 1
 
 
+# -----------------------------------------------------------------------------
+def describe_setup():
+    """
+    Make a repo with a tagged commit and one more commit on top of it.
+    Return a function that counts calls to describe_full.
+    """
+    ghlib.catch_stdout('git init')
+    ghlib.catch_stdout('git commit --allow-empty -m "first"')
+    ghlib.catch_stdout('git tag -a 2009.0507 -m "test tag"')
+    ghlib.catch_stdout('git commit --allow-empty -m "second"')
+    calls = []
+    real = ghlib.describe_full
+
+    def counted():
+        calls.append(1)
+        return real()
+    return (calls, counted)
+
+
+# -----------------------------------------------------------------------------
+def test_git_describe_ht_cached(tmpdir, monkeypatch):
+    """
+    A describe result is reused while HEAD and the tags stay put, and
+    carried forward when HEAD advances linearly
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    with chdir(td):
+        (calls, counted) = describe_setup()
+        monkeypatch.setattr(ghlib, 'describe_full', counted)
+        assert ghlib.git_describe_ht() == ('2009.0507.1', '2009.0507', 1)
+        ghlib.memo_reset()
+        assert ghlib.git_describe_ht() == ('2009.0507.1', '2009.0507', 1)
+        assert len(calls) == 1
+
+        for n in range(3):
+            ghlib.catch_stdout('git commit --allow-empty -m "more %d"' % n)
+        ghlib.memo_reset()
+        assert ghlib.git_describe_ht() == ('2009.0507.4', '2009.0507', 4)
+        assert len(calls) == 1
+        assert ghlib.describe_full() == ('2009.0507.4', '2009.0507', 4)
+
+
+# -----------------------------------------------------------------------------
+def test_git_describe_ht_retag(tmpdir, monkeypatch):
+    """
+    A new tag, or a HEAD that isn't a linear descendant of the cached one,
+    means running git describe again
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    with chdir(td):
+        (calls, counted) = describe_setup()
+        monkeypatch.setattr(ghlib, 'describe_full', counted)
+        assert ghlib.git_describe_ht() == ('2009.0507.1', '2009.0507', 1)
+
+        ghlib.catch_stdout('git tag -a 2009.0508 -m "test tag"')
+        ghlib.memo_reset()
+        assert ghlib.git_describe_ht() == ('2009.0508', '2009.0508', 0)
+        assert len(calls) == 2
+
+        ghlib.catch_stdout('git checkout -q -b side HEAD~1')
+        ghlib.catch_stdout('git commit --allow-empty -m "side"')
+        ghlib.catch_stdout('git checkout -q -')
+        ghlib.catch_stdout('git merge -q --no-edit --no-ff side')
+        ghlib.memo_reset()
+        assert ghlib.git_describe_ht() == ('2009.0508.2', '2009.0508', 2)
+        assert len(calls) == 3
+
+
+# -----------------------------------------------------------------------------
+def test_git_describe_ht_dash(tmpdir):
+    """
+    A tag name with '-' in it comes through whole, whether or not HEAD is
+    on the tag
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    with chdir(td):
+        ghlib.catch_stdout('git init')
+        ghlib.catch_stdout('git commit --allow-empty -m "first"')
+        ghlib.catch_stdout('git tag -a v1.0-rc1 -m "test tag"')
+        ghlib.catch_stdout('git commit --allow-empty -m "second"')
+        assert ghlib.git_describe_ht() == ('v1.0-rc1.1', 'v1.0-rc1', 1)
+        ghlib.catch_stdout('git tag -a v1.1-rc-2 -m "test tag"')
+        ghlib.memo_reset()
+        assert ghlib.git_describe_ht() == ('v1.1-rc-2', 'v1.1-rc-2', 0)
+
+
+# -----------------------------------------------------------------------------
+def test_worker_reuse(tmpdir):
+    """
+    Repeated queries in the same directory should go to the same git process
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    with chdir(td):
+        ghlib.catch_stdout('git init')
+        w1 = ghlib.git_worker('git cat-file --batch-check')
+        ghlib.rev_parse('HEAD^0')
+        ghlib.rev_parse('HEAD^{tree}')
+        w2 = ghlib.git_worker('git cat-file --batch-check')
+        assert w1 is w2
+        assert w1.alive()
+        ghlib.close_workers()
+        assert not w1.alive()
+
+
+# -----------------------------------------------------------------------------
+def test_worker_many(tmpdir):
+    """
+    A few thousand queries at once, with more replies than a pipe holds,
+    should all be answered rather than leaving us and git both blocked on
+    writes
+    """
+    pytest.dbgfunc()
+    with chdir(str(tmpdir)):
+        ghlib.catch_stdout('git init')
+        ghlib.catch_stdout('git commit --allow-empty -m first')
+        head = ghlib.rev_parse('HEAD').strip()
+        checks = ghlib.git_batch_many('git cat-file --batch-check',
+                                      [head] * 4000)
+        bodies = ghlib.git_batch_many('git cat-file --batch', [head] * 4000,
+                                      body=True)
+        assert len(checks) == 4000
+        assert set(checks) == set(['%s commit %d' % (head, len(bodies[0][1]))])
+        assert len(bodies) == 4000
+        assert set([b[0].split()[0] for b in bodies]) == set([head])
+
+
+# -----------------------------------------------------------------------------
+def test_hash_object(tmpdir):
+    """
+    hash_object should agree with 'git hash-object' for blobs and commits
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    commit = ('tree 4b825dc642cb6eb9a060e54bf8d69288fbee4904\n' +
+              'author A U Thor <author@example.com> 1234567890 +0000\n' +
+              'committer A U Thor <author@example.com> 1234567890 +0000\n' +
+              '\n' +
+              'Subject line\n')
+    with chdir(td):
+        ghlib.catch_stdout('git init')
+        for (otype, data) in [('blob', 'some data\n'),
+                              ('blob', ''),
+                              ('commit', commit)]:
+            exp = ghlib.catch_stdout('git hash-object -t %s --stdin' % otype,
+                                     input=data)
+            assert ghlib.hash_object(data, otype) + '\n' == exp
+
+
+# -----------------------------------------------------------------------------
+def test_hash_path(tmpdir):
+    """
+    hash_path should agree with 'git hash-object'
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    with chdir(td):
+        ghlib.catch_stdout('git init')
+        open('data', 'w').write('some data\n')
+        assert ghlib.hash_path('data') == ghlib.catch_stdout(
+            'git hash-object data')
+
+
+# -----------------------------------------------------------------------------
+@pytest.mark.parametrize('name, email', [
+    ('A U Thor', 'author@example.com'),
+    (' .A U <Th>or;; ', '<author@example.com>.'),
+    ('"A U\tThor\',', '\'author\n@example.com\''),
+])
+def test_ident_env(tmpdir, monkeypatch, name, email):
+    """
+    With name, email, and date in the environment, ident should match 'git
+    var' exactly without running git, cleaning up the name and email as git
+    does
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    monkeypatch.setenv('GIT_AUTHOR_NAME', name)
+    monkeypatch.setenv('GIT_AUTHOR_EMAIL', email)
+    monkeypatch.setenv('GIT_AUTHOR_DATE', '@1234567890 +0200')
+    with chdir(td):
+        ghlib.catch_stdout('git init')
+        exp = ghlib.catch_stdout('git var GIT_AUTHOR_IDENT')
+        assert ghlib.ident('AUTHOR') == exp
+
+
+# -----------------------------------------------------------------------------
+def test_ident_noenv(tmpdir, monkeypatch):
+    """
+    Without a name and email in the environment, ident returns None and
+    RepoFacts asks git
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    monkeypatch.delenv('GIT_COMMITTER_NAME', raising=False)
+    monkeypatch.delenv('GIT_COMMITTER_EMAIL', raising=False)
+    with chdir(td):
+        ghlib.catch_stdout('git init')
+        ghlib.catch_stdout('git config user.name "C O Mitter"')
+        ghlib.catch_stdout('git config user.email committer@example.com')
+        assert ghlib.ident('COMMITTER') is None
+        exp = ghlib.catch_stdout('git var GIT_COMMITTER_IDENT')
+        facts = ghlib.repo_facts()
+        assert facts.committer.rsplit(' ', 2)[0] == exp.rsplit(' ', 2)[0]
+
+
+# -----------------------------------------------------------------------------
+def test_memoized(tmpdir, monkeypatch):
+    """
+    Within a run, version path, version string, and describe output should
+    each be computed once, without running git again, until memo_reset()
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    with chdir(td):
+        ghlib.catch_stdout('git init')
+        v = open('version.py', 'w')
+        v.write('__version__ = "2010.1201.3"\n')
+        v.close()
+        vpath = ghlib.get_version_path()
+        vht = ghlib.get_version_ht()
+        dht = ghlib.git_describe_ht()
+
+        def nogit(*args, **kwargs):
+            raise AssertionError('git should not run')
+        monkeypatch.setattr(ghlib, 'catch_all', nogit)
+        monkeypatch.setattr(ghlib, 'catch_stdout', nogit)
+        assert ghlib.get_version_path() == vpath
+        assert ghlib.get_version() == 'Version:   2010.1201.3'
+        assert ghlib.get_version_ht() == vht
+        assert ghlib.git_describe_ht() == dht
+
+        # Send repo_facts to git, so recomputing anything shows up
+        monkeypatch.setattr(gitrefs, 'discover', lambda start=None: None)
+        ghlib.memo_reset()
+        with pytest.raises(AssertionError):
+            ghlib.get_version_path()
+
+
+# -----------------------------------------------------------------------------
+def test_repo_facts(tmpdir):
+    """
+    repo_facts should report toplevel, git dir, and HEAD, from the toplevel
+    or a subdirectory
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    with chdir(td):
+        ghlib.catch_stdout('git init')
+        facts = ghlib.repo_facts()
+        assert facts.toplevel == td
+        assert facts.gitdir == os.path.join(td, '.git')
+        assert facts.head.startswith('ERR:')
+
+        open('version.py', 'w').close()
+        ghlib.catch_stdout('git add version.py')
+        ghlib.catch_stdout('git commit -m "test commit"')
+        exp = ghlib.catch_stdout('git rev-parse "HEAD^0"')
+        os.mkdir('sub')
+        with chdir('sub'):
+            facts = ghlib.repo_facts()
+    assert facts.toplevel == td
+    assert facts.gitdir == os.path.join(td, '.git')
+    assert facts.head == exp
+
+
+# -----------------------------------------------------------------------------
+def test_repo_facts_norepo(tmpdir):
+    """
+    Outside a repo, toplevel and gitdir are empty and head is an error
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    with chdir(td):
+        facts = ghlib.repo_facts()
+    assert facts.toplevel == ''
+    assert facts.gitdir == ''
+    assert facts.head.startswith('ERR:')
+
+
+# -----------------------------------------------------------------------------
+def test_rev_parse(tmpdir):
+    """
+    rev_parse should agree with 'git rev-parse' and report ERR: when there is
+    nothing to resolve
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    with chdir(td):
+        ghlib.catch_stdout('git init')
+        assert ghlib.rev_parse('HEAD^0').startswith('ERR:')
+        open('version.py', 'w').close()
+        ghlib.catch_stdout('git add version.py')
+        ghlib.catch_stdout('git commit -m "test commit"')
+        exp = ghlib.catch_stdout('git rev-parse "HEAD^0"')
+        assert ghlib.rev_parse('HEAD^0') == exp
+
+
+# -----------------------------------------------------------------------------
+def test_rev_parse_noworkers(tmpdir, monkeypatch):
+    """
+    With workers disabled, rev_parse should fall back to one-shot git
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    monkeypatch.setenv('GITHOOKS_NO_WORKERS', '1')
+    with chdir(td):
+        ghlib.catch_stdout('git init')
+        assert ghlib.rev_parse('HEAD^0').startswith('ERR:')
+        open('version.py', 'w').close()
+        ghlib.catch_stdout('git add version.py')
+        ghlib.catch_stdout('git commit -m "test commit"')
+        exp = ghlib.catch_stdout('git rev-parse "HEAD^0"')
+        assert ghlib.rev_parse('HEAD^0') == exp
+        assert ghlib.git_worker('git cat-file --batch-check') is None
+
+
+# -----------------------------------------------------------------------------
+def rewrite_setup(td, msg):
+    """
+    Make a repo in *td* with a version.py and commit message file 'msg'
+    holding lines *msg*
+    """
+    ghlib.catch_stdout('git init')
+    open('version.py', 'w').write('__version__ = "2015.0820"\n')
+    open('msg', 'w').writelines([l + '\n' for l in msg])
+
+
+# -----------------------------------------------------------------------------
+def test_rewrite_msg_backup(tmpdir, monkeypatch):
+    """
+    rewrite_msg keeps the original as .old, unless told not to, preserves
+    the file's mode, and leaves no temporary files behind
+    """
+    pytest.dbgfunc()
+    monkeypatch.setenv('GIT_AUTHOR_DATE', '1234567890 +0000')
+    monkeypatch.setenv('GIT_COMMITTER_DATE', '1234567890 +0000')
+    td = str(tmpdir)
+    msg = ['Subject line', '', 'Body text']
+    with chdir(td):
+        rewrite_setup(td, msg)
+        os.chmod('msg', 0o640)
+        ghlib.rewrite_msg('msg', True, False)
+        assert ghlib.contents('msg.old') == msg
+        assert os.stat('msg').st_mode & 0o777 == 0o640
+        os.unlink('msg.old')
+        ghlib.rewrite_msg('msg', False, True, backup=False)
+        assert not os.path.exists('msg.old')
+        assert sorted(os.listdir('.')) == ['.git', 'msg', 'version.py']
+
+
+# -----------------------------------------------------------------------------
+def test_rewrite_msg_save_new(tmpdir, monkeypatch):
+    """
+    rewrite_msg should write what split_msg, get_version, get_change_id, and
+    save_new would
+    """
+    pytest.dbgfunc()
+    monkeypatch.setenv('GIT_AUTHOR_DATE', '1234567890 +0000')
+    monkeypatch.setenv('GIT_COMMITTER_DATE', '1234567890 +0000')
+    td = str(tmpdir)
+    msg = ['Subject line',
+           '# a comment in the middle',
+           '',
+           'Body text',
+           'Version:',
+           '# a comment at the end',
+           '#']
+    with chdir(td):
+        rewrite_setup(td, msg)
+        (payload, version, cid, comments) = ghlib.split_msg(msg)
+        version = ghlib.get_version()
+        cid = ghlib.get_change_id(msg)
+        exp = ghlib.contents(ghlib.save_new('msg', payload, version, cid,
+                                            comments))
+        ghlib.rewrite_msg('msg', True, True)
+        assert ghlib.contents('msg') == exp
+        assert 'Version:   2015.0820' in exp
+        assert cid.strip() in exp
+
+
+# -----------------------------------------------------------------------------
+def test_rewrite_msg_noop(tmpdir):
+    """
+    If the trailers asked for are already there, rewrite_msg should not
+    touch the file
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    msg = ['Subject line',
+           '',
+           'Version:   2014.1217.46',
+           'Change-Id: Ia9c0832881fadc61e6511826f4112df72525f1e8',
+           '# a comment']
+    with chdir(td):
+        rewrite_setup(td, msg)
+        before = os.stat('msg')
+        for (want_version, want_cid) in [(True, False), (False, True),
+                                         (True, True)]:
+            assert not ghlib.rewrite_msg('msg', want_version, want_cid)
+        after = os.stat('msg')
+        assert (after.st_ino, after.st_mtime) == (before.st_ino,
+                                                  before.st_mtime)
+        assert not os.path.exists('msg.old')
+        assert ghlib.contents('msg') == msg
+
+        open('msg', 'w').writelines([l + '\n' for l in msg[:2] +
+                                     ['Version:'] + msg[3:]])
+        assert not ghlib.rewrite_msg('msg', False, True)
+        assert ghlib.rewrite_msg('msg', True, True)
+        assert 'Version:   2015.0820' in ghlib.contents('msg')
+
+
 # -----------------------------------------------------------------------------
 def test_select_absent(tmpdir):
     """
@@ -274,3 +931,189 @@ def test_select_present_exact(tmpdir):
     assert exp == actual
     assert len(exp) == len(actual)
 
+
+# -----------------------------------------------------------------------------
+def test_staged_version(tmpdir):
+    """
+    staged_version reports the version in the index and whether it differs
+    from HEAD
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    vpath = os.path.join(td, 'version.py')
+    with chdir(td):
+        ghlib.catch_stdout('git init')
+        open(vpath, 'w').write('__version__ = "1.0"\n')
+        assert ghlib.staged_version(vpath) == (None, False)
+
+        ghlib.catch_stdout('git add version.py')
+        assert ghlib.staged_version(vpath) == ('1.0', True)
+
+        ghlib.catch_stdout('git commit -m "test commit"')
+        assert ghlib.staged_version(vpath) == ('1.0', False)
+
+        open(vpath, 'w').write('__version__ = "1.1"\n')
+        assert ghlib.staged_version(vpath) == ('1.0', False)
+
+        ghlib.catch_stdout('git add version.py')
+        assert ghlib.staged_version(vpath) == ('1.1', True)
+
+
+# -----------------------------------------------------------------------------
+def test_tag_index(tmpdir):
+    """
+    TagIndex should agree with git describe about every commit in a history
+    with branches, merges, lightweight tags, and several tags on one commit
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    with chdir(td):
+        ghlib.catch_stdout('git init')
+        ghlib.catch_stdout('git commit --allow-empty -m "root"')
+        ghlib.catch_stdout('git tag -a 2015.0101 -m "tag"')
+        ghlib.catch_stdout('git commit --allow-empty -m "a1"')
+        ghlib.catch_stdout('git checkout -q -b side')
+        for n in range(3):
+            ghlib.catch_stdout('git commit --allow-empty -m "s%d"' % n)
+        ghlib.catch_stdout('git tag -a 2015.0202 -m "tag"')
+        ghlib.catch_stdout('git commit --allow-empty -m "s3"')
+        ghlib.catch_stdout('git tag light')
+        ghlib.catch_stdout('git checkout -q -')
+        ghlib.catch_stdout('git commit --allow-empty -m "a2"')
+        ghlib.catch_stdout('git merge -q --no-edit --no-ff side')
+        ghlib.catch_stdout('git commit --allow-empty -m "a3"')
+
+        idx = ghlib.TagIndex()
+        for oid in ghlib.catch_stdout('git rev-list --all').split():
+            exp = ghlib.catch_stdout('git describe --long %s' % oid)
+            (tag, dist, g) = exp.strip().rsplit('-', 2)
+            assert idx.describe(oid) == (tag, int(dist))
+        assert idx.describe('HEAD') == ('2015.0202', 6)
+
+        ghlib.catch_stdout('git tag -a 2015.0203 -m "tag" 2015.0202^{}')
+        idx = ghlib.TagIndex()
+        exp = ghlib.catch_stdout('git describe --long').rsplit('-', 2)[0]
+        assert idx.describe('HEAD') == (exp, 6)
+        assert idx.describe('HEAD~2') == ('2015.0101', 2)
+
+
+# -----------------------------------------------------------------------------
+def test_tag_index_notag(tmpdir):
+    """
+    With no annotated tags, or an unknown commit, there's no answer
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    with chdir(td):
+        ghlib.catch_stdout('git init')
+        ghlib.catch_stdout('git commit --allow-empty -m "root"')
+        ghlib.catch_stdout('git tag light')
+        idx = ghlib.TagIndex()
+        assert idx.describe('HEAD') == (None, 0)
+        assert idx.describe('0' * 40) == (None, 0)
+
+
+# -----------------------------------------------------------------------------
+def test_trace(tmpdir, monkeypatch):
+    """
+    With tracing on, each command and worker query is recorded with its
+    timing, byte counts, and exit status, and reported as JSON at exit
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    tfile = os.path.join(td, 'trace.json')
+    monkeypatch.setattr(ghlib, '_trace', [])
+    monkeypatch.setenv('GITHOOKS_TRACE', tfile)
+    with chdir(td):
+        ghlib.catch_stdout('git init')
+        ghlib.catch_stdout('git hash-object --stdin', input='abc')
+        ghlib.rev_parse('HEAD^0')
+    cmds = [t['cmd'] for t in ghlib._trace]
+    assert cmds[0] == 'git init'
+    assert ghlib._trace[1]['in'] == 3
+    assert ghlib._trace[1]['out'] == 41
+    assert ghlib._trace[1]['rc'] == 0
+    assert 'git cat-file --batch-check <<< HEAD^0' in cmds
+    assert all(0 <= t['ms'] for t in ghlib._trace)
+
+    ghlib.trace_report()
+    lines = open(tfile).readlines()
+    assert len(lines) == 1
+    assert json.loads(lines[0])['calls'][0]['cmd'] == 'git init'
+
+
+# -----------------------------------------------------------------------------
+def test_trace_hook(tmpdir):
+    """
+    Setting $GITHOOKS_TRACE to a file traces a hook run
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    tfile = os.path.join(td, 'trace.json')
+    hook = os.path.abspath(os.path.join('githooks', 'commit-msg.chgid'))
+    with chdir(td):
+        ghlib.catch_stdout('git init')
+        open('msg', 'w').write('subject\n')
+        ghlib.catch_stdout('env GITHOOKS_TRACE=%s %s msg' % (tfile, hook))
+    run = json.loads(open(tfile).read())
+    assert run['argv'][0] == hook
+    assert [t for t in run['calls'] if t['cmd'] == 'git write-tree']
+
+
+# -----------------------------------------------------------------------------
+def test_version_from_file_cfg(tmpdir):
+    """
+    setup.cfg with a literal version in [metadata]
+    """
+    pytest.dbgfunc()
+    cfg = '[metadata]\nname = pkg\nversion = 2015.0820.4\n'
+    assert ghlib.version_from_file('setup.cfg', cfg) == '2015.0820.4'
+    cfg = '[metadata]\nversion = attr: pkg.version.__version__\n'
+    assert ghlib.version_from_file('setup.cfg', cfg) is None
+
+
+# -----------------------------------------------------------------------------
+def test_version_from_file_py(tmpdir):
+    """
+    version.py forms: single or double quotes, tuples, reassignment
+    """
+    pytest.dbgfunc()
+    for (src, exp) in [('__version__ = "2015.0820"\n', '2015.0820'),
+                       ("__version__ = '1.2.3'  # comment\n", '1.2.3'),
+                       ('__version__ = (2015, 820, 4)\n', '2015.820.4'),
+                       ('__version__ = "1.0"\n__version__ = "1.1"\n', '1.1'),
+                       ('VERSION = "1.0"\n', None),
+                       ('', None)]:
+        assert ghlib.version_from_file('version.py', src) == exp
+
+
+# -----------------------------------------------------------------------------
+def test_version_from_file_noexec(tmpdir):
+    """
+    version.py must not be executed to get the version
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    marker = os.path.join(td, 'marker')
+    vpath = os.path.join(td, 'version.py')
+    v = open(vpath, 'w')
+    v.write('open(%r, "w").close()\n' % marker +
+            '__version__ = ("2015", "0820")\n')
+    v.close()
+    assert ghlib.version_from_file(vpath) == '2015.0820'
+    assert not os.path.exists(marker)
+
+
+# -----------------------------------------------------------------------------
+def test_version_from_file_toml(tmpdir):
+    """
+    pyproject.toml with a version in [project] or [tool.poetry]
+    """
+    pytest.dbgfunc()
+    toml = ('[build-system]\nrequires = ["x"]\n\n' +
+            '[project]\nname = "pkg"\nversion = "3.1.4"\n')
+    assert ghlib.version_from_file('pyproject.toml', toml) == '3.1.4'
+    toml = '[tool.poetry]\nversion = \'0.9\'\n'
+    assert ghlib.version_from_file('pyproject.toml', toml) == '0.9'
+    toml = '[tool.other]\nversion = "0.9"\n'
+    assert ghlib.version_from_file('pyproject.toml', toml) is None
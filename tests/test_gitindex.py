@@ -0,0 +1,217 @@
+"""
+Tests for gitindex
+"""
+from conftest import chdir
+from githooks import dispatch
+from githooks import ghlib
+from githooks import gitindex
+import os
+import pytest
+
+
+# -----------------------------------------------------------------------------
+def make_tree(td):
+    """
+    Populate a repo in *td* with nested directories, an executable, and a
+    symlink, staged and committed
+    """
+    ghlib.catch_stdout('git init')
+    for path in ['a/b/c.txt', 'a/b-c.txt', 'a.txt', 'a/d/e/f.txt', 'z.txt']:
+        if os.path.dirname(path) and not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        open(path, 'w').write('%s\n' % path)
+    os.chmod('z.txt', 0o755)
+    os.symlink('a.txt', 'link')
+    ghlib.catch_stdout('git add -A')
+    ghlib.catch_stdout('git commit -m first')
+
+
+# -----------------------------------------------------------------------------
+def write_tree():
+    """
+    Return what git write-tree says
+    """
+    return ghlib.catch_stdout('git write-tree').strip()
+
+
+# -----------------------------------------------------------------------------
+def test_tree_id(tmpdir):
+    """
+    tree_id should agree with git write-tree as the index changes
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    with chdir(td):
+        assert gitindex.tree_id('.git/index') is None
+        ghlib.catch_stdout('git init')
+        make_tree(td)
+        assert gitindex.tree_id('.git/index') == write_tree()
+
+        open('a/d/e/f.txt', 'a').write('more\n')
+        open('a/new.txt', 'w').write('new\n')
+        ghlib.catch_stdout('git add a/d/e/f.txt a/new.txt')
+        assert gitindex.tree_id('.git/index', '.git') == write_tree()
+
+        ghlib.catch_stdout('git rm -q a.txt')
+        ghlib.catch_stdout('git update-index --chmod=+x a/b/c.txt')
+        assert gitindex.tree_id('.git/index') == write_tree()
+
+
+# -----------------------------------------------------------------------------
+def test_tree_id_nocache(tmpdir, monkeypatch):
+    """
+    Without a TREE extension, every directory is hashed
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    with chdir(td):
+        make_tree(td)
+        exp = write_tree()
+        info = ghlib.catch_stdout('git ls-files -s')
+        monkeypatch.setenv('GIT_INDEX_FILE', os.path.join(td, '.git/idx2'))
+        ghlib.catch_stdout('git update-index --index-info', input=info)
+        index = gitindex.Index('.git/idx2')
+        assert len(index) == 6
+        assert 'TREE' not in index.extensions()
+        index.close()
+        assert gitindex.tree_id('.git/idx2') == exp
+
+
+# -----------------------------------------------------------------------------
+def test_tree_id_unsupported(tmpdir):
+    """
+    Indexes we can't handle give None
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    with chdir(td):
+        make_tree(td)
+
+        open('new.txt', 'w').write('new\n')
+        ghlib.catch_stdout('git add -N new.txt')
+        index = gitindex.Index('.git/index')
+        assert not index.writable
+        index.close()
+        assert gitindex.tree_id('.git/index') is None
+
+
+# -----------------------------------------------------------------------------
+@pytest.mark.parametrize('how', ['split', 'size'])
+def test_load_declined(tmpdir, monkeypatch, how):
+    """
+    A split index, or one bigger than MAX_BYTES, isn't read here, and the
+    hooks get their answers from git instead
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    with chdir(td):
+        make_tree(td)
+        os.mkdir('pkg')
+        open('pkg/version.py', 'w').write('__version__ = "1.2.3"\n')
+        if how == 'split':
+            ghlib.catch_stdout('git config core.splitIndex true')
+            ghlib.catch_stdout('git update-index --split-index')
+        else:
+            monkeypatch.setattr(gitindex, 'MAX_BYTES', 100)
+        ghlib.catch_stdout('git add pkg/version.py')
+        assert gitindex.load('.git/index') is None
+        assert gitindex.tree_id('.git/index') is None
+        assert ghlib.index_oid('pkg/version.py') is None
+        assert ghlib.version_indexed([''], []) is None
+        vpath = ghlib.get_version_path()
+        assert vpath == os.path.join(td, 'pkg', 'version.py')
+        assert dispatch.version_staged(vpath)
+        parts = ghlib.change_id_parts()
+        assert parts[0] == write_tree()
+
+
+# -----------------------------------------------------------------------------
+def test_tree_id_change_id(tmpdir, monkeypatch):
+    """
+    get_change_id uses the index, honoring $GIT_INDEX_FILE, and doesn't run
+    git write-tree
+    """
+    pytest.dbgfunc()
+    monkeypatch.setenv('GIT_AUTHOR_DATE', '1234567890 +0000')
+    monkeypatch.setenv('GIT_COMMITTER_DATE', '1234567890 +0000')
+    td = str(tmpdir)
+    with chdir(td):
+        make_tree(td)
+        parts = ghlib.change_id_parts()
+        exp = ghlib.change_id_for(*(parts + (['msg'],)))
+        ghlib.catch_stdout('cp .git/index .git/other')
+        ghlib.catch_stdout('git rm -q --cached a.txt')
+        monkeypatch.setenv('GIT_INDEX_FILE', os.path.join(td, '.git/other'))
+
+        def no_write_tree(cmd, input=None):
+            assert 'write-tree' not in cmd
+            return real(cmd, input=input)
+        real = ghlib.catch_stdout
+        monkeypatch.setattr(ghlib, 'catch_stdout', no_write_tree)
+        assert ghlib.get_change_id(['msg']) == exp
+
+
+# -----------------------------------------------------------------------------
+@pytest.mark.parametrize('version', [2, 3, 4])
+def test_index_lookup(tmpdir, version):
+    """
+    Index should find entries by path, including long paths and paths in
+    a version 4 index, and agree with git ls-files about the blob ids
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    with chdir(td):
+        make_tree(td)
+        # Too long for the file system, and for the 12 bit length field
+        deep = '/'.join(['d%03d' % n for n in range(900)]) + '/long.txt'
+        blob = ghlib.catch_stdout('git hash-object -w --stdin', input='x\n')
+        r = ghlib.catch_stdout('git update-index --add --cacheinfo '
+                               '100644,%s,%s' % (blob.strip(), deep))
+        assert not r.startswith('ERR:')
+        if version == 3:
+            ghlib.catch_stdout('git update-index --skip-worktree z.txt')
+        ghlib.catch_stdout('git update-index --index-version %d' % version)
+
+        index = gitindex.Index('.git/index')
+        assert index.version == version
+        assert index.writable
+        exp = {}
+        for line in ghlib.catch_stdout('git ls-files -s').split('\n')[:-1]:
+            (meta, path) = line.split('\t')
+            exp[path] = meta.split()
+        assert sorted(exp.keys()) == [e.path for e in index]
+        for (path, (mode, oid, stage)) in exp.items():
+            entry = index.lookup(path)
+            assert (oct(entry.mode)[-6:], entry.hexoid, entry.stage) == \
+                (mode, oid, int(stage))
+        assert index.lookup('a') is None
+        assert index.lookup('zz') is None
+        assert list(index.prefixed('a/')) == ['a/b-c.txt', 'a/b/c.txt',
+                                              'a/d/e/f.txt']
+        index.close()
+        assert gitindex.tree_id('.git/index') == write_tree()
+
+
+# -----------------------------------------------------------------------------
+def test_index_conflict(tmpdir):
+    """
+    A conflicted path has several entries; lookup gives the first, and
+    tree_id declines
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    with chdir(td):
+        make_tree(td)
+        ghlib.catch_stdout('git checkout -q -b side')
+        open('a.txt', 'w').write('side\n')
+        ghlib.catch_stdout('git commit -q -a -m side')
+        ghlib.catch_stdout('git checkout -q -')
+        open('a.txt', 'w').write('main\n')
+        ghlib.catch_stdout('git commit -q -a -m main')
+        ghlib.catch_stdout('git merge side')
+        index = gitindex.Index('.git/index')
+        assert index.lookup('a.txt').stage == 1
+        assert not index.writable
+        assert list(index.prefixed('a.')) == ['a.txt']
+        index.close()
+        assert gitindex.tree_id('.git/index') is None
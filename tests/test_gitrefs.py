@@ -0,0 +1,176 @@
+"""
+Tests for gitrefs
+"""
+from conftest import chdir
+from githooks import ghlib
+from githooks import gitrefs
+import os
+import pytest
+
+
+# -----------------------------------------------------------------------------
+def make_repo(count=3):
+    """
+    Init a repo in the current directory with *count* commits
+    """
+    ghlib.catch_stdout('git init')
+    for n in range(count):
+        open('file', 'w').write('%d\n' % n)
+        ghlib.catch_stdout('git add file')
+        ghlib.catch_stdout('git commit -m "commit %d"' % n)
+
+
+# -----------------------------------------------------------------------------
+def rev_parse(*args):
+    """
+    Return the lines 'git rev-parse' prints for *args*
+    """
+    return ghlib.catch_stdout('git rev-parse ' + ' '.join(args)).split()
+
+
+# -----------------------------------------------------------------------------
+def test_discover(tmpdir):
+    """
+    discover should find the repo from its subdirectories and report ('',
+    '') outside one
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    with chdir(td):
+        assert gitrefs.discover() == ('', '')
+        make_repo(1)
+        os.makedirs('sub/dir')
+        exp = (os.path.realpath(td), os.path.join(os.path.realpath(td), '.git'))
+        assert gitrefs.discover() == exp
+        with chdir('sub/dir'):
+            assert gitrefs.discover() == exp
+        ghlib.catch_stdout('git config core.worktree %s' % td)
+        assert gitrefs.discover() is None
+
+
+# -----------------------------------------------------------------------------
+def test_resolve(tmpdir):
+    """
+    resolve should follow HEAD through loose and packed refs the way git
+    rev-parse does, and report None on an unborn branch
+    """
+    pytest.dbgfunc()
+    with chdir(str(tmpdir)):
+        ghlib.catch_stdout('git init')
+        assert gitrefs.resolve('.git') is None
+        make_repo()
+        assert gitrefs.resolve('.git') == rev_parse('HEAD')[0]
+        ghlib.catch_stdout('git pack-refs --all --prune')
+        assert not os.path.exists('.git/refs/heads/master')
+        assert gitrefs.resolve('.git') == rev_parse('HEAD')[0]
+        ghlib.catch_stdout('git checkout -q -b topic HEAD~1')
+        assert gitrefs.resolve('.git') == rev_parse('HEAD~0')[0]
+        assert gitrefs.resolve('.git', 'refs/heads/topic') == \
+            rev_parse('topic')[0]
+        ghlib.catch_stdout('git checkout -q --detach HEAD~1')
+        assert gitrefs.read_ref('.git', 'HEAD') == rev_parse('HEAD')[0]
+        assert gitrefs.resolve('.git', 'refs/heads/nosuch') is None
+
+
+# -----------------------------------------------------------------------------
+def test_worktree(tmpdir):
+    """
+    In a linked worktree, HEAD should come from the worktree's git dir and
+    branches and tags from the main one, and repo_facts should agree with
+    git
+    """
+    pytest.dbgfunc()
+    main = tmpdir.join('main')
+    main.ensure(dir=True)
+    with chdir(str(main)):
+        make_repo()
+        ghlib.catch_stdout('git tag -a v1.0 -m v1.0 HEAD~1')
+        ghlib.catch_stdout('git worktree add -q ../wt HEAD~2')
+    with chdir(str(tmpdir.join('wt'))):
+        (toplevel, gitdir) = gitrefs.discover()
+        assert [toplevel, gitdir, gitrefs.resolve(gitdir)] == \
+            rev_parse('--show-toplevel', '--git-dir', 'HEAD')
+        assert gitrefs.common_dir(gitdir) == \
+            os.path.join(os.path.realpath(str(main)), '.git')
+        assert list(gitrefs.tags(gitdir)) == ['v1.0']
+        facts = ghlib.repo_facts()
+        assert [facts.toplevel, facts.gitdir, facts.head.strip()] == \
+            rev_parse('--show-toplevel', '--git-dir', 'HEAD')
+
+
+# -----------------------------------------------------------------------------
+def test_git_dir(tmpdir, monkeypatch):
+    """
+    $GIT_DIR should name the git dir, with the current directory as the top
+    of the working tree unless $GIT_WORK_TREE says otherwise
+    """
+    pytest.dbgfunc()
+    repo = tmpdir.join('repo')
+    repo.ensure(dir=True)
+    with chdir(str(repo)):
+        make_repo()
+    elsewhere = os.path.realpath(str(tmpdir))
+    with chdir(elsewhere):
+        monkeypatch.setenv('GIT_DIR', str(repo.join('.git')))
+        assert gitrefs.discover() == (elsewhere, str(repo.join('.git')))
+        assert gitrefs.resolve(str(repo.join('.git'))) == \
+            rev_parse('HEAD')[0]
+        monkeypatch.setenv('GIT_WORK_TREE', str(repo))
+        assert gitrefs.discover()[0] == os.path.realpath(str(repo))
+
+
+# -----------------------------------------------------------------------------
+def test_packed_refs_cached(tmpdir, monkeypatch):
+    """
+    packed-refs should be parsed once and again only after it changes
+    """
+    pytest.dbgfunc()
+    with chdir(str(tmpdir)):
+        make_repo()
+        ghlib.catch_stdout('git tag -a v1.0 -m v1.0 HEAD~1')
+        ghlib.catch_stdout('git pack-refs --all')
+        reads = []
+        real = gitrefs.read
+
+        def counted(path):
+            if path.endswith('packed-refs'):
+                reads.append(path)
+            return real(path)
+        monkeypatch.setattr(gitrefs, 'read', counted)
+        (refs, peeled, fully) = gitrefs.packed_refs('.git')
+        assert fully
+        assert peeled['refs/tags/v1.0'] == rev_parse('HEAD~1')[0]
+        gitrefs.packed_refs('.git')
+        assert len(reads) == 1
+
+        ghlib.catch_stdout('git tag -a v2.0 -m v2.0 HEAD')
+        ghlib.catch_stdout('git pack-refs --all')
+        assert 'refs/tags/v2.0' in gitrefs.packed_refs('.git')[0]
+        assert len(reads) == 2
+
+
+# -----------------------------------------------------------------------------
+def test_annotated_tags(tmpdir):
+    """
+    annotated_tags, reading the refs itself, should find the same annotated
+    tags as git for-each-ref, packed or loose, and skip lightweight ones
+    """
+    pytest.dbgfunc()
+    with chdir(str(tmpdir)):
+        make_repo(4)
+        ghlib.catch_stdout('git tag -a v1.0 -m v1.0 HEAD~3')
+        ghlib.catch_stdout('git tag -a v1.1 -m v1.1 HEAD~1')
+        ghlib.catch_stdout('git tag light HEAD~2')
+        ghlib.catch_stdout('git pack-refs --all')
+        ghlib.catch_stdout('git tag -a v2.0 -m v2.0 HEAD')
+        ghlib.catch_stdout('git tag light2 HEAD')
+        r = ghlib.catch_stdout("git for-each-ref --format='%(refname:short) "
+                               "%(*objectname)' refs/tags")
+        exp = {}
+        for line in r.strip().split('\n'):
+            f = line.split()
+            if 1 < len(f):
+                exp[f[1]] = [f[0]]
+        assert len(exp) == 3
+        got = ghlib.annotated_tags()
+        assert dict((k, [n for (w, n) in v]) for (k, v) in got.items()) == exp
@@ -0,0 +1,21 @@
+"""
+Check the hooks against the saved benchmark baseline
+"""
+from githooks import ghlib
+import pytest
+import sys
+
+
+# -----------------------------------------------------------------------------
+def test_hookbench_baseline(tmpdir):
+    """
+    Run bench/hookbench.py --check against bench/baseline.json. Times and
+    memory use vary between hosts, so the tolerance leaves only the git
+    process counts and exit statuses to compare.
+    """
+    pytest.dbgfunc()
+    cmd = ('%s bench/hookbench.py -r 1 --tolerance 1000 '
+           '--check bench/baseline.json' % sys.executable)
+    result = ghlib.catch_stdout(cmd)
+    assert 'REGRESSION' not in result
+    assert not result.startswith('ERR:')
@@ -86,3 +86,133 @@ def test_pcv_2_updated_staged(tmpdir):
         result = ghlib.catch_stdout(cmd)
 
         assert '' in result
+
+
+def test_pcv_3_index_not_staged(tmpdir, monkeypatch):
+    """
+    In index mode, an updated but unstaged version.py is reported as not
+    staged
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    cmd = os.path.abspath(os.path.join('.', 'githooks', 'pre-commit.ver'))
+    monkeypatch.setenv('GITHOOKS_VERSION_SOURCE', 'index')
+
+    with chdir(td):
+        tag = "2013.1015"
+        z = ghlib.catch_stdout('git init')
+
+        v = editor.editor('version.py', ['__version__ = "%s"' % tag])
+        v.quit(save=True)
+
+        z = ghlib.catch_stdout('git add version.py')
+        z = ghlib.catch_stdout('git commit -m inception')
+        z = ghlib.catch_stdout('git tag -a -m "version basis" %s' % tag)
+
+        v = editor.editor('version.py')
+        v.sub('1015', '1015.1')
+        v.quit(save=True)
+
+        result = ghlib.catch_stdout(cmd)
+        assert 'is not staged. Looks like you need' in result
+
+
+def test_pcv_4_index_staged(tmpdir, monkeypatch):
+    """
+    In index mode, the staged version is checked even if the working tree
+    copy has changed since it was staged
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    cmd = os.path.abspath(os.path.join('.', 'githooks', 'pre-commit.ver'))
+    monkeypatch.setenv('GITHOOKS_VERSION_SOURCE', 'index')
+
+    with chdir(td):
+        tag = "2013.1015"
+        z = ghlib.catch_stdout('git init')
+
+        v = editor.editor('version.py', ['__version__ = "%s"' % tag])
+        v.quit(save=True)
+
+        z = ghlib.catch_stdout('git add version.py')
+        z = ghlib.catch_stdout('git commit -m inception')
+        z = ghlib.catch_stdout('git tag -a -m "version basis" %s' % tag)
+
+        v = editor.editor('version.py')
+        v.sub('1015', '1015.1')
+        v.quit(save=True)
+        z = ghlib.catch_stdout('git add version.py')
+
+        v = editor.editor('version.py')
+        v.sub('1015.1', '1015.7')
+        v.quit(save=True)
+
+        result = ghlib.catch_stdout(cmd)
+        assert result == ''
+
+        z = ghlib.catch_stdout('git add version.py')
+
+        result = ghlib.catch_stdout(cmd)
+        assert 'Looks like version.py should contain 2013.1015.1' in result
+
+
+def test_pcv_5_first_commit(tmpdir):
+    """
+    With no commits yet, a staged version.py counts as staged and one that's
+    only in the working tree doesn't, even if a similarly named file is
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    cmd = os.path.abspath(os.path.join('.', 'githooks', 'pre-commit.ver'))
+
+    with chdir(td):
+        z = ghlib.catch_stdout('git init')
+        v = editor.editor('version.py', ['__version__ = "2013.1015"'])
+        v.quit(save=True)
+        open('old_version.py', 'w').close()
+        z = ghlib.catch_stdout('git add old_version.py')
+
+        result = ghlib.catch_stdout(cmd)
+        assert 'is not staged. Looks like you need' in result
+
+        z = ghlib.catch_stdout('git add version.py')
+        result = ghlib.catch_stdout(cmd)
+        assert result == ''
+
+
+def test_pcv_6_changed_after_staging(tmpdir):
+    """
+    By default the working tree version is checked, so a version.py changed
+    since it was staged is reported as not staged, even if the working tree
+    version would pass
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    cmd = os.path.abspath(os.path.join('.', 'githooks', 'pre-commit.ver'))
+
+    with chdir(td):
+        tag = "2013.1015"
+        z = ghlib.catch_stdout('git init')
+
+        v = editor.editor('version.py', ['__version__ = "%s"' % tag])
+        v.quit(save=True)
+
+        z = ghlib.catch_stdout('git add version.py')
+        z = ghlib.catch_stdout('git commit -m inception')
+        z = ghlib.catch_stdout('git tag -a -m "version basis" %s' % tag)
+
+        v = editor.editor('version.py')
+        v.sub('1015', '1015.7')
+        v.quit(save=True)
+        z = ghlib.catch_stdout('git add version.py')
+
+        v = editor.editor('version.py')
+        v.sub('1015.7', '1015.1')
+        v.quit(save=True)
+
+        result = ghlib.catch_stdout(cmd)
+        assert 'is not staged. Looks like you need' in result
+
+        z = ghlib.catch_stdout('git add version.py')
+        result = ghlib.catch_stdout(cmd)
+        assert result == ''
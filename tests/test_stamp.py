@@ -0,0 +1,79 @@
+"""
+Tests for stamp.py
+"""
+from conftest import chdir
+from githooks import ghlib
+from githooks import stamp
+import os
+import pytest
+import sys
+
+STAMP = os.path.abspath(os.path.join('githooks', 'stamp.py'))
+
+
+# -----------------------------------------------------------------------------
+def make_history(td):
+    """
+    Make a repo in *td* with three commits, bumping version.py in each. The
+    second already has its trailers.
+    """
+    ghlib.catch_stdout('git init')
+    msgs = ['first\n',
+            'second\n\nVersion:   2015.0820.1\n'
+            'Change-Id: Ia9c0832881fadc61e6511826f4112df72525f1e8\n',
+            'third\n\nwith a body\n']
+    for (n, msg) in enumerate(msgs):
+        open('version.py', 'w').write('__version__ = "2015.0820.%d"\n' % n)
+        ghlib.catch_stdout('git add version.py')
+        ghlib.catch_stdout('git commit -F -', input=msg)
+
+
+# -----------------------------------------------------------------------------
+def log_messages():
+    """
+    Return the messages of the commits on HEAD, oldest first
+    """
+    r = ghlib.catch_stdout('git log --reverse --format=%B%x00')
+    return [x.strip('\n') for x in r.split('\0')[:-1]]
+
+
+# -----------------------------------------------------------------------------
+def test_stamp_range(tmpdir):
+    """
+    stamp.py should add trailers to the commits that lack them, with the
+    version as committed, re-parent the rest, and move HEAD
+    """
+    pytest.dbgfunc()
+    td = str(tmpdir)
+    with chdir(td):
+        make_history(td)
+        tree = ghlib.catch_stdout('git rev-parse HEAD^{tree}')
+        before = ghlib.catch_stdout('git rev-list HEAD').split()
+        r = ghlib.catch_stdout('%s %s --update HEAD' % (sys.executable,
+                                                        STAMP))
+        assert len(r.strip().split('\n')) == 3
+        assert ghlib.catch_stdout('git rev-parse HEAD^{tree}') == tree
+        after = ghlib.catch_stdout('git rev-list HEAD').split()
+        assert len(after) == 3
+        assert not set(before) & set(after)
+
+        msgs = log_messages()
+        assert msgs[0].split('\n')[:3] == ['first', '',
+                                           'Version:   2015.0820.0']
+        assert msgs[0].split('\n')[3].startswith('Change-Id: I')
+        assert msgs[1] == ('second\n\nVersion:   2015.0820.1\n'
+                           'Change-Id: Ia9c0832881fadc61e6511826f4112df72525f1e8')
+        assert msgs[2].split('\n')[:4] == ['third', '', 'with a body', '']
+        assert msgs[2].split('\n')[4] == 'Version:   2015.0820.2'
+
+        root = ghlib.cat_file(after[-1])
+        fields = dict([l.split(' ', 1) for l in root.split('\n\n')[0]
+                       .split('\n')])
+        exp = ghlib.change_id_for(fields['tree'], None, fields['author'],
+                                  fields['committer'], ['first'])
+        assert exp.strip() in msgs[0]
+
+        r = ghlib.catch_stdout('%s %s --update HEAD' % (sys.executable,
+                                                        STAMP))
+        assert r == ''
+
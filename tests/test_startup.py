@@ -0,0 +1,72 @@
+"""
+Keep hook startup cheap. Every hook imports dispatch (and through it
+ghlib) on every commit, so modules that only some runs need must be imported
+where they're used.
+"""
+from githooks import ghlib
+import json
+import os
+import pytest
+import sys
+import time
+
+# Modules the hooks must not load just by starting up
+LAZY = ['calendar', 'fnmatch', 'hashlib', 'json', 'optparse', 'pdb', 'shlex',
+        'StringIO', 'subprocess']
+
+# Most modules importing dispatch may load, counting the standard library
+# modules it pulls in (Python 3 loads more of those than Python 2)
+MODULE_BUDGET = 30
+
+
+# -----------------------------------------------------------------------------
+def importtime(module):
+    """
+    Run bench/importtime.py on *module* and return its report
+    """
+    cmd = '%s bench/importtime.py --json -n 3 %s' % (sys.executable, module)
+    result = ghlib.catch_stdout(cmd)
+    assert not result.startswith('ERR:')
+    return json.loads(result)
+
+
+# -----------------------------------------------------------------------------
+def bare_startup_ms(runs=3):
+    """
+    Return the best wall time, in milliseconds, of *runs* starts of an
+    interpreter that does nothing
+    """
+    times = []
+    for i in range(runs):
+        start = time.time()
+        ghlib.catch_stdout('%s -c pass' % sys.executable)
+        times.append(time.time() - start)
+    return 1000.0 * min(times)
+
+
+# -----------------------------------------------------------------------------
+def test_startup_budget(tmpdir):
+    """
+    Importing dispatch must load no more than MODULE_BUDGET modules and take
+    less time than starting a bare interpreter, so a hook's imports never
+    cost more than the interpreter it runs in, however fast the host is.
+    $GITHOOKS_IMPORT_BUDGET_MS, if set, is a tighter budget in milliseconds.
+    """
+    pytest.dbgfunc()
+    r = importtime('dispatch')
+    assert len(r['loaded']) <= MODULE_BUDGET
+    budget = bare_startup_ms()
+    if os.getenv('GITHOOKS_IMPORT_BUDGET_MS'):
+        budget = min(budget, float(os.getenv('GITHOOKS_IMPORT_BUDGET_MS')))
+    assert r['total_ms'] < budget
+
+
+# -----------------------------------------------------------------------------
+def test_startup_lazy(tmpdir):
+    """
+    Importing dispatch must not load modules only some hook runs need
+    """
+    pytest.dbgfunc()
+    r = importtime('dispatch')
+    assert 'ghlib' in r['loaded']
+    assert [m for m in LAZY if m in r['loaded']] == []
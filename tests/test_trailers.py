@@ -0,0 +1,93 @@
+"""
+Tests for trailers.py
+"""
+from conftest import chdir
+from githooks import ghlib
+from githooks import trailers
+import os
+import pytest
+import sys
+
+TRAILERS = os.path.abspath(os.path.join('githooks', 'trailers.py'))
+
+
+# -----------------------------------------------------------------------------
+def commit(msg):
+    """
+    Make an empty commit with message *msg* and return its id
+    """
+    ghlib.catch_stdout('git commit --allow-empty -F -', input=msg)
+    return ghlib.rev_parse('HEAD').strip()
+
+
+# -----------------------------------------------------------------------------
+def test_trailers(tmpdir):
+    """
+    trailers.py should find commits by Change-Id or Version, reading only
+    the commits added since the last update
+    """
+    pytest.dbgfunc()
+    with chdir(str(tmpdir)):
+        ghlib.catch_stdout('git init')
+        first = commit('first\n\nVersion:   1.0.1\n'
+                       'Change-Id: I0123456789abcdef0123456789abcdef01234567\n')
+        commit('plain\n')
+        (rc, o, e) = ghlib.catch_all('%s %s' % (sys.executable, TRAILERS))
+        assert (rc, o, e) == (0, '', 'trailers: indexed 2 commits\n')
+        assert os.path.exists(os.path.join('.git', trailers.INDEX_NAME))
+
+        ghlib.catch_stdout('git checkout -q -b side')
+        side = commit('side\n\nVersion:   1.0.1\n')
+        ghlib.catch_stdout('git checkout -q master')
+        third = commit('third\n\nVersion:   1.0.2\n'
+                       'Change-Id: Ifedcba9876543210fedcba9876543210fedcba98\n')
+        (rc, o, e) = ghlib.catch_all('%s %s' % (sys.executable, TRAILERS))
+        assert e == 'trailers: indexed 2 commits\n'
+
+        r = ghlib.catch_stdout('%s %s 1.0.1 '
+                               'Ifedcba9876543210fedcba9876543210fedcba98' %
+                               (sys.executable, TRAILERS))
+        assert sorted(r.strip().split('\n')) == sorted([
+            '%s Version: 1.0.1' % first,
+            '%s Version: 1.0.1' % side,
+            '%s Change-Id: Ifedcba9876543210fedcba9876543210fedcba98' %
+            third])
+
+
+# -----------------------------------------------------------------------------
+def test_trailer_rows():
+    """
+    trailer_rows should pick out the trailers split_msg finds
+    """
+    pytest.dbgfunc()
+    commits = [('a' * 40, [], ['subject', '', 'Version:   2015.0820.3',
+                               'Change-Id: I' + '1' * 40]),
+               ('b' * 40, ['a' * 40], ['subject', '', 'Version:']),
+               ('c' * 40, ['b' * 40], ['just a subject'])]
+    seen = []
+    assert list(trailers.trailer_rows(commits, seen)) == [
+        ('Change-Id', 'I' + '1' * 40, 'a' * 40),
+        ('Version', '2015.0820.3', 'a' * 40)]
+    assert seen == ['a' * 40, 'b' * 40, 'c' * 40]
+
+
+# -----------------------------------------------------------------------------
+def test_tips_replaced(tmpdir):
+    """
+    Each update should record only the tips it indexed up to, so the list
+    doesn't grow with every run
+    """
+    pytest.dbgfunc()
+    with chdir(str(tmpdir)):
+        ghlib.catch_stdout('git init')
+        index = trailers.TrailerIndex(os.path.join('.git',
+                                                   trailers.INDEX_NAME))
+        try:
+            for n in range(6):
+                commit('commit %d\n\nVersion:   1.0.%d\n' % (n, n))
+                assert index.update('HEAD') == 1
+                assert index.tips() == [ghlib.rev_parse('HEAD').strip()]
+            assert index.update('HEAD') == 0
+            assert len(index.find('1.0.3')) == 1
+        finally:
+            index.close()